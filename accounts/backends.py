@@ -0,0 +1,45 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.db.models import Q
+from .models import UserProfile, normalize_email
+
+
+def users_matching(identifier):
+    """
+    Users whose username is ``identifier`` or whose email matches it ignoring case.
+
+    Both conditions are served by unique indexes: auth_user.username and
+    accounts_userprofile.email_normalized.
+    """
+    condition = Q(username=identifier)
+    if '@' in identifier:
+        emails = UserProfile.objects.filter(email_normalized=normalize_email(identifier))
+        condition |= Q(pk__in=emails.values('user_id'))
+    return User.objects.filter(condition)
+
+
+def find_user(identifier):
+    """The user with ``identifier`` as username or email, in one query. A username match wins."""
+    identifier = (identifier or '').strip()
+    if not identifier:
+        return None
+    users = sorted(users_matching(identifier)[:2], key=lambda user: user.username != identifier)
+    return users[0] if users else None
+
+
+class EmailOrUsernameBackend(ModelBackend):
+    """Authenticates with a username or an email address"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = find_user(username)
+        if user is None:
+            # Hash anyway, so response times don't reveal which accounts exist
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -1,7 +1,17 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, normalize_email
+
+
+def check_email_available(email, user=None):
+    """Reject an email address that another account already uses, ignoring case"""
+    taken = UserProfile.objects.filter(email_normalized=normalize_email(email))
+    if user is not None and user.pk:
+        taken = taken.exclude(user=user)
+    if taken.exists():
+        raise forms.ValidationError('An account with this email address already exists.')
+    return email
 
 class SignUpForm(UserCreationForm):
     email = forms.EmailField(required=True, widget=forms.EmailInput(attrs={
@@ -27,6 +37,9 @@ class SignUpForm(UserCreationForm):
             }),
         }
     
+    def clean_email(self):
+        return check_email_available(self.cleaned_data['email'])
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['password1'].widget.attrs.update({
@@ -54,6 +67,9 @@ class UserProfileForm(forms.ModelForm):
 
 class UserUpdateForm(forms.ModelForm):
     email = forms.EmailField(required=True)
+
+    def clean_email(self):
+        return check_email_available(self.cleaned_data['email'], self.instance)
     
     class Meta:
         model = User
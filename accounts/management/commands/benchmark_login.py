@@ -0,0 +1,88 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.backends import find_user, users_matching
+from accounts.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Time login lookups against synthetic users (everything is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help='Number of users to generate (default: 1000000)')
+        parser.add_argument('--lookups', type=int, default=1000, help='Lookups timed per method (default: 1000)')
+        parser.add_argument('--logins', type=int, default=20, help='Full logins timed, including password hashing (default: 20)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def run(self, options):
+        count = options['users']
+        started = time.perf_counter()
+        self.create_users(count)
+        self.stdout.write(f'Generated {count} users in {time.perf_counter() - started:.1f}s')
+
+        picks = [random.randrange(count) for _ in range(options['lookups'])]
+        # Emails are typed with varying case, usernames exactly
+        self.time_lookups('email lookup', [f'Benchmark-Login-{i}@Example.com' for i in picks], find_user)
+        self.time_lookups('username lookup', [f'benchmark-login-{i}' for i in picks], find_user)
+        self.time_lookups('unknown email', [f'nobody-{i}@example.com' for i in picks], find_user)
+        self.time_lookups(
+            'previous email__iexact scan', [f'Benchmark-Login-{i}@Example.com' for i in picks[:20]],
+            lambda email: User.objects.filter(email__iexact=email).first(),
+        )
+        self.time_lookups(
+            'full login', [f'benchmark-login-{i}@example.com' for i in picks[:options['logins']]],
+            lambda email: authenticate(username=email, password='benchmark-password'),
+        )
+
+        with connection.cursor() as cursor:
+            sql, params = users_matching('benchmark-login-1@example.com').query.sql_with_params()
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f'  plan: {row[-1]}')
+
+    def time_lookups(self, label, identifiers, lookup):
+        timings = []
+        # The query log is capped, and generating the users filled it
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            for identifier in identifiers:
+                started = time.perf_counter()
+                lookup(identifier)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        self.stdout.write(
+            f'{label}: {len(timings)} runs, median {statistics.median(timings):.3f}ms, '
+            f'p95 {p95:.3f}ms, {len(queries) / len(timings):.1f} queries each'
+        )
+
+    def create_users(self, count):
+        """Every user shares one password hash, so generating them doesn't hash a million times"""
+        password = make_password('benchmark-password')
+        batch_size = 5000
+        for start in range(0, count, batch_size):
+            users = User.objects.bulk_create([
+                User(username=f'benchmark-login-{i}', email=f'benchmark-login-{i}@example.com', password=password)
+                for i in range(start, min(start + batch_size, count))
+            ])
+            if not users or users[0].pk is None:
+                users = list(User.objects.filter(
+                    username__in=[user.username for user in users]
+                ).only('pk', 'email'))
+            UserProfile.objects.bulk_create([
+                UserProfile(user_id=user.pk, email_normalized=user.email.lower()) for user in users
+            ])
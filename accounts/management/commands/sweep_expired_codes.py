@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import EmailVerificationCode, PasswordResetCode
+
+
+class Command(BaseCommand):
+    help = 'Delete password reset and email verification codes that expired unused. Run hourly.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement (default: 1000)')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        for model in (PasswordResetCode, EmailVerificationCode):
+            deleted = 0
+            while True:
+                # Small deletes keep each write lock short; expires_at is indexed
+                batch = list(model.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:options['batch_size']])
+                if not batch:
+                    break
+                deleted += model.objects.filter(pk__in=batch).delete()[0]
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired {model._meta.verbose_name_plural}'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:13
+
+from django.db import migrations, models
+
+
+def backfill_normalized_emails(apps, schema_editor):
+    """Create missing profiles and fill normalized emails; the oldest account keeps a shared email"""
+    User = apps.get_model('auth', 'User')
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id) for user_id in User.objects.filter(profile__isnull=True).values_list('pk', flat=True)],
+        batch_size=1000,
+    )
+
+    seen = set()
+    profiles = []
+    for profile_id, email in UserProfile.objects.order_by('user_id').values_list('pk', 'user__email').iterator():
+        email = (email or '').strip().lower()
+        if email and email not in seen:
+            seen.add(email)
+            profiles.append(UserProfile(pk=profile_id, email_normalized=email))
+    UserProfile.objects.bulk_update(profiles, ['email_normalized'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_emailverificationcode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='email_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=254, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_normalized_emails, migrations.RunPython.noop),
+    ]
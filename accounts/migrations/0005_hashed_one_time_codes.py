@@ -0,0 +1,112 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:40
+
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def hash_pending_codes(apps, schema_editor):
+    """Keep each user's newest usable code, hashed, and drop every other code"""
+    now = django.utils.timezone.now()
+    for model_name in ('PasswordResetCode', 'EmailVerificationCode'):
+        model = apps.get_model('accounts', model_name)
+        keep = {}
+        for code in model.objects.filter(is_used=False, expires_at__gt=now).order_by('created_at'):
+            keep[code.user_id] = code
+        model.objects.exclude(pk__in=[code.pk for code in keep.values()]).delete()
+        for code in keep.values():
+            message = f'accounts.{model_name}:{code.user_id}:{code.code}'.encode()
+            code.code_hash = hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+        model.objects.bulk_update(keep.values(), ['code_hash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0004_userprofile_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passwordresetcode',
+            name='code_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='passwordresetcode',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='emailverificationcode',
+            name='code_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='emailverificationcode',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(hash_pending_codes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='passwordresetcode',
+            name='code',
+        ),
+        migrations.RemoveField(
+            model_name='passwordresetcode',
+            name='is_used',
+        ),
+        migrations.RemoveField(
+            model_name='emailverificationcode',
+            name='code',
+        ),
+        migrations.RemoveField(
+            model_name='emailverificationcode',
+            name='is_used',
+        ),
+        migrations.AlterModelOptions(
+            name='passwordresetcode',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='emailverificationcode',
+            options={},
+        ),
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='passwordresetcode',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='emailverificationcode',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='emailverificationcode',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='emailverificationcode',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -1,11 +1,27 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
-import random
+from datetime import timedelta
+import hashlib
+import hmac
+import logging
+import secrets
 import string
 
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email):
+    """The form of an email address used for lookups, or None for a blank address"""
+    email = (email or '').strip().lower()
+    return email or None
+
+
 class UserProfile(models.Model):
     ROLE_CHOICES = (
         ('customer', 'Customer'),
@@ -21,11 +37,19 @@ class UserProfile(models.Model):
     zip_code = models.CharField(max_length=20, blank=True)
     country = models.CharField(max_length=100, blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
+    # Lowercased copy of user.email, unique and indexed for email logins
+    email_normalized = models.CharField(max_length=254, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.user.username} - {self.role}"
+
+    class Meta:
+        indexes = [
+            # Keyset pages of the dashboard customer list, see core.pagination
+            models.Index(fields=['role', 'created_at', 'id'], name='accounts_customer_list_idx'),
+        ]
     
     @property
     def is_admin(self):
@@ -35,73 +59,129 @@ class UserProfile(models.Model):
     def is_customer(self):
         return self.role == 'customer'
 
+    def sync_email(self):
+        """Copy the user's normalized email, unless another account already uses it"""
+        email = normalize_email(self.user.email)
+        if email and UserProfile.objects.filter(email_normalized=email).exclude(pk=self.pk).exists():
+            logger.warning(f"Email {email} of user {self.user.username} is already used by another account")
+            email = None
+        self.email_normalized = email
+
 # Create UserProfile automatically when User is created
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
+        profile = UserProfile(user=instance)
+        profile.sync_email()
+        profile.save()
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save only last_login, which the profile does not depend on
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    if not created and hasattr(instance, 'profile'):
+        instance.profile.sync_email()
         instance.profile.save()
 
 
-class PasswordResetCode(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    code = models.CharField(max_length=6)
-    created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
-    is_used = models.BooleanField(default=False)
-    
-    def save(self, *args, **kwargs):
-        if not self.code:
-            self.code = self.generate_code()
-        if not self.expires_at:
-            # Code expires in 15 minutes
-            self.expires_at = timezone.now() + timezone.timedelta(minutes=15)
-        super().save(*args, **kwargs)
-    
-    def generate_code(self):
+class CodeRateLimited(Exception):
+    """Raised when a user asks for more codes than ``OneTimeCode.RATE_LIMIT`` allows"""
+
+
+class OneTimeCode(models.Model):
+    """
+    A 6-digit code emailed to a user, stored as an HMAC of the code.
+
+    Each user has at most one code of a kind, so issuing a new code replaces the
+    previous one and checking a code is a lookup on the unique ``user`` index.
+    A used code is deleted, and a code is also deleted after ``MAX_ATTEMPTS``
+    wrong guesses. ``manage.py sweep_expired_codes`` deletes codes that expired
+    without being used.
+    """
+    VALID = 'valid'
+    INVALID = 'invalid'
+    EXPIRED = 'expired'
+
+    LIFETIME = timedelta(minutes=15)
+    MAX_ATTEMPTS = 5
+    # At most RATE_LIMIT codes per user within RATE_WINDOW, counted in the cache
+    RATE_LIMIT = 3
+    RATE_WINDOW = timedelta(minutes=5)
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    code_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def generate_code():
         """Generate a 6-digit numeric code"""
-        return ''.join(random.choices(string.digits, k=6))
-    
-    def is_valid(self):
-        """Check if code is still valid (not expired and not used)"""
-        return not self.is_used and timezone.now() < self.expires_at
-    
+        return ''.join(secrets.choice(string.digits) for _ in range(6))
+
+    @classmethod
+    def hash_code(cls, user, code):
+        message = f'{cls._meta.label}:{user.pk}:{code}'.encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    @classmethod
+    def check_rate_limit(cls, user):
+        key = f'accounts:codes:{cls._meta.label_lower}:{user.pk}'
+        if cache.add(key, 1, int(cls.RATE_WINDOW.total_seconds())):
+            return
+        try:
+            issued = cache.incr(key)
+        except ValueError:
+            # The window ran out since add()
+            cache.set(key, 1, int(cls.RATE_WINDOW.total_seconds()))
+            return
+        if issued > cls.RATE_LIMIT:
+            raise CodeRateLimited(f'Too many codes requested for {user.username}')
+
+    @classmethod
+    def issue(cls, user):
+        """Replace the user's code with a new one and return the code. Raises CodeRateLimited."""
+        cls.check_rate_limit(user)
+        code = cls.generate_code()
+        now = timezone.now()
+        cls.objects.update_or_create(user=user, defaults={
+            'code_hash': cls.hash_code(user, code),
+            'created_at': now,
+            'expires_at': now + cls.LIFETIME,
+            'attempts': 0,
+        })
+        return code
+
+    @classmethod
+    def verify(cls, user, code):
+        """Check ``code`` and consume it if it matches. Returns VALID, INVALID or EXPIRED."""
+        stored = cls.objects.filter(user=user).first()
+        if stored is None:
+            return cls.INVALID
+        if timezone.now() >= stored.expires_at or stored.attempts >= cls.MAX_ATTEMPTS:
+            stored.delete()
+            return cls.EXPIRED
+        if not hmac.compare_digest(stored.code_hash, cls.hash_code(user, code)):
+            cls.objects.filter(pk=stored.pk).update(attempts=F('attempts') + 1)
+            return cls.INVALID
+        # Deleting by hash makes sure two requests can't both use the same code
+        deleted, _ = cls.objects.filter(pk=stored.pk, code_hash=stored.code_hash).delete()
+        return cls.VALID if deleted else cls.INVALID
+
+
+class PasswordResetCode(OneTimeCode):
+    LIFETIME = timedelta(minutes=15)
+
     def __str__(self):
-        return f"Reset code for {self.user.username}: {self.code}"
-    
-    class Meta:
-        ordering = ['-created_at']
+        return f"Reset code for {self.user.username}"
 
 
-class EmailVerificationCode(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    code = models.CharField(max_length=6)
-    created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
-    is_used = models.BooleanField(default=False)
-    
-    def save(self, *args, **kwargs):
-        if not self.code:
-            self.code = self.generate_code()
-        if not self.expires_at:
-            # Code expires in 30 minutes for email verification
-            self.expires_at = timezone.now() + timezone.timedelta(minutes=30)
-        super().save(*args, **kwargs)
-    
-    def generate_code(self):
-        """Generate a 6-digit numeric code"""
-        return ''.join(random.choices(string.digits, k=6))
-    
-    def is_valid(self):
-        """Check if code is still valid (not expired and not used)"""
-        return not self.is_used and timezone.now() < self.expires_at
-    
+class EmailVerificationCode(OneTimeCode):
+    LIFETIME = timedelta(minutes=30)
+
     def __str__(self):
-        return f"Email verification code for {self.user.username}: {self.code}"
-    
-    class Meta:
-        ordering = ['-created_at']
+        return f"Email verification code for {self.user.username}"
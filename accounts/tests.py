@@ -1,3 +1,81 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.testing import TEST_CACHES
+from .backends import find_user
+from .forms import SignUpForm
+from .models import CodeRateLimited, EmailVerificationCode, PasswordResetCode
+
+
+@override_settings(CACHES=TEST_CACHES)
+class EmailLoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('amina', 'Amina@Example.com', 'correct-horse')
+
+    def test_authenticates_by_username_or_case_insensitive_email(self):
+        self.assertEqual(authenticate(username='amina', password='correct-horse'), self.user)
+        self.assertEqual(authenticate(username=' amina@example.COM ', password='correct-horse'), self.user)
+        self.assertIsNone(authenticate(username='amina@example.com', password='wrong'))
+
+    def test_lookup_is_one_query_and_follows_email_changes(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(find_user('AMINA@example.com'), self.user)
+        self.user.email = 'amina@oraagh.com'
+        self.user.save()
+        self.assertIsNone(find_user('amina@example.com'))
+        self.assertEqual(find_user('Amina@Oraagh.com'), self.user)
+
+    def test_duplicate_emails_are_rejected_at_signup(self):
+        form = SignUpForm(data={
+            'username': 'other', 'first_name': 'Other', 'last_name': 'User', 'email': 'AMINA@example.com',
+            'password1': 'a-long-password-1', 'password2': 'a-long-password-1',
+        })
+        self.assertIn('email', form.errors)
+
+    def test_unverified_users_are_sent_to_verification(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post('/accounts/login/', {'username': 'amina@example.com', 'password': 'correct-horse'})
+        self.assertRedirects(response, '/accounts/verify-email/', fetch_redirect_response=False)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OneTimeCodeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('amina', 'amina@example.com', 'correct-horse')
+
+    def test_codes_are_hashed_single_use_and_replaced_on_reissue(self):
+        first = PasswordResetCode.issue(self.user)
+        code = PasswordResetCode.issue(self.user)
+        stored = PasswordResetCode.objects.get(user=self.user)
+        self.assertNotIn(code, stored.code_hash)
+        if first != code:
+            self.assertEqual(PasswordResetCode.verify(self.user, first), PasswordResetCode.INVALID)
+        self.assertEqual(PasswordResetCode.verify(self.user, code), PasswordResetCode.VALID)
+        self.assertEqual(PasswordResetCode.verify(self.user, code), PasswordResetCode.INVALID)
+
+    def test_wrong_guesses_and_expiry_lock_the_code(self):
+        code = EmailVerificationCode.issue(self.user)
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(EmailVerificationCode.MAX_ATTEMPTS):
+            self.assertEqual(EmailVerificationCode.verify(self.user, wrong), EmailVerificationCode.INVALID)
+        self.assertEqual(EmailVerificationCode.verify(self.user, code), EmailVerificationCode.EXPIRED)
+
+        code = EmailVerificationCode.issue(self.user)
+        EmailVerificationCode.objects.update(expires_at=timezone.now())
+        call_command('sweep_expired_codes', stdout=StringIO())
+        self.assertFalse(EmailVerificationCode.objects.exists())
+
+    def test_issuing_is_rate_limited_per_user(self):
+        for _ in range(PasswordResetCode.RATE_LIMIT):
+            PasswordResetCode.issue(self.user)
+        with self.assertRaises(CodeRateLimited):
+            PasswordResetCode.issue(self.user)
+        EmailVerificationCode.issue(self.user)
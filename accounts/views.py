@@ -6,11 +6,15 @@ from django.contrib.auth.forms import AuthenticationForm, SetPasswordForm
 from django.contrib.auth.models import User
 from django.core.mail import send_mail
 from django.conf import settings
-from django.utils import timezone
 from django.http import JsonResponse
+from .backends import find_user
 from .forms import SignUpForm, UserProfileForm, UserUpdateForm
-from .models import UserProfile, PasswordResetCode, EmailVerificationCode
-from orders.models import Order
+from .models import UserProfile, PasswordResetCode, EmailVerificationCode, CodeRateLimited
+from django.db.models import Prefetch
+from core.pagination import paginate
+from orders.models import Order, OrderItem
+from orders.stats import get_order_stats
+from products.models import Product
 
 def signup_view(request):
     if request.method == 'POST':
@@ -38,7 +42,7 @@ def signup_view(request):
                 profile.save()
             
             # Create verification code
-            verification_code = EmailVerificationCode.objects.create(user=user)
+            verification_code = EmailVerificationCode.issue(user)
             
             # Send verification email
             try:
@@ -50,7 +54,7 @@ def signup_view(request):
                 # Render HTML template
                 html_content = render_to_string('accounts/email/email_verification_code.html', {
                     'user': user,
-                    'code': verification_code.code,
+                    'code': verification_code,
                     'request': request,
                 })
                 
@@ -60,7 +64,7 @@ Hello {user.first_name or user.username},
 
 Welcome to Timeless Cart! To complete your account registration, please verify your email address.
 
-Your 6-digit verification code is: {verification_code.code}
+Your 6-digit verification code is: {verification_code}
 
 This code will expire in 30 minutes.
 
@@ -100,40 +104,22 @@ def login_view(request):
         password = request.POST.get('password', '')
         
         if username_or_email and password:
-            # First, find the user object to check if they exist and their status
-            user_obj = None
-            if '@' in username_or_email:
-                # It's an email
-                try:
-                    user_obj = User.objects.get(email=username_or_email)
-                except User.DoesNotExist:
-                    pass
-            else:
-                # It's a username
-                try:
-                    user_obj = User.objects.get(username=username_or_email)
-                except User.DoesNotExist:
-                    pass
-            
+            user = authenticate(request, username=username_or_email, password=password)
+            if user is not None:
+                login(request, user)
+                display_name = user.first_name or user.username
+                messages.success(request, f'Welcome back, {display_name}!')
+                next_page = request.GET.get('next', 'core:home')
+                return redirect(next_page)
+
+            # Login failed, find out why; the backend rejects inactive users even with the right password
+            user_obj = find_user(username_or_email)
             if user_obj:
-                # User exists, now check password manually since authenticate() fails for inactive users
-                from django.contrib.auth.hashers import check_password
-                
-                if check_password(password, user_obj.password):
-                    # Password is correct
-                    if user_obj.is_active:
-                        # Use authenticate for active users to get proper user object
-                        user = authenticate(username=user_obj.username, password=password)
-                        login(request, user)
-                        display_name = user_obj.first_name or user_obj.username
-                        messages.success(request, f'Welcome back, {display_name}!')
-                        next_page = request.GET.get('next', 'core:home')
-                        return redirect(next_page)
-                    else:
-                        # User exists, password correct, but account is not verified
-                        request.session['verification_user_id'] = user_obj.id
-                        messages.warning(request, 'Your account is not verified. Please check your email and enter the verification code to activate your account.')
-                        return redirect('accounts:verify_email')
+                if user_obj.check_password(password):
+                    # User exists, password correct, but account is not verified
+                    request.session['verification_user_id'] = user_obj.id
+                    messages.warning(request, 'Your account is not verified. Please check your email and enter the verification code to activate your account.')
+                    return redirect('accounts:verify_email')
                 else:
                     # User exists but password is wrong
                     messages.error(request, 'Incorrect password. Please try again.')
@@ -189,28 +175,23 @@ def profile_view(request):
 
 @login_required
 def order_history(request):
-    from django.core.paginator import Paginator
-    from django.db.models import Sum, Count
+    # Items, their products and each product's first image are loaded for the whole page in three queries
+    orders = Order.objects.filter(user=request.user).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.order_by('pk').prefetch_related(
+            Prefetch('product', queryset=Product.objects.with_primary_media())
+        ))
+    )
     
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    
-    # Calculate statistics
-    total_orders = orders.count()
-    total_items = orders.aggregate(total_items=Sum('items__quantity'))['total_items'] or 0
-    total_spent = orders.aggregate(total_spent=Sum('total'))['total_spent'] or 0
-    
-    # Pagination
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Order count, items bought and amount spent in one aggregate query
+    stats = get_order_stats(request.user)
+    # Keyset pages walk the orders_user_history_idx index, see core.pagination
+    page_obj = paginate(request, orders, 10, total=stats['total_orders'])
     
     context = {
         'orders': page_obj,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
-        'total_orders': total_orders,
-        'total_items': total_items,
-        'total_spent': total_spent,
+        **stats,
     }
     return render(request, 'accounts/order_history.html', context)
 
@@ -235,13 +216,8 @@ def forgot_password_view(request):
             return render(request, 'accounts/forgot_password.html')
         
         # Try to find user by email or username
-        user = None
-        try:
-            if '@' in email_or_username:
-                user = User.objects.get(email=email_or_username)
-            else:
-                user = User.objects.get(username=email_or_username)
-        except User.DoesNotExist:
+        user = find_user(email_or_username)
+        if user is None:
             # Don't reveal if user exists or not for security
             messages.success(request, 'If an account with that email/username exists, you will receive a password reset code shortly.')
             return render(request, 'accounts/forgot_password.html')
@@ -250,11 +226,12 @@ def forgot_password_view(request):
             messages.error(request, 'No email address associated with this account.')
             return render(request, 'accounts/forgot_password.html')
         
-        # Invalidate any existing codes for this user
-        PasswordResetCode.objects.filter(user=user, is_used=False).update(is_used=True)
-        
-        # Create new reset code
-        reset_code = PasswordResetCode.objects.create(user=user)
+        # Create new reset code, which replaces any earlier one
+        try:
+            reset_code = PasswordResetCode.issue(user)
+        except CodeRateLimited:
+            messages.error(request, 'Too many requests. Please wait 5 minutes before requesting another code.')
+            return render(request, 'accounts/forgot_password.html')
         
         # Send email with code using HTML template
         try:
@@ -266,7 +243,7 @@ def forgot_password_view(request):
             # Render HTML template
             html_content = render_to_string('accounts/email/password_reset_code.html', {
                 'user': user,
-                'code': reset_code.code,
+                'code': reset_code,
                 'request': request,
             })
             
@@ -276,7 +253,7 @@ Hello {user.first_name or user.username},
 
 You requested a password reset for your Timeless Cart account.
 
-Your 6-digit verification code is: {reset_code.code}
+Your 6-digit verification code is: {reset_code}
 
 This code will expire in 15 minutes.
 
@@ -328,32 +305,21 @@ def verify_reset_code_view(request):
             messages.error(request, 'Please enter the verification code.')
             return render(request, 'accounts/verify_reset_code.html', {'user': user})
         
-        # Find valid reset code
-        try:
-            reset_code = PasswordResetCode.objects.get(
-                user=user,
-                code=code,
-                is_used=False
-            )
-            
-            if not reset_code.is_valid():
-                messages.error(request, 'This code has expired. Please request a new password reset.')
-                return redirect('accounts:forgot_password')
-            
-            # Mark code as used
-            reset_code.is_used = True
-            reset_code.save()
-            
-            # Store verification in session
-            request.session['verified_reset_user_id'] = user.id
-            request.session['reset_code_verified'] = True
-            
-            messages.success(request, 'Code verified successfully! Please set your new password.')
-            return redirect('accounts:reset_password')
-            
-        except PasswordResetCode.DoesNotExist:
+        # Check the code, which is used up if it matches
+        result = PasswordResetCode.verify(user, code)
+        if result == PasswordResetCode.EXPIRED:
+            messages.error(request, 'This code has expired. Please request a new password reset.')
+            return redirect('accounts:forgot_password')
+        if result == PasswordResetCode.INVALID:
             messages.error(request, 'Invalid verification code. Please try again.')
             return render(request, 'accounts/verify_reset_code.html', {'user': user})
+        
+        # Store verification in session
+        request.session['verified_reset_user_id'] = user.id
+        request.session['reset_code_verified'] = True
+        
+        messages.success(request, 'Code verified successfully! Please set your new password.')
+        return redirect('accounts:reset_password')
     
     return render(request, 'accounts/verify_reset_code.html', {'user': user})
 
@@ -403,21 +369,12 @@ def resend_reset_code_view(request):
         except User.DoesNotExist:
             return JsonResponse({'success': False, 'message': 'User not found.'})
         
-        # Check if user has requested too many codes recently (rate limiting)
-        recent_codes = PasswordResetCode.objects.filter(
-            user=user,
-            created_at__gte=timezone.now() - timezone.timedelta(minutes=5)
-        ).count()
-        
-        if recent_codes >= 3:
+        # Create new code, which replaces the previous one; issuing is rate limited per user
+        try:
+            reset_code = PasswordResetCode.issue(user)
+        except CodeRateLimited:
             return JsonResponse({'success': False, 'message': 'Too many requests. Please wait 5 minutes before requesting another code.'})
         
-        # Invalidate existing codes
-        PasswordResetCode.objects.filter(user=user, is_used=False).update(is_used=True)
-        
-        # Create new code
-        reset_code = PasswordResetCode.objects.create(user=user)
-        
         # Send email using HTML template
         try:
             from django.template.loader import render_to_string
@@ -428,7 +385,7 @@ def resend_reset_code_view(request):
             # Render HTML template
             html_content = render_to_string('accounts/email/password_reset_code.html', {
                 'user': user,
-                'code': reset_code.code,
+                'code': reset_code,
                 'request': request,
             })
             
@@ -436,7 +393,7 @@ def resend_reset_code_view(request):
             text_content = f"""
 Hello {user.first_name or user.username},
 
-Here is your new 6-digit verification code: {reset_code.code}
+Here is your new 6-digit verification code: {reset_code}
 
 This code will expire in 15 minutes.
 
@@ -483,41 +440,31 @@ def verify_email_view(request):
             messages.error(request, 'Please enter the verification code.')
             return render(request, 'accounts/verify_email.html', {'user': user})
         
-        # Find valid verification code
-        try:
-            verification_code = EmailVerificationCode.objects.get(
-                user=user,
-                code=code,
-                is_used=False
-            )
-            
-            if not verification_code.is_valid():
-                messages.error(request, 'This code has expired. Please request a new verification code.')
-                return render(request, 'accounts/verify_email.html', {'user': user})
-            
-            # Mark code as used and activate user
-            verification_code.is_used = True
-            verification_code.save()
-            
-            user.is_active = True
-            user.save()
-            
-            # Clear session data
-            request.session.pop('verification_user_id', None)
-            
-            # Log the user in
-            login(request, user)
-            
-            messages.success(request, f'Welcome to Timeless Cart, {user.username}! Your email has been verified and your account is now active.')
-            
-            # Force redirect to home page
-            from django.http import HttpResponseRedirect
-            from django.urls import reverse
-            return HttpResponseRedirect(reverse('core:home'))
-            
-        except EmailVerificationCode.DoesNotExist:
+        # Check the code, which is used up if it matches
+        result = EmailVerificationCode.verify(user, code)
+        if result == EmailVerificationCode.EXPIRED:
+            messages.error(request, 'This code has expired. Please request a new verification code.')
+            return render(request, 'accounts/verify_email.html', {'user': user})
+        if result == EmailVerificationCode.INVALID:
             messages.error(request, 'Invalid verification code. Please try again.')
             return render(request, 'accounts/verify_email.html', {'user': user})
+        
+        # Activate user
+        user.is_active = True
+        user.save()
+        
+        # Clear session data
+        request.session.pop('verification_user_id', None)
+        
+        # Log the user in
+        login(request, user)
+        
+        messages.success(request, f'Welcome to Timeless Cart, {user.username}! Your email has been verified and your account is now active.')
+        
+        # Force redirect to home page
+        from django.http import HttpResponseRedirect
+        from django.urls import reverse
+        return HttpResponseRedirect(reverse('core:home'))
     
     return render(request, 'accounts/verify_email.html', {'user': user})
 
@@ -534,21 +481,12 @@ def resend_verification_code_view(request):
         except User.DoesNotExist:
             return JsonResponse({'success': False, 'message': 'User not found.'})
         
-        # Check if user has requested too many codes recently (rate limiting)
-        recent_codes = EmailVerificationCode.objects.filter(
-            user=user,
-            created_at__gte=timezone.now() - timezone.timedelta(minutes=5)
-        ).count()
-        
-        if recent_codes >= 3:
+        # Create new code, which replaces the previous one; issuing is rate limited per user
+        try:
+            verification_code = EmailVerificationCode.issue(user)
+        except CodeRateLimited:
             return JsonResponse({'success': False, 'message': 'Too many requests. Please wait 5 minutes before requesting another code.'})
         
-        # Invalidate existing codes
-        EmailVerificationCode.objects.filter(user=user, is_used=False).update(is_used=True)
-        
-        # Create new code
-        verification_code = EmailVerificationCode.objects.create(user=user)
-        
         # Send email
         try:
             from django.template.loader import render_to_string
@@ -559,7 +497,7 @@ def resend_verification_code_view(request):
             # Render HTML template
             html_content = render_to_string('accounts/email/email_verification_code.html', {
                 'user': user,
-                'code': verification_code.code,
+                'code': verification_code,
                 'request': request,
             })
             
@@ -567,7 +505,7 @@ def resend_verification_code_view(request):
             text_content = f"""
 Hello {user.first_name or user.username},
 
-Here is your new 6-digit verification code: {verification_code.code}
+Here is your new 6-digit verification code: {verification_code}
 
 This code will expire in 30 minutes.
 
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from admin_dashboard.metrics import rebuild_metrics
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily dashboard metrics from orders, users, products and posts.'
+
+    def handle(self, *args, **options):
+        count = rebuild_metrics()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily metrics.'))
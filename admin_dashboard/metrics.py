@@ -0,0 +1,128 @@
+"""
+Materialized dashboard metrics.
+
+The dashboard does not count or sum whole tables. It reads running daily
+totals from ``DailyMetric``:
+
+* orders and their revenue, per status
+* new customers (non-staff users)
+* new products
+* new blog posts
+
+The receivers in ``admin_dashboard.signals`` update the rows of the affected
+day with an ``F()`` expression whenever one of these objects is created,
+deleted, or has a field that is counted change. The update runs in the
+transaction of the change. Overall totals then take one grouped query over
+the daily rows, and the revenue chart is read from the same rows.
+
+Migration ``0002_backfill_daily_metrics`` fills in the history that existed
+before the signals. ``manage.py rebuild_dashboard_metrics`` recomputes every
+row from the source tables. Run it whenever data was changed without
+signals, e.g. by a ``QuerySet.update()``.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyMetric
+
+ORDERS = 'orders'
+CUSTOMERS = 'customers'
+PRODUCTS = 'products'
+POSTS = 'posts'
+REVENUE_CHART_DAYS = 30
+
+
+def record(metric, created_at, count=1, amount=Decimal('0.00'), status=''):
+    """Add ``count`` and ``amount`` to the metric of the day ``created_at`` falls on"""
+    day = timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+    rows = DailyMetric.objects.filter(date=day, metric=metric, status=status)
+    if rows.update(count=F('count') + count, amount=F('amount') + amount):
+        return
+    try:
+        with transaction.atomic():
+            DailyMetric.objects.create(date=day, metric=metric, status=status, count=count, amount=amount)
+    except IntegrityError:
+        # Created by a concurrent request since the update above
+        rows.update(count=F('count') + count, amount=F('amount') + amount)
+
+
+def get_totals():
+    """All-time totals for the dashboard cards, with order counts per status, in one query"""
+    totals = {ORDERS: 0, 'revenue': Decimal('0.00'), CUSTOMERS: 0, PRODUCTS: 0, POSTS: 0, 'order_status': {}}
+    rows = DailyMetric.objects.values('metric', 'status').annotate(
+        total_count=Sum('count'), total_amount=Sum('amount')
+    ).order_by('metric', 'status')
+    for row in rows:
+        totals[row['metric']] += row['total_count']
+        if row['metric'] == ORDERS:
+            totals['revenue'] += row['total_amount']
+            if row['total_count']:
+                totals['order_status'][row['status']] = row['total_count']
+    return totals
+
+
+def get_daily_revenue(days=REVENUE_CHART_DAYS):
+    """Orders and revenue for each of the last ``days`` days, oldest first, including empty days"""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rows = {
+        row['date']: row
+        for row in DailyMetric.objects.filter(metric=ORDERS, date__gte=start).values('date').annotate(
+            orders=Sum('count'), revenue=Sum('amount')
+        )
+    }
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = rows.get(day, {})
+        series.append({'date': day, 'orders': row.get('orders', 0), 'revenue': row.get('revenue', Decimal('0.00'))})
+    return series
+
+
+def daily_metrics(apps):
+    """
+    Unsaved DailyMetric rows with the totals of the source tables, read
+    through the models of ``apps``, so migrations can pass their historical apps.
+    """
+    DailyMetric = apps.get_model('admin_dashboard', 'DailyMetric')
+    sources = (
+        (ORDERS, apps.get_model('orders', 'Order').objects.all(), 'created_at', 'status', 'total'),
+        (CUSTOMERS, apps.get_model(settings.AUTH_USER_MODEL).objects.filter(is_staff=False), 'date_joined', None, None),
+        (PRODUCTS, apps.get_model('products', 'Product').objects.all(), 'created_at', None, None),
+        (POSTS, apps.get_model('blog', 'Post').objects.all(), 'created_at', None, None),
+    )
+    metrics = []
+    for metric, queryset, date_field, status_field, amount_field in sources:
+        group_by = ['day'] + ([status_field] if status_field else [])
+        aggregates = {'total_count': Count('pk')}
+        if amount_field:
+            aggregates['total_amount'] = Sum(amount_field)
+        rows = queryset.annotate(day=TruncDate(date_field)).values(*group_by).annotate(**aggregates).order_by()
+        metrics.extend(
+            DailyMetric(
+                date=row['day'],
+                metric=metric,
+                status=row[status_field] if status_field else '',
+                count=row['total_count'],
+                amount=row.get('total_amount') or Decimal('0.00'),
+            )
+            for row in rows
+        )
+    return metrics
+
+
+def rebuild_metrics():
+    """Recompute every daily metric from the source tables, returns the number of rows written"""
+    metrics = daily_metrics(django_apps)
+    with transaction.atomic():
+        DailyMetric.objects.all().delete()
+        DailyMetric.objects.bulk_create(metrics, batch_size=1000)
+    return len(metrics)
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('metric', models.CharField(choices=[('orders', 'Orders'), ('customers', 'New customers'), ('products', 'New products'), ('posts', 'New blog posts')], max_length=20)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'ordering': ['-date', 'metric', 'status'],
+                'indexes': [models.Index(fields=['metric', 'date'], name='dashboard_metric_date_idx')],
+                'unique_together': {('date', 'metric', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import migrations
+
+from admin_dashboard.metrics import daily_metrics
+
+
+def backfill_daily_metrics(apps, schema_editor):
+    """The daily totals of everything created before the signals counted it"""
+    DailyMetric = apps.get_model('admin_dashboard', 'DailyMetric')
+    DailyMetric.objects.all().delete()
+    DailyMetric.objects.bulk_create(daily_metrics(apps), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('admin_dashboard', '0001_initial'),
+        ('blog', '0001_initial'),
+        ('orders', '0001_initial'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_metrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class DailyMetric(models.Model):
+    """
+    A running daily total for the dashboard, maintained by ``admin_dashboard.metrics``.
+
+    Orders are counted per status, with their revenue in ``amount``. Customers,
+    products and posts are counted by the day they were created, so deletions
+    subtract from the day the row was created on.
+    """
+    METRIC_CHOICES = (
+        ('orders', 'Orders'),
+        ('customers', 'New customers'),
+        ('products', 'New products'),
+        ('posts', 'New blog posts'),
+    )
+
+    date = models.DateField()
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    status = models.CharField(max_length=20, blank=True)
+    count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.date} {self.metric} {self.status}: {self.count}'
+
+    class Meta:
+        ordering = ['-date', 'metric', 'status']
+        unique_together = ['date', 'metric', 'status']
+        indexes = [
+            models.Index(fields=['metric', 'date'], name='dashboard_metric_date_idx'),
+        ]
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from blog.models import Post
+from orders.models import Order
+from products.models import Product
+from . import metrics
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    """Count a new order, or move an order between statuses when its status or total changes"""
+    if created:
+        metrics.record(metrics.ORDERS, instance.created_at, amount=instance.total, status=instance.status)
+    elif instance.status != instance._original_status or instance.total != instance._original_total:
+        metrics.record(metrics.ORDERS, instance.created_at, count=-1, amount=-instance._original_total,
+                       status=instance._original_status)
+        metrics.record(metrics.ORDERS, instance.created_at, amount=instance.total, status=instance.status)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    metrics.record(metrics.ORDERS, instance.created_at, count=-1, amount=-instance._original_total,
+                   status=instance._original_status)
+
+
+@receiver(pre_save, sender=User)
+def remember_staff_flag(sender, instance, update_fields=None, **kwargs):
+    """Customers are non-staff users, so note whether a saved user was staff before"""
+    if instance.pk and (update_fields is None or 'is_staff' in update_fields):
+        instance._was_staff = User.objects.filter(pk=instance.pk).values_list('is_staff', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        if not instance.is_staff:
+            metrics.record(metrics.CUSTOMERS, instance.date_joined)
+    elif getattr(instance, '_was_staff', None) not in (None, instance.is_staff):
+        metrics.record(metrics.CUSTOMERS, instance.date_joined, count=1 if instance._was_staff else -1)
+    instance._was_staff = instance.is_staff
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if not instance.is_staff:
+        metrics.record(metrics.CUSTOMERS, instance.date_joined, count=-1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Post)
+def content_saved(sender, instance, created, **kwargs):
+    if created:
+        metrics.record(metrics.PRODUCTS if sender is Product else metrics.POSTS, instance.created_at)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Post)
+def content_deleted(sender, instance, **kwargs):
+    metrics.record(metrics.PRODUCTS if sender is Product else metrics.POSTS, instance.created_at, count=-1)
@@ -0,0 +1,73 @@
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from blog.models import Post
+from core.testing import TEST_CACHES
+from orders.models import Order
+from products.models import Product
+from . import metrics
+from .models import DailyMetric
+
+
+def metric_rows():
+    return sorted(DailyMetric.objects.values_list('date', 'metric', 'status', 'count', 'amount'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DailyMetricTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='buyer', email='buyer@example.com')
+        User.objects.create(username='admin', is_staff=True)
+        Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        Post.objects.create(title='Pashmina care', author=self.customer, content='Hand wash', status='published')
+        self.order = Order.objects.create(user=self.customer, subtotal=Decimal('1000.00'), tax=0,
+                                          total=Decimal('1000.00'))
+        Order.objects.create(user=self.customer, subtotal=Decimal('500.00'), tax=0, total=Decimal('500.00'))
+
+    def test_signals_keep_the_totals_current(self):
+        totals = metrics.get_totals()
+        self.assertEqual((totals['orders'], totals['revenue']), (2, Decimal('1500.00')))
+        self.assertEqual((totals['customers'], totals['products'], totals['posts']), (1, 1, 1))
+        self.assertEqual(totals['order_status'], {'pending': 2})
+
+        self.order.status = 'delivered'
+        self.order.total = Decimal('1200.00')
+        self.order.save()
+        User.objects.filter(username='admin').get().delete()
+        self.customer.is_staff = True
+        self.customer.save()
+        Product.objects.get().delete()
+
+        totals = metrics.get_totals()
+        self.assertEqual((totals['orders'], totals['revenue']), (2, Decimal('1700.00')))
+        self.assertEqual(totals['order_status'], {'pending': 1, 'delivered': 1})
+        self.assertEqual((totals['customers'], totals['products'], totals['posts']), (0, 0, 1))
+
+    def test_daily_revenue_covers_every_day(self):
+        series = metrics.get_daily_revenue(days=3)
+        self.assertEqual([day['date'] for day in series],
+                         [timezone.localdate() - timedelta(days=offset) for offset in (2, 1, 0)])
+        self.assertEqual((series[-1]['orders'], series[-1]['revenue']), (2, Decimal('1500.00')))
+        self.assertEqual(series[0]['orders'], 0)
+
+    def test_rebuild_matches_the_signal_totals(self):
+        expected = metric_rows()
+        # Changes made without signals are only picked up by a rebuild
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        self.assertEqual(metric_rows(), expected)
+        self.assertEqual(metrics.rebuild_metrics(), 5)
+        self.assertEqual(metrics.get_totals()['order_status'], {'pending': 1, 'cancelled': 1})
+
+    def test_migration_backfill_matches_the_rebuild(self):
+        metrics.rebuild_metrics()
+        expected = metric_rows()
+        DailyMetric.objects.all().delete()
+        migration = import_module('admin_dashboard.migrations.0002_backfill_daily_metrics')
+        migration.backfill_daily_metrics(apps, None)
+        self.assertEqual(metric_rows(), expected)
@@ -27,6 +27,9 @@ urlpatterns = [
     path('products/<int:product_id>/edit/', views.product_edit, name='product_edit'),
     path('products/<int:product_id>/delete/', views.product_delete, name='product_delete'),
     path('products/<int:product_id>/media/add/', views.product_media_add, name='product_media_add'),
+    path('products/<int:product_id>/uploads/', views.product_upload_start, name='product_upload_start'),
+    path('products/<int:product_id>/uploads/status/', views.product_upload_status, name='product_upload_status'),
+    path('uploads/<int:upload_id>/chunk/', views.media_upload_chunk, name='media_upload_chunk'),
     path('product-media/<int:media_id>/delete/', views.product_media_delete, name='product_media_delete'),
 
     # Category URLs
@@ -1,14 +1,22 @@
+import re
+
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
 from django.contrib.auth.views import LoginView
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.db.models import Count, Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from .forms import ProductForm, CategoryForm, PostForm, ReviewForm, NewsletterForm
-from products.models import Product, ProductCategory, Review, DealRequest, ProductMedia
+from . import metrics
+from core.pagination import estimate_count, paginate
+from products.models import Product, ProductCategory, Review, DealRequest, ProductMedia, MediaUpload
+from products import uploads
 from blog.models import Post
-from newsletter.models import Subscriber
+from newsletter.models import Subscriber, Campaign
+from newsletter.delivery import create_campaign
 from accounts.models import UserProfile
 from orders.models import Order, Cart
 from django.core.mail import EmailMultiAlternatives
@@ -19,6 +27,9 @@ from datetime import datetime, timedelta
 from django.utils import timezone
 
 
+CONTENT_RANGE = re.compile(r'^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<size>\d+)$')
+
+
 class DashboardLoginView(LoginView):
     template_name = 'admin_dashboard/login.html'
 
@@ -37,34 +48,28 @@ def is_staff_user(user):
 @login_required
 @user_passes_test(is_staff_user)
 def dashboard_home(request):
-    from products.models import Product
-    from orders.models import Order
-    from django.contrib.auth.models import User
-    from blog.models import Post
-    
-    # Get statistics
-    total_products = Product.objects.count()
-    total_orders = Order.objects.count()
-    new_deals = 0  # Placeholder for future deals functionality
-    total_customers = User.objects.filter(is_staff=False).count()
-    total_blog_posts = Post.objects.count()
+    # Statistics come from the daily metrics, see admin_dashboard.metrics
+    totals = metrics.get_totals()
     
     # Get recent data
     recent_products = Product.objects.order_by('-created_at')[:5]
     recent_orders = Order.objects.order_by('-created_at')[:5]
     
     # Get order status data for chart
-    order_status_data = Order.objects.values('status').annotate(count=Count('id'))
+    order_status_data = [{'status': status, 'count': count} for status, count in totals['order_status'].items()]
+    daily_revenue = metrics.get_daily_revenue()
     
     context = {
-        'total_products': total_products,
-        'total_orders': total_orders,
-        'new_deals': new_deals,
-        'total_customers': total_customers,
-        'total_blog_posts': total_blog_posts,
+        'total_products': totals[metrics.PRODUCTS],
+        'total_orders': totals[metrics.ORDERS],
+        'new_deals': 0,  # Placeholder for future deals functionality
+        'total_customers': totals[metrics.CUSTOMERS],
+        'total_blog_posts': totals[metrics.POSTS],
         'recent_products': recent_products,
         'recent_orders': recent_orders,
         'order_status_data': order_status_data,
+        'daily_revenue': daily_revenue,
+        'max_daily_revenue': max(day['revenue'] for day in daily_revenue),
     }
     
     return render(request, 'admin_dashboard/dashboard_home.html', context)
@@ -74,14 +79,13 @@ def dashboard_home(request):
 @user_passes_test(is_staff_user)
 def order_list(request):
     """List all orders with search and filter functionality"""
-    from django.db.models import Sum
-    
-    orders_list = Order.objects.all().order_by('-created_at')
+    orders_list = Order.objects.all()
 
-    # Calculate stats
-    total_orders = orders_list.count()
-    pending_orders_count = orders_list.filter(status='pending').count()
-    total_revenue = orders_list.aggregate(Sum('total'))['total__sum'] or 0
+    # Stats come from the daily metrics, see admin_dashboard.metrics
+    totals = metrics.get_totals()
+    total_orders = totals[metrics.ORDERS]
+    pending_orders_count = totals['order_status'].get('pending', 0)
+    total_revenue = totals['revenue']
 
     # Search functionality
     search_query = request.GET.get('search', '')
@@ -92,10 +96,8 @@ def order_list(request):
             Q(billing_email__icontains=search_query)
         )
 
-    # Pagination
-    paginator = Paginator(orders_list, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pages, counted from the metrics unless searching
+    page_obj = paginate(request, orders_list, 12, total=None if search_query else total_orders)
 
     context = {
         'page_obj': page_obj,
@@ -124,17 +126,6 @@ def order_detail(request, order_id):
     
     return render(request, 'admin_dashboard/order_detail.html', {'order': order})
 
-@login_required
-@user_passes_test(is_staff_user)
-def product_media_add(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    if request.method == 'POST':
-        files = request.FILES.getlist('media_files')
-        for f in files:
-            ProductMedia.objects.create(product=product, media_file=f)
-        messages.success(request, f'{len(files)} media file(s) uploaded.')
-    return redirect('admin_dashboard:product_edit', product_id=product.id)
-
 @login_required
 @user_passes_test(is_staff_user)
 def product_media_delete(request, media_id):
@@ -144,12 +135,14 @@ def product_media_delete(request, media_id):
     messages.success(request, 'Media deleted.')
     return redirect('admin_dashboard:product_edit', product_id=product_id)
 
+@login_required
+@user_passes_test(is_staff_user)
 def customer_list(request):
     """List all customers"""
-    customers_list = UserProfile.objects.filter(role='customer').order_by('-created_at')
+    customers_list = UserProfile.objects.filter(role='customer').select_related('user')
 
-    # Calculate stats
-    total_customers = customers_list.count()
+    # Stats come from the daily metrics, see admin_dashboard.metrics
+    total_customers = metrics.get_totals()[metrics.CUSTOMERS]
 
     # Search functionality
     search_query = request.GET.get('search', '')
@@ -160,10 +153,7 @@ def customer_list(request):
             Q(phone__icontains=search_query)
         )
 
-    # Pagination
-    paginator = Paginator(customers_list, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, customers_list, 12, total=None if search_query else total_customers)
 
     context = {
         'page_obj': page_obj,
@@ -194,12 +184,10 @@ def content_management(request):
 @user_passes_test(is_staff_user)
 def media_management(request):
     """Manage media files"""
-    media_files = ProductMedia.objects.all().order_by('-id')
+    media_files = ProductMedia.objects.select_related('product')
     
-    # Pagination
-    paginator = Paginator(media_files, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Media has no timestamp, its ids are allocated in upload order
+    page_obj = paginate(request, media_files, 20, ordering=('-id',), total=estimate_count(media_files))
     
     context = {
         'page_obj': page_obj,
@@ -212,19 +200,17 @@ def media_management(request):
 @login_required
 @user_passes_test(is_staff_user)
 def product_list(request):
-    query = request.GET.get('q')
-    product_list = Product.objects.all()
+    query = request.GET.get('q', '')
+    product_list = Product.objects.with_primary_media()
     if query:
         product_list = product_list.filter(name__icontains=query)
-    paginator = Paginator(product_list, 10)
-    page = request.GET.get('page')
-    try:
-        products = paginator.page(page)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        products = paginator.page(paginator.num_pages)
-    return render(request, 'admin_dashboard/product_list.html', {'products': products, 'query': query})
+    total_products = metrics.get_totals()[metrics.PRODUCTS]
+    products = paginate(request, product_list, 10, total=None if query else total_products)
+    return render(request, 'admin_dashboard/product_list.html', {
+        'products': products,
+        'query': query,
+        'total_products': total_products,
+    })
 
 @login_required
 @user_passes_test(is_staff_user)
@@ -273,42 +259,27 @@ def send_newsletter(request):
             subject = form.cleaned_data['subject']
             message = form.cleaned_data['message']
             
-            subscribers_emails = Subscriber.objects.values_list('email', flat=True)
-            
-            try:
-                html_content = render_to_string('newsletter/email/newsletter_template.html', {'subject': subject, 'message': message})
-                text_content = strip_tags(html_content)
-
-                email = EmailMultiAlternatives(
-                    subject,
-                    text_content,
-                    settings.DEFAULT_FROM_EMAIL,
-                    list(subscribers_emails)
-                )
-                email.attach_alternative(html_content, "text/html")
-                email.send()
-
-                messages.success(request, f'Newsletter sent to {len(list(subscribers_emails))} subscribers.')
-            except Exception as e:
-                messages.error(request, f'An error occurred while sending the newsletter: {e}')
+            logo_url = request.build_absolute_uri(settings.MEDIA_URL + 'red_sun_logo.png')
+            campaign = create_campaign(subject, message, logo_url=logo_url)
+            messages.success(request, f'Newsletter queued for {campaign.total_recipients} subscribers.')
             
             return redirect('admin_dashboard:send_newsletter')
     else:
         form = NewsletterForm()
 
     # Subscriber list logic
-    subscriber_list = Subscriber.objects.all().order_by('-created_at')
+    subscriber_list = Subscriber.objects.all()
+    subscriber_count = estimate_count(subscriber_list)
     search_query = request.GET.get('search', '')
     if search_query:
         subscriber_list = subscriber_list.filter(email__icontains=search_query)
 
-    paginator = Paginator(subscriber_list, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, subscriber_list, 10, total=None if search_query else subscriber_count)
 
     context = {
         'form': form,
-        'subscriber_count': Subscriber.objects.count(),
+        'subscriber_count': subscriber_count,
+        'campaigns': Campaign.objects.all()[:10],
         'page_obj': page_obj,
         'search_query': search_query,
     }
@@ -503,14 +474,74 @@ def review_update_status(request, pk, status):
 @login_required
 @user_passes_test(is_staff_user)
 def product_media_add(request, product_id):
+    """Form upload for browsers without JavaScript, the files are processed in the background like chunked uploads"""
     product = get_object_or_404(Product, id=product_id)
     if request.method == 'POST':
         files = request.FILES.getlist('media_files')
         for f in files:
-            ProductMedia.objects.create(product=product, media_file=f)
-        messages.success(request, f'{len(files)} media file(s) uploaded.')
+            uploads.queue_file(product, f, request.user)
+        messages.success(request, f'{len(files)} media file(s) uploaded. They appear in the gallery once processed.')
     return redirect('admin_dashboard:product_edit', product_id=product.id)
 
+def upload_json(upload):
+    return {
+        'id': upload.pk,
+        'filename': upload.filename,
+        'size': upload.size,
+        'received': upload.received,
+        'progress': upload.progress,
+        'status': upload.status,
+        'media_id': upload.media_id,
+        'error': upload.error,
+    }
+
+@login_required
+@user_passes_test(is_staff_user)
+@require_POST
+def product_upload_start(request, product_id):
+    """Start a chunked upload of one file, the client then sends its chunks to chunk_url"""
+    product = get_object_or_404(Product, id=product_id)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = -1
+    filename = request.POST.get('filename', '')
+    if size < 0 or not filename:
+        return JsonResponse({'error': 'A filename and a size are required.'}, status=400)
+    upload = uploads.start_upload(product, filename, size, request.user)
+    return JsonResponse({
+        **upload_json(upload),
+        'chunk_size': uploads.CHUNK_SIZE,
+        'chunk_url': reverse('admin_dashboard:media_upload_chunk', args=[upload.pk]),
+    }, status=201)
+
+@login_required
+@user_passes_test(is_staff_user)
+@require_POST
+def media_upload_chunk(request, upload_id):
+    """
+    Append the raw request body to an upload. The ``Content-Range: bytes start-end/size``
+    header says where it goes; a 409 response carries the offset to resume from.
+    """
+    upload = get_object_or_404(MediaUpload, id=upload_id)
+    match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+    if not match or int(match['size']) != upload.size or int(match['end']) < int(match['start']):
+        return JsonResponse({'error': 'A Content-Range header for this upload is required.', 'received': upload.received}, status=400)
+    start = int(match['start'])
+    try:
+        uploads.write_chunk(upload, start, request, int(match['end']) - start + 1)
+    except uploads.ChunkRejected as e:
+        return JsonResponse({'error': str(e), 'received': e.received}, status=409)
+    return JsonResponse(upload_json(upload))
+
+@login_required
+@user_passes_test(is_staff_user)
+def product_upload_status(request, product_id):
+    """Progress of the uploads in ``?ids=1,2,3``, polled while they are processed"""
+    ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.isdigit()]
+    product_uploads = MediaUpload.objects.filter(product_id=product_id, pk__in=ids).order_by('pk')
+    return JsonResponse({'uploads': [upload_json(upload) for upload in product_uploads]})
+
 @login_required
 @user_passes_test(is_staff_user)
 def product_media_delete(request, media_id):
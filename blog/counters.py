@@ -0,0 +1,126 @@
+"""
+Buffered post view counting.
+
+Page views do not write to the database. ``record_view`` increments a counter
+in the cache, which every worker shares. Counters are keyed by slug, so cached
+pages can count a view without looking the post up. ``flush_pending_views``
+(run by ``flush_post_views``) moves the pending counts into ``Post.views``
+with one UPDATE per batch of posts. Each counter is decremented by the amount
+that was flushed, so views recorded during a flush stay pending for the next
+one.
+
+A flush only visits posts that were viewed since the last one. The first view
+of a post after a flush appends its slug to a dirty log, a run of numbered
+cache keys. The flush reads the log from where the previous one stopped, and
+clears the post's dirty mark before reading its counter, so a view arriving
+meanwhile logs the slug again.
+
+Pages that show view counts merge the pending counts with ``with_pending_views``.
+They do not have to wait for a flush.
+
+The cache must have atomic ``add`` and ``incr``, such as Redis or Memcached.
+The file and local-memory backends increment with a read and a write, so
+simultaneous views can be counted once, or two of them can take the same
+slot of the dirty log. ``settings.CACHES`` has to point at such a cache in
+production for the counts to be exact.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+
+from .models import Post
+
+BATCH_SIZE = 500
+# A dirty mark whose log slot was lost expires, so the next view logs the slug again
+DIRTY_MARK_TIMEOUT = 24 * 60 * 60
+# Last slot taken in the dirty log, and last slot flushed
+DIRTY_LOG_END_KEY = 'blog:views:dirty:end'
+DIRTY_LOG_FLUSHED_KEY = 'blog:views:dirty:flushed'
+
+
+def counter_key(slug):
+    return f'blog:views:{slug}'
+
+
+def dirty_mark_key(slug):
+    return f'blog:views:dirty:mark:{slug}'
+
+
+def dirty_slot_key(slot):
+    return f'blog:views:dirty:slot:{slot}'
+
+
+def mark_dirty(slug):
+    """Append ``slug`` to the dirty log, unless it is already there"""
+    if not cache.add(dirty_mark_key(slug), True, DIRTY_MARK_TIMEOUT):
+        return
+    cache.add(DIRTY_LOG_END_KEY, 0, None)
+    cache.set(dirty_slot_key(cache.incr(DIRTY_LOG_END_KEY)), slug, None)
+
+
+def record_view(slug):
+    """Count a view of a post without touching the database"""
+    key = counter_key(slug)
+    # The counter never expires, a flush takes it back to zero
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(key, 1, None)
+    mark_dirty(slug)
+
+
+def pending_views(slugs):
+    """Views recorded since the last flush, as ``{slug: count}`` without zero counts"""
+    counts = cache.get_many([counter_key(slug) for slug in slugs])
+    return {slug: counts[counter_key(slug)] for slug in slugs if counts.get(counter_key(slug))}
+
+
+def with_pending_views(posts):
+    """Add pending views to ``post.views`` of each post, for display"""
+    posts = list(posts)
+    pending = pending_views([post.slug for post in posts])
+    for post in posts:
+        post.views += pending.get(post.slug, 0)
+    return posts
+
+
+def dirty_slots(batch_size):
+    """The next ``batch_size`` slots of the dirty log that have not been flushed, as a range"""
+    flushed = cache.get(DIRTY_LOG_FLUSHED_KEY, 0)
+    end = cache.get(DIRTY_LOG_END_KEY, 0)
+    return range(flushed + 1, min(end, flushed + batch_size) + 1)
+
+
+def flush_pending_views(batch_size=BATCH_SIZE):
+    """Write pending views to ``Post.views``, returns the number of views flushed"""
+    flushed = 0
+
+    while True:
+        slots = dirty_slots(batch_size)
+        if not slots:
+            break
+        slot_keys = [dirty_slot_key(slot) for slot in slots]
+        batch = set(cache.get_many(slot_keys).values())
+        cache.delete_many([dirty_mark_key(slug) for slug in batch])
+        pending = pending_views(batch)
+        # Views of missing posts are dropped
+        existing = set(Post.objects.filter(slug__in=pending).order_by().values_list('slug', flat=True)) if pending else set()
+        if existing:
+            with transaction.atomic():
+                # An UPDATE, so flushes don't fire save signals or invalidate cached blog pages
+                Post.objects.filter(slug__in=existing).update(views=Case(
+                    *[When(slug=slug, then=F('views') + pending[slug]) for slug in existing],
+                    output_field=PositiveIntegerField(),
+                ))
+            flushed += sum(pending[slug] for slug in existing)
+        for slug, count in pending.items():
+            try:
+                cache.decr(counter_key(slug), count)
+            except ValueError:
+                pass
+        cache.set(DIRTY_LOG_FLUSHED_KEY, slots[-1], None)
+        cache.delete_many(slot_keys)
+    return flushed
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from blog.counters import BATCH_SIZE, flush_pending_views
+
+
+class Command(BaseCommand):
+    help = 'Write buffered blog post views to the database. Run every minute.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Posts updated per batch (default: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        flushed = flush_pending_views(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{flushed} post views flushed'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from blog.recommendations import BATCH_SIZE, rebuild_related_posts
+from core.cache import BLOG, bump_version
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of every published post from shared categories and tags.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Posts written per batch (default: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        count = rebuild_related_posts(batch_size=options['batch_size'])
+        bump_version(BLOG)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed related posts for {count} posts.'))
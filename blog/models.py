@@ -61,3 +61,17 @@ class Post(models.Model):
 
     class Meta:
         ordering = ('-created_at',)
+
+class RelatedPost(models.Model):
+    """A precomputed recommendation, built by ``blog.recommendations``"""
+    post = models.ForeignKey(Post, related_name='related_posts', on_delete=models.CASCADE)
+    related = models.ForeignKey(Post, related_name='recommended_for', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return f'{self.related} for {self.post} (#{self.rank})'
+
+    class Meta:
+        ordering = ('post', 'rank')
+        unique_together = ('post', 'rank')
@@ -0,0 +1,117 @@
+"""
+Precomputed related posts.
+
+The post page reads its related posts from ``RelatedPost`` with one indexed
+lookup on ``(post, rank)``. A published post is scored 2 points for every
+category and 1 point for every tag it shares with the post. Only the newest
+``GROUP_CANDIDATES`` posts of each category and tag are considered, and ties
+go to the newer post.
+
+``blog.signals`` refreshes a post when it or its categories and tags change,
+together with the newest posts of its categories and tags, whose lists it may
+now belong to.
+``manage.py rebuild_related_posts`` rebuilds every post.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from .models import Post, RelatedPost
+
+RELATED_LIMIT = 6
+GROUP_CANDIDATES = 20
+BATCH_SIZE = 500
+
+WEIGHTS = {
+    'category': 2.0,
+    'tag': 1.0,
+}
+RELATIONS = (
+    ('category', Post.categories.through),
+    ('tag', Post.tags.through),
+)
+
+
+def post_groups(post_ids=None):
+    """``{post_id: {(kind, group_id), ...}}`` with the categories and tags of published posts"""
+    groups = defaultdict(set)
+    for kind, relation in RELATIONS:
+        rows = relation.objects.filter(post__status='published')
+        if post_ids is not None:
+            rows = rows.filter(post__in=post_ids)
+        for post_id, group_id in rows.values_list('post_id', f'{kind}_id').iterator(chunk_size=2000):
+            groups[post_id].add((kind, group_id))
+    return groups
+
+
+def group_members(groups):
+    """The newest published posts of each ``(kind, group_id)`` group, newest first"""
+    members = defaultdict(list)
+    for kind, relation in RELATIONS:
+        group_ids = {group_id for group_kind, group_id in groups if group_kind == kind}
+        rows = relation.objects.filter(post__status='published', **{f'{kind}__in': group_ids}).order_by(
+            '-post__created_at', '-post_id'
+        ).values_list(f'{kind}_id', 'post_id')
+        for group_id, post_id in rows.iterator(chunk_size=2000):
+            group = members[(kind, group_id)]
+            # One extra, as a post is among the newest of its own groups
+            if len(group) <= GROUP_CANDIDATES:
+                group.append(post_id)
+    return members
+
+
+def score_posts(post_ids=None):
+    """Return ``{post_id: [(related_id, score), ...]}`` best first, for all published posts or ``post_ids``"""
+    targets = post_groups(post_ids)
+    members = group_members({group for groups in targets.values() for group in groups})
+
+    recommendations = {}
+    published = Post.objects.filter(status='published')
+    if post_ids is not None:
+        published = published.filter(pk__in=post_ids)
+    for post_id in published.values_list('pk', flat=True):
+        scores = Counter()
+        for group in targets.get(post_id, ()):
+            for other in members[group]:
+                if other != post_id:
+                    scores[other] += WEIGHTS[group[0]]
+        # Ties go to the newer post, which has the higher id
+        ranked = sorted((-score, -other, other) for other, score in scores.items())
+        recommendations[post_id] = [(other, -score) for score, _, other in ranked[:RELATED_LIMIT]]
+    return recommendations
+
+
+def save_recommendations(recommendations):
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id__in=recommendations).delete()
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post_id=post_id, related_id=related_id, rank=rank, score=score)
+            for post_id, related in recommendations.items()
+            for rank, (related_id, score) in enumerate(related, start=1)
+        ])
+
+
+def refresh_related_posts(post_ids):
+    """Recompute the related posts of ``post_ids``, clearing them for posts that are not published"""
+    recommendations = score_posts(post_ids)
+    for post_id in post_ids:
+        recommendations.setdefault(post_id, [])
+    save_recommendations(recommendations)
+
+
+def refresh_post_neighbourhood(post_id):
+    """Recompute a changed post and the posts it can now appear next to"""
+    members = group_members(post_groups([post_id]).get(post_id, set()))
+    refresh_related_posts({post_id} | {other for group in members.values() for other in group})
+
+
+def rebuild_related_posts(batch_size=BATCH_SIZE):
+    """Recompute the related posts of every published post, returns the number of posts"""
+    recommendations = score_posts()
+    post_ids = list(recommendations)
+    for start in range(0, len(post_ids), batch_size):
+        save_recommendations({post_id: recommendations[post_id] for post_id in post_ids[start:start + batch_size]})
+    # Drafts keep no recommendations
+    RelatedPost.objects.exclude(post__status='published').delete()
+    return len(post_ids)
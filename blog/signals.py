@@ -0,0 +1,18 @@
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from .models import Post
+from .recommendations import refresh_post_neighbourhood
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, **kwargs):
+    """Refresh the related posts of a post when it is saved, e.g. published"""
+    refresh_post_neighbourhood(instance.pk)
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_groups_changed(sender, instance, action, reverse, **kwargs):
+    """Refresh the related posts of a post when its categories or tags change"""
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        refresh_post_neighbourhood(instance.pk)
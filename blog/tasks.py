@@ -0,0 +1,25 @@
+"""
+Celery tasks for the blog.
+This file can be used with Celery for automated task scheduling.
+"""
+
+from celery import shared_task
+from django.core.management import call_command
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_post_views():
+    """
+    Celery task to write buffered post views to the database.
+    This task should be scheduled to run every minute.
+    """
+    try:
+        call_command('flush_post_views')
+        logger.info("Post views flushed successfully")
+        return "Post views flushed successfully"
+    except Exception as e:
+        logger.error(f"Error flushing post views: {str(e)}")
+        raise e
@@ -1,3 +1,71 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from core.testing import TEST_CACHES
+from .counters import flush_pending_views, record_view, with_pending_views
+from .models import Category, Post, Tag
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PostViewCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create(username='author')
+        self.post = Post.objects.create(title='Pashmina care', author=author, content='Hand wash', status='published')
+
+    def test_views_are_buffered_and_flushed_in_bulk(self):
+        for _ in range(3):
+            self.client.get(self.post.get_absolute_url())
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 0)
+        self.assertEqual(with_pending_views([self.post])[0].views, 3)
+
+        with self.assertNumQueries(4):
+            # The viewed posts that exist, then the UPDATE inside a savepoint
+            self.assertEqual(flush_pending_views(), 3)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(flush_pending_views(), 0)
+
+        # Viewed again after the flush, so logged again
+        self.client.get(self.post.get_absolute_url())
+        self.assertEqual(flush_pending_views(), 1)
+
+    def test_flushes_only_visit_viewed_posts(self):
+        others = [Post(title=f'Post {i}', slug=f'post-{i}', author=self.post.author, content='Text',
+                       status='published') for i in range(20)]
+        Post.objects.bulk_create(others)
+        record_view(self.post.slug)
+        record_view('post-3')
+        record_view('post-3')
+        # One batch for each of the two viewed posts, whatever the number of posts
+        with self.assertNumQueries(8):
+            self.assertEqual(flush_pending_views(batch_size=1), 3)
+        self.assertEqual(Post.objects.get(slug='post-3').views, 2)
+
+    def test_missing_posts_are_not_counted(self):
+        self.client.get('/blog/no-such-post/')
+        self.assertEqual(flush_pending_views(), 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RelatedPostTests(TestCase):
+    def test_related_posts_follow_shared_categories_and_tags(self):
+        author = User.objects.create(username='author')
+        care = Category.objects.create(name='Care')
+        wool = Tag.objects.create(name='Wool')
+        post = Post.objects.create(title='Washing pashmina', author=author, content='Cold water', status='published')
+        same_category = Post.objects.create(title='Storing shawls', author=author, content='Cedar', status='published')
+        same_tag = Post.objects.create(title='Wool grades', author=author, content='Merino', status='published')
+        draft = Post.objects.create(title='Moths', author=author, content='Lavender', status='draft')
+        post.categories.add(care)
+        post.tags.add(wool)
+        same_tag.tags.add(wool)
+        draft.categories.add(care)
+        same_category.categories.add(care)
+
+        self.assertEqual(list(post.related_posts.values_list('related', flat=True)), [same_category.pk, same_tag.pk])
+        self.assertEqual(list(same_category.related_posts.values_list('related', flat=True)), [post.pk])
@@ -1,8 +1,11 @@
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView
-from django.db.models import F
+from django.utils.decorators import method_decorator
+from core.cache import BLOG, cache_public_page
+from .counters import record_view, with_pending_views
 from .models import Post
 
+@method_decorator(cache_public_page([BLOG]), name='dispatch')
 class PostListView(ListView):
     model = Post
     template_name = 'blog/post_list.html'
@@ -16,19 +19,28 @@ class PostDetailView(DetailView):
     context_object_name = 'post'
     slug_url_kwarg = 'slug'
 
+    def get(self, request, *args, **kwargs):
+        response = self.render_post(request, *args, **kwargs)
+        # Counted here, outside the page cache, so cached pages are counted too
+        if response.status_code == 200:
+            record_view(kwargs[self.slug_url_kwarg])
+        return response
+
+    @method_decorator(cache_public_page([BLOG]))
+    def render_post(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        post = self.get_object()
-        # Increment view count without causing a new save signal
-        Post.objects.filter(pk=post.pk).update(views=F('views') + 1)
+        post = self.object
+        with_pending_views([post])
         
-        # Get related posts based on shared categories
-        if post.categories.exists():
-            related_posts = Post.objects.filter(
-                status='published', 
-                categories__in=post.categories.all()
-            ).exclude(pk=post.pk).distinct().order_by('-created_at')[:3]
-            context['related_posts'] = related_posts
+        # Precomputed by blog.recommendations, read in rank order from the (post, rank) index
+        related_posts = Post.objects.filter(
+            status='published',
+            recommended_for__post=post
+        ).order_by('recommended_for__rank')[:3]
+        context['related_posts'] = with_pending_views(related_posts)
             
         return context
 
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import DeliveryCharge
+from django.db.models import Q
+from django.utils import timezone
+from .mail import CLAIM_TIMEOUT
+from .models import DeliveryCharge, OutgoingEmail
 
 # Register your models here.
 
@@ -28,3 +31,24 @@ class DeliveryChargeAdmin(admin.ModelAdmin):
         if obj.is_default:
             DeliveryCharge.objects.filter(is_default=True).exclude(pk=obj.pk).update(is_default=False)
         super().save_model(request, obj, form, change)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'created_at', 'sent_at', 'next_attempt_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['attempts', 'claimed_at', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_emails']
+
+    def recipients(self, obj):
+        return ', '.join(obj.to)
+
+    def retry_emails(self, request, queryset):
+        # A recent claim means a worker may be sending the message right now
+        stale = Q(status='sending', claimed_at__lt=timezone.now() - CLAIM_TIMEOUT)
+        updated = queryset.filter(Q(status='failed') | stale).update(
+            status='queued', attempts=0, claimed_at=None, claim_token='', next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} email(s) queued for another attempt.")
+    retry_emails.short_description = "Retry selected emails"
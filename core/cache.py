@@ -0,0 +1,142 @@
+"""
+Versioned page and fragment caching for the public site.
+
+Every cached entry is keyed with the current version of the content groups it
+was built from. ``catalog`` covers products, media, reviews, categories and
+delivery charges, and ``blog`` covers posts. The receivers in ``core.signals``
+bump a group's version once a transaction saving or deleting one of its models
+commits, so a page rendered meanwhile cannot be cached as current. Old
+entries are then never read again and simply expire. ``delivery`` only covers
+delivery charges and versions the in-process table of ``core.delivery``.
+
+Anonymous visitors get whole pages from ``cache_public_page``. Logged-in users
+see their own header and cart, so their pages are rendered every time, but
+the templates wrap the product grids in ``{% cache %}`` blocks keyed by
+``cache_versions.catalog``.
+"""
+
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+CATALOG = 'catalog'
+BLOG = 'blog'
+DELIVERY = 'delivery'
+DEFAULT_PAGE_CACHE_TIMEOUT = 300
+
+# Cached pages store this marker instead of the CSRF token of the visitor who rendered them
+CSRF_PLACEHOLDER = b'__cached_csrf_token__'
+CSRF_INPUT_PATTERN = re.compile(rb'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def version_key(group):
+    return f'cache:version:{group}'
+
+
+def get_versions(*groups):
+    """Return the current version of each group, starting missing ones at the current time"""
+    keys = [version_key(group) for group in groups]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A time-based start keeps versions increasing even if the key was evicted
+            cache.add(key, time.time_ns() // 1000, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(group):
+    return get_versions(group)[0]
+
+
+def bump_version(*groups):
+    """Invalidate everything cached from ``groups``"""
+    for group in groups:
+        try:
+            cache.incr(version_key(group))
+        except ValueError:
+            cache.set(version_key(group), time.time_ns() // 1000, None)
+
+
+def versioned_key(name, groups, *parts):
+    versions = '.'.join(str(version) for version in get_versions(*groups))
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'{name}:{versions}:{digest}'
+
+
+class CacheVersions:
+    """Template access to group versions, e.g. ``{% cache 600 grid cache_versions.catalog %}``"""
+
+    def __getitem__(self, group):
+        return get_version(group)
+
+
+def get_page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', DEFAULT_PAGE_CACHE_TIMEOUT)
+
+
+def is_cacheable_request(request):
+    """Only anonymous GETs without pending flash messages share cached pages"""
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    if CookieStorage.cookie_name in request.COOKIES:
+        return False
+    return SessionStorage.session_key not in request.session
+
+
+def store_page(request, key, response, timeout):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return
+    content = response.content
+    match = CSRF_INPUT_PATTERN.search(content)
+    if match:
+        content = content.replace(match.group(1), CSRF_PLACEHOLDER)
+    elif request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        # The page used a CSRF token somewhere other than a form input, don't share it
+        return
+    cache.set(key, (content, response['Content-Type']), timeout)
+
+
+def cached_response(request, cached):
+    content, content_type = cached
+    if CSRF_PLACEHOLDER in content:
+        # get_token() also makes the CSRF middleware set the cookie for this visitor
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_public_page(groups, timeout=None, vary_on=None, unless=None):
+    """
+    Cache the full response of a view for anonymous visitors.
+
+    ``groups`` are the content groups the page is built from. ``vary_on`` is an
+    optional callable taking the request and returning extra key material, for
+    pages that differ per visitor. ``unless`` is an optional callable taking
+    the request, which skips the cache for requests it returns True for.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request) or (unless and unless(request)):
+                return view_func(request, *args, **kwargs)
+            extra = vary_on(request) if vary_on else ''
+            key = versioned_key('page', groups, request.get_full_path(), extra)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached_response(request, cached)
+
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            store_page(request, key, response, timeout or get_page_cache_timeout())
+            return response
+        return wrapper
+    return decorator
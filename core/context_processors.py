@@ -1,4 +1,5 @@
-from orders.models import Cart
+from orders.cart_count import get_cart_count
+from .cache import CacheVersions
 
 def cart_context(request):
     """
@@ -6,12 +7,20 @@ def cart_context(request):
     """
     cart_count = 0
     if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_count = cart.get_total_items()
-        except Cart.DoesNotExist:
-            cart_count = 0
+        # Reuse the summary when the view already computed it for this request
+        summary = getattr(request, 'cart_summary', None)
+        if summary is not None:
+            cart_count = summary.total_items
+        else:
+            cart_count = get_cart_count(request.user)
     
     return {
         'cart_count': cart_count
     }
+
+
+def cache_versions(request):
+    """
+    Expose content group versions for keying {% cache %} fragments
+    """
+    return {'cache_versions': CacheVersions()}
@@ -0,0 +1,100 @@
+"""
+In-process delivery charge table.
+
+Product, cart and checkout pages all list the delivery options, and checkout
+prices the shipping of every order. The table is small and rarely changes, so
+each worker loads the active options once and keeps them in memory.
+
+The options are stored sorted by ``min_order_value``. A lookup for an order
+value bisects that list to drop every option whose minimum is higher, and
+then checks the maximum of the rest. The table is tagged with the version of
+the ``delivery`` cache group. The receivers in ``core.signals`` bump that
+version once a transaction saving or deleting a delivery charge commits, so
+no worker reloads the table before it can see the change. Every worker
+reads the shared version once per lookup and reloads its table when the
+version has moved, so an edit in the admin reaches all of them without a
+restart.
+"""
+
+from bisect import bisect_right
+from decimal import Decimal
+from threading import Lock
+
+from .cache import DELIVERY, get_version
+from .models import DeliveryCharge
+
+
+class DeliveryTable:
+    """The active delivery options of one version of the table"""
+
+    def __init__(self, options):
+        self.by_minimum = sorted(options, key=lambda option: (option.min_order_value, option.pk))
+        self.minimums = [option.min_order_value for option in self.by_minimum]
+        # Display order, as DeliveryCharge.Meta.ordering
+        self.options = sorted(options, key=lambda option: (option.charge, option.estimated_days, option.pk))
+        self.by_pk = {option.pk: option for option in options}
+        self.default = next((option for option in self.options if option.is_default), None)
+
+    def available(self, order_value):
+        """Options available for ``order_value``, cheapest first"""
+        candidates = self.by_minimum[:bisect_right(self.minimums, order_value)]
+        candidates = {
+            option.pk for option in candidates
+            if option.max_order_value is None or order_value <= option.max_order_value
+        }
+        return [option for option in self.options if option.pk in candidates]
+
+
+_table = None
+_table_version = None
+_lock = Lock()
+
+
+def get_table():
+    """The current delivery table, reloaded when a delivery charge has changed"""
+    global _table, _table_version
+    version = get_version(DELIVERY)
+    if _table_version != version:
+        with _lock:
+            if _table_version != version:
+                _table = DeliveryTable(list(DeliveryCharge.objects.filter(is_active=True)))
+                _table_version = version
+    return _table
+
+
+def get_delivery_options():
+    """All active delivery options, cheapest first"""
+    return get_table().options
+
+
+def get_default_delivery():
+    return get_table().default
+
+
+def get_available_delivery(order_value):
+    """Delivery options available for an order of ``order_value``, cheapest first"""
+    return get_table().available(order_value)
+
+
+def choose_delivery(order_value, option_id=None):
+    """
+    The delivery option an order of ``order_value`` ships with.
+
+    That is the option ``option_id`` if it is available for the order, else
+    the default option if it is, else the cheapest available one. Returns None
+    when no option is available.
+    """
+    table = get_table()
+    available = table.available(order_value)
+    try:
+        chosen = table.by_pk.get(int(option_id))
+    except (TypeError, ValueError):
+        chosen = None
+    for option in (chosen, table.default):
+        if option is not None and option in available:
+            return option
+    return available[0] if available else None
+
+
+def delivery_charge(option):
+    return option.charge if option is not None else Decimal('0.00')
@@ -0,0 +1,237 @@
+"""
+Transactional email outbox.
+
+``OutboxEmailBackend`` is installed as ``EMAIL_BACKEND``, so every
+``send_mail()`` / ``EmailMessage.send()`` in the project only stores the
+message as an ``OutgoingEmail`` row and returns immediately. The
+``process_email_outbox`` management command drains the outbox. It sends each
+batch over a single connection of ``OUTBOX_DELIVERY_BACKEND`` (SMTP by
+default) and retries failures with exponential backoff.
+
+Attachments given as ``(filename, content, mimetype)`` are stored with the
+message. A message with a prebuilt MIME attachment cannot be stored, so the
+backend hands it straight to the delivery backend instead.
+
+Several workers may drain the outbox at once. Each claims its batch with one
+UPDATE that only matches rows still queued and stamps them with a token of
+its own, then sends just the rows carrying its token. On databases without
+row locks (SQLite), two workers may pick the same candidates, but only one of
+them wins each row.
+"""
+
+import logging
+import uuid
+from base64 import b64decode, b64encode
+from datetime import timedelta
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 60 * 60
+# Messages claimed by a worker that died are handed out again after this long
+CLAIM_TIMEOUT = timedelta(minutes=15)
+
+
+def get_delivery_connection(**kwargs):
+    """Open a connection to the backend that actually delivers outbox mail"""
+    backend = getattr(settings, 'OUTBOX_DELIVERY_BACKEND', DEFAULT_DELIVERY_BACKEND)
+    return get_connection(backend, **kwargs)
+
+
+def can_queue(message):
+    """Whether the outbox can store ``message``, which rules out MIME attachments"""
+    return not any(isinstance(attachment, MIMEBase) for attachment in message.attachments)
+
+
+def outgoing_email(message):
+    """Build an unsaved OutgoingEmail row for an EmailMessage"""
+    if not can_queue(message):
+        raise ValueError('The email outbox does not store MIME attachments.')
+    attachments = []
+    for filename, content, mimetype in message.attachments:
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, b64encode(content).decode('ascii'), mimetype])
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+    return OutgoingEmail(
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=dict(message.extra_headers),
+        attachments=attachments,
+    )
+
+
+def queue_message(message):
+    """Store an EmailMessage in the outbox and return the OutgoingEmail row"""
+    outgoing = outgoing_email(message)
+    outgoing.save()
+    return outgoing
+
+
+def build_message(outgoing, connection=None):
+    """Rebuild the EmailMessage for an OutgoingEmail row"""
+    message = EmailMultiAlternatives(
+        outgoing.subject,
+        outgoing.body,
+        outgoing.from_email,
+        outgoing.to,
+        bcc=outgoing.bcc,
+        connection=connection,
+        headers=outgoing.headers,
+        cc=outgoing.cc,
+        reply_to=outgoing.reply_to,
+    )
+    if outgoing.html_body:
+        message.attach_alternative(outgoing.html_body, 'text/html')
+    for filename, content, mimetype in outgoing.attachments:
+        message.attach(filename, b64decode(content), mimetype)
+    return message
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim(pks, now=None):
+    """
+    Claim the messages of ``pks`` that are still queued and due, and return
+    them. Rows another worker claimed in the meantime are left out.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    OutgoingEmail.objects.filter(pk__in=pks, status='queued', next_attempt_at__lte=now).update(
+        status='sending', claimed_at=now, claim_token=token
+    )
+    return list(OutgoingEmail.objects.filter(claim_token=token, status='sending').order_by('next_attempt_at', 'pk'))
+
+
+def claim_batch(batch_size):
+    """Claim up to ``batch_size`` due messages and return them"""
+    now = timezone.now()
+    OutgoingEmail.objects.filter(status='sending', claimed_at__lt=now - CLAIM_TIMEOUT).update(
+        status='queued', claim_token=''
+    )
+    with transaction.atomic():
+        pks = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        return claim(pks, now)
+
+
+def record_failure(outgoing, error):
+    """Schedule a retry with exponential backoff, or give up after MAX_ATTEMPTS"""
+    outgoing.attempts += 1
+    outgoing.claimed_at = None
+    outgoing.claim_token = ''
+    outgoing.last_error = str(error)
+    if outgoing.attempts >= MAX_ATTEMPTS:
+        outgoing.status = 'failed'
+        logger.error(f"Giving up on email {outgoing.pk} to {outgoing.to} after {outgoing.attempts} attempts: {error}")
+    else:
+        outgoing.status = 'queued'
+        outgoing.next_attempt_at = timezone.now() + retry_delay(outgoing.attempts)
+        logger.warning(f"Email {outgoing.pk} to {outgoing.to} failed (attempt {outgoing.attempts}), will retry: {error}")
+    outgoing.save(update_fields=['status', 'attempts', 'claimed_at', 'claim_token', 'last_error', 'next_attempt_at'])
+
+
+def deliver(outgoing, connection):
+    """Send one message over an open connection and record the outcome"""
+    try:
+        build_message(outgoing, connection=connection).send(fail_silently=False)
+    except Exception as e:
+        record_failure(outgoing, e)
+        return False
+
+    outgoing.attempts += 1
+    outgoing.claimed_at = None
+    outgoing.claim_token = ''
+    outgoing.status = 'sent'
+    outgoing.sent_at = timezone.now()
+    outgoing.last_error = ''
+    outgoing.save(update_fields=['status', 'attempts', 'claimed_at', 'claim_token', 'last_error', 'sent_at'])
+    return True
+
+
+def process_outbox(batch_size=50, max_batches=None):
+    """
+    Drain due messages from the outbox, one delivery connection per batch.
+
+    Returns a ``(sent, failed)`` tuple of counts.
+    """
+    sent = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+        batches += 1
+        connection = get_delivery_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Could not connect to the mail server: {e}")
+            for outgoing in batch:
+                record_failure(outgoing, e)
+            failed += len(batch)
+            continue
+        try:
+            for outgoing in batch:
+                if deliver(outgoing, connection):
+                    sent += 1
+                else:
+                    failed += 1
+        finally:
+            connection.close()
+    return sent, failed
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Email backend that queues messages in the outbox instead of sending them"""
+
+    def send_messages(self, email_messages):
+        rows = []
+        direct = []
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            if not can_queue(message):
+                direct.append(message)
+                continue
+            try:
+                rows.append(outgoing_email(message))
+            except Exception:
+                if not self.fail_silently:
+                    raise
+        sent = 0
+        if direct:
+            sent = get_delivery_connection(fail_silently=self.fail_silently).send_messages(direct) or 0
+        # One INSERT for the whole batch, so bulk senders don't pay a round trip per message
+        try:
+            OutgoingEmail.objects.bulk_create(rows, batch_size=500)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return sent
+        return sent + len(rows)
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from core.pagination import KeysetPaginator
+from newsletter.models import Subscriber
+
+
+class Command(BaseCommand):
+    help = 'Time offset and keyset pages of the subscriber list at increasing depths (everything is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of subscribers to generate (default: 100000)')
+        parser.add_argument('--per-page', type=int, default=10, help='Rows per page (default: 10)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timings per page, the median is reported (default: 5)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def run(self, options):
+        rows, per_page = options['rows'], options['per_page']
+        started = time.perf_counter()
+        Subscriber.objects.bulk_create(
+            [Subscriber(email=f'benchmark-pagination-{i}@example.com') for i in range(rows)],
+            batch_size=5000,
+        )
+        self.stdout.write(f'Generated {rows} subscribers in {time.perf_counter() - started:.1f}s')
+
+        queryset = Subscriber.objects.all()
+        ordered = queryset.order_by('-created_at', '-id')
+        keyset = KeysetPaginator(queryset, per_page)
+        last_page = Paginator(ordered, per_page).num_pages
+        pages = sorted({1, 10, 100, 1000, 10000, last_page // 2, last_page} & set(range(1, last_page + 1)))
+
+        for number in pages:
+            # The cursor a reader following Next links would arrive with
+            offset = (number - 1) * per_page
+            cursor = keyset.encode_cursor(ordered[offset - 1]) if offset else None
+            # A new Paginator per request, so each page pays for its COUNT as the views did
+            offset_time = self.time(lambda: list(Paginator(ordered, per_page).page(number)), options['repeat'])
+            keyset_time = self.time(lambda: list(keyset.get_page(after=cursor)), options['repeat'])
+            self.stdout.write(f'page {number}: offset {offset_time * 1000:.2f}ms, keyset {keyset_time * 1000:.2f}ms')
+
+    def time(self, read_page, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            read_page()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from core.mail import get_delivery_connection
 import os
 
 class Command(BaseCommand):
@@ -27,7 +28,8 @@ class Command(BaseCommand):
                 subject,
                 text_content,
                 settings.DEFAULT_FROM_EMAIL,
-                [os.getenv('EMAIL_HOST_USER')]  # Send to self
+                [os.getenv('EMAIL_HOST_USER')],  # Send to self
+                connection=get_delivery_connection(),  # Bypass the outbox to test SMTP directly
             )
             email.attach_alternative(html_content, "text/html")
             email.send()
@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from blog.models import Post
+from products.models import Product, ProductCategory, ProductMedia
+from .cache import BLOG, CATALOG, DELIVERY, bump_version
+from .models import DeliveryCharge
+
+# Reviews only show once approved, products.signals bumps the catalog for them
+CATALOG_MODELS = (Product, ProductCategory, ProductMedia, DeliveryCharge)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_page_cache(sender, **kwargs):
+    """Expire cached pages and fragments built from the model that changed"""
+    if sender is DeliveryCharge:
+        transaction.on_commit(lambda: bump_version(CATALOG, DELIVERY))
+    elif sender in CATALOG_MODELS:
+        transaction.on_commit(lambda: bump_version(CATALOG))
+    elif sender is Post:
+        transaction.on_commit(lambda: bump_version(BLOG))
@@ -0,0 +1,48 @@
+"""
+Settings and stand-ins shared by the test suites.
+"""
+
+from smtplib import SMTPException, SMTPServerDisconnected
+
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class SMTPStandIn(LocmemEmailBackend):
+    """
+    Delivery backend with a scripted mail server. It refuses connections while
+    ``refuse_connections`` is set, drops the next ``disconnects`` calls to
+    ``send_messages()`` and fails the next ``failures`` messages.
+    """
+
+    refuse_connections = False
+    disconnects = 0
+    failures = 0
+
+    @classmethod
+    def reset(cls):
+        cls.refuse_connections = False
+        cls.disconnects = 0
+        cls.failures = 0
+
+    def open(self):
+        if SMTPStandIn.refuse_connections:
+            raise ConnectionRefusedError('Connection refused')
+        return super().open()
+
+    def send_messages(self, messages):
+        if SMTPStandIn.disconnects:
+            SMTPStandIn.disconnects -= 1
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        for message in messages:
+            if SMTPStandIn.failures:
+                SMTPStandIn.failures -= 1
+                raise SMTPException('451 Try again later')
+            super().send_messages([message])
+        return len(messages)
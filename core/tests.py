@@ -1,3 +1,184 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from email.mime.text import MIMEText
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from newsletter.models import Subscriber
+from products.models import Product, Review
+from .cache import CSRF_PLACEHOLDER
+from .mail import RETRY_BASE_SECONDS, claim, claim_batch, process_outbox
+from .models import OutgoingEmail
+from .pagination import KeysetPaginator
+from .testing import TEST_CACHES, SMTPStandIn
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'),
+                                              stock_quantity=3)
+
+    def test_anonymous_pages_are_cached_until_the_catalog_changes(self):
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Shawl')
+
+        self.product.name = 'Silk Shawl'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.save()
+        # Until the change commits, the cached page stays current
+        self.assertNotContains(self.client.get(url), 'Silk Shawl')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(url), 'Silk Shawl')
+
+    def test_pending_reviews_leave_cached_pages_alone(self):
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.product, author='Ali', comment='Lovely', status='Pending')
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review.status = 'Approved'
+            review.save()
+        self.assertContains(self.client.get(url), 'Lovely')
+
+    def test_cached_pages_get_the_visitors_csrf_token(self):
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        visitor = self.client_class()
+        response = visitor.get(url)
+        self.assertNotIn(CSRF_PLACEHOLDER, response.content)
+        self.assertIn('csrftoken', response.cookies)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        Subscriber.objects.bulk_create([Subscriber(email=f'reader{i}@example.com') for i in range(7)])
+        # Rows sharing a timestamp are told apart by id
+        Subscriber.objects.filter(pk__in=Subscriber.objects.order_by('pk').values('pk')[2:5]).update(
+            created_at=Subscriber.objects.order_by('pk')[2].created_at
+        )
+        self.paginator = KeysetPaginator(Subscriber.objects.all(), 3, total=7)
+        self.expected = list(Subscriber.objects.order_by('-created_at', '-id'))
+
+    def test_walks_forwards_and_back_through_every_row_once(self):
+        with self.assertNumQueries(1):
+            first = self.paginator.get_page()
+        second = self.paginator.get_page(after=first.next_cursor)
+        third = self.paginator.get_page(after=second.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), self.expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+        self.assertEqual(third.total, 7)
+
+        back = self.paginator.get_page(before=third.previous_cursor)
+        self.assertEqual(list(back), list(second))
+        back = self.paginator.get_page(before=back.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_cursors_past_the_end_give_the_last_page(self):
+        last = self.paginator.get_page(after=self.paginator.encode_cursor(self.expected[-1]))
+        self.assertEqual(list(last), self.expected[-3:])
+        self.assertFalse(last.has_next())
+        back = self.paginator.get_page(before=last.previous_cursor)
+        self.assertEqual(list(back), self.expected[1:4])
+
+    def test_invalid_cursors_give_the_first_page(self):
+        for cursor in ('garbage', 'WyJ4Il0', '!!!'):
+            self.assertEqual(list(self.paginator.get_page(after=cursor)), self.expected[:3])
+
+
+@override_settings(CACHES=TEST_CACHES, EMAIL_BACKEND='core.mail.OutboxEmailBackend', OUTBOX_DELIVERY_BACKEND='core.testing.SMTPStandIn')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        SMTPStandIn.reset()
+
+    def queue(self, count=1):
+        for i in range(count):
+            mail.send_mail(f'Order {i}', 'Thank you', 'shop@example.com', [f'buyer{i}@example.com'])
+
+    def test_messages_are_queued_then_delivered(self):
+        message = mail.EmailMessage('Invoice', 'Attached', 'shop@example.com', ['buyer@example.com'])
+        message.attach('invoice.txt', 'Total: 1000', 'text/plain')
+        message.send()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutgoingEmail.objects.get().status, 'queued')
+
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments, [('invoice.txt', 'Total: 1000', 'text/plain')])
+        self.assertEqual(OutgoingEmail.objects.get().status, 'sent')
+
+    def test_mime_attachments_are_delivered_directly(self):
+        message = mail.EmailMessage('Invoice', 'Attached', 'shop@example.com', ['buyer@example.com'])
+        message.attach(MIMEText('Total: 1000'))
+        message.send()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_failures_are_retried_with_backoff(self):
+        self.queue()
+        SMTPStandIn.failures = 1
+        before = timezone.now()
+        self.assertEqual(process_outbox(), (0, 1))
+        outgoing = OutgoingEmail.objects.get()
+        self.assertEqual((outgoing.status, outgoing.attempts), ('queued', 1))
+        self.assertIn('451', outgoing.last_error)
+        self.assertGreaterEqual(outgoing.next_attempt_at, before + timedelta(seconds=RETRY_BASE_SECONDS))
+
+        # Not due yet
+        self.assertEqual(process_outbox(), (0, 0))
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_stale_claims_are_handed_out_again(self):
+        self.queue(2)
+        stale, fresh = OutgoingEmail.objects.order_by('pk')
+        OutgoingEmail.objects.filter(pk=stale.pk).update(status='sending', claimed_at=timezone.now() - timedelta(hours=1))
+        OutgoingEmail.objects.filter(pk=fresh.pk).update(status='sending', claimed_at=timezone.now())
+        self.assertEqual([outgoing.pk for outgoing in claim_batch(10)], [stale.pk])
+
+    def test_concurrent_workers_never_claim_the_same_message(self):
+        self.queue(3)
+        # Both workers read the same candidates before either claims them
+        pks = list(OutgoingEmail.objects.values_list('pk', flat=True))
+        first = claim(pks)
+        second = claim(pks)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(second, [])
+        self.assertEqual(claim_batch(10), [])
+
+    def test_retry_action_requeues_failed_and_stale_messages_only(self):
+        self.queue(4)
+        failed, stale, claimed, queued = OutgoingEmail.objects.order_by('pk')
+        OutgoingEmail.objects.filter(pk=failed.pk).update(status='failed', attempts=5)
+        OutgoingEmail.objects.filter(pk=stale.pk).update(
+            status='sending', claimed_at=timezone.now() - timedelta(hours=1), claim_token='gone'
+        )
+        OutgoingEmail.objects.filter(pk=claimed.pk).update(status='sending', claimed_at=timezone.now(), claim_token='busy')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.client.post(reverse('admin:core_outgoingemail_changelist'), {
+            'action': 'retry_emails',
+            '_selected_action': [failed.pk, stale.pk, claimed.pk, queued.pk],
+        })
+
+        statuses = dict(OutgoingEmail.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {failed.pk: 'queued', stale.pk: 'queued', claimed.pk: 'sending', queued.pk: 'queued'})
+        self.assertEqual(OutgoingEmail.objects.get(pk=failed.pk).attempts, 0)
+        self.assertEqual(OutgoingEmail.objects.get(pk=stale.pk).claim_token, '')
+        self.assertEqual(OutgoingEmail.objects.get(pk=claimed.pk).claim_token, 'busy')
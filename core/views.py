@@ -1,13 +1,17 @@
 import os
 from django.views.generic import TemplateView
 from django.conf import settings
+from django.core.paginator import Paginator
 from django.shortcuts import render
-from django.db.models import Q
 from products.models import Product, Review, ProductCategory
+from products.search import search_products, search_categories
 from blog.models import Post
+from .cache import BLOG, CATALOG, cache_public_page
 
 # Create your views here.
 
+SEARCH_RESULTS_PER_PAGE = 24
+
 class TermsOfUseView(TemplateView):
     template_name = 'core/terms_of_use.html'
 
@@ -21,17 +25,19 @@ class AboutView(TemplateView):
     template_name = 'core/about.html'
 
 
+@cache_public_page([CATALOG, BLOG])
 def home(request):
     """
     View for the homepage, passing featured content to the template.
     """
     # Get all products and categories, fallback to all if no featured/published items
-    featured_products = Product.objects.filter(is_featured=True, is_active=True)[:8]
+    products = Product.objects.with_primary_media()
+    featured_products = products.filter(is_featured=True, is_active=True)[:8]
     if not featured_products:
-        featured_products = Product.objects.filter(is_active=True)[:8]
+        featured_products = products.filter(is_active=True)[:8]
     
     categories = ProductCategory.objects.all()[:6]
-    new_arrivals = Product.objects.filter(is_active=True).order_by('-created_at')[:4]
+    new_arrivals = products.filter(is_active=True).order_by('-created_at')[:4]
     
     # Get published posts, fallback to all if none published
     latest_posts = Post.objects.filter(status='published').order_by('-created_at')[:3]
@@ -55,24 +61,21 @@ def home(request):
 
 def search(request):
     query = request.GET.get('q', '')
-    product_results = []
+    product_results = Product.objects.none()
     category_results = []
     
     if query:
-        product_results = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(sku__icontains=query)
-        ).distinct()
+        product_results = search_products(Product.objects.with_primary_media(), query)
+        category_results = list(search_categories(ProductCategory.objects.all(), query))
 
-        category_results = ProductCategory.objects.filter(
-            Q(name__icontains=query)
-        ).distinct()
+    # Counted and paged inside the search query
+    page_obj = Paginator(product_results, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
 
     context = {
         'query': query,
-        'product_results': product_results,
+        'product_results': page_obj,
+        'page_obj': page_obj,
         'category_results': category_results,
-        'total_results': len(product_results)
+        'total_results': page_obj.paginator.count,
     }
     return render(request, 'core/search_results.html', context)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import path
 from django.shortcuts import redirect
-from .models import Subscriber
+from .models import Subscriber, Campaign
 from .views import compose_newsletter_view
 
 class SubscriberAdmin(admin.ModelAdmin):
@@ -18,3 +18,13 @@ class SubscriberAdmin(admin.ModelAdmin):
 
 admin.site.register(Subscriber, SubscriberAdmin)
 
+
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'sent_count', 'failed_count', 'total_recipients', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject',)
+    readonly_fields = ('total_recipients', 'sent_count', 'failed_count', 'last_subscriber_id', 'last_error',
+                       'started_at', 'heartbeat_at', 'finished_at')
+
+admin.site.register(Campaign, CampaignAdmin)
+
@@ -0,0 +1,180 @@
+"""
+Newsletter campaign delivery.
+
+Campaigns are created by the compose views and delivered by the
+``send_newsletter_campaigns`` management command. Subscribers are read in
+primary key chunks and every subscriber gets their own message, so addresses
+are never shared. Each chunk goes over one pooled SMTP connection, throttled
+to ``NEWSLETTER_SEND_RATE`` messages per second. Progress is saved after
+every chunk, and a campaign whose worker stopped heartbeating is picked up
+again from its last chunk. When the mail server cannot be reached at all, the
+worker stops without moving the cursor, so the chunk is retried once the
+campaign goes stale.
+"""
+
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from core.mail import get_delivery_connection
+from .models import Campaign, Subscriber
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_SEND_RATE = 10
+# A sending campaign without a heartbeat for this long is assumed to have crashed
+STALE_CAMPAIGN_TIMEOUT = timedelta(minutes=10)
+
+
+def create_campaign(subject, message, logo_url=None):
+    """Render the newsletter once and queue it for delivery"""
+    html_content = render_to_string('newsletter/email/newsletter_template.html', {
+        'subject': subject,
+        'message': message,
+        'logo_url': logo_url,
+    })
+    return Campaign.objects.create(
+        subject=subject,
+        text_content=strip_tags(html_content),
+        html_content=html_content,
+        total_recipients=Subscriber.objects.count(),
+    )
+
+
+class RateLimiter:
+    """Spaces out calls to at most ``rate`` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def claim_campaign():
+    """Take the next queued or stalled campaign, or return None"""
+    now = timezone.now()
+    candidates = Campaign.objects.filter(status='queued') | Campaign.objects.filter(
+        status='sending', heartbeat_at__lt=now - STALE_CAMPAIGN_TIMEOUT
+    )
+    for campaign in candidates.order_by('created_at')[:5]:
+        # The conditional update makes sure only one worker wins the campaign
+        claimed = Campaign.objects.filter(
+            pk=campaign.pk, status=campaign.status, heartbeat_at=campaign.heartbeat_at
+        ).update(status='sending', heartbeat_at=now, started_at=campaign.started_at or now)
+        if claimed:
+            campaign.refresh_from_db()
+            return campaign
+    return None
+
+
+def build_message(campaign, email, connection):
+    message = EmailMultiAlternatives(
+        campaign.subject,
+        campaign.text_content,
+        settings.DEFAULT_FROM_EMAIL,
+        [email],
+        connection=connection,
+    )
+    message.attach_alternative(campaign.html_content, 'text/html')
+    return message
+
+
+def send_chunk(campaign, emails, limiter):
+    """
+    Send one message per address over a single connection, returns (sent, failed, last_error).
+
+    Raises the connection error if the mail server cannot be reached, before anything is sent.
+    """
+    sent = failed = 0
+    last_error = ''
+    connection = get_delivery_connection(fail_silently=False)
+    connection.open()
+    try:
+        for email in emails:
+            limiter.wait()
+            try:
+                try:
+                    build_message(campaign, email, connection).send(fail_silently=False)
+                except smtplib.SMTPServerDisconnected:
+                    # The server dropped the pooled connection: reconnect and retry this recipient once
+                    connection.close()
+                    connection.open()
+                    build_message(campaign, email, connection).send(fail_silently=False)
+            except Exception as e:
+                failed += 1
+                last_error = f'{email}: {e}'
+                logger.warning(f"Newsletter '{campaign.subject}' could not be sent to {email}: {e}")
+                continue
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed, last_error
+
+
+def send_campaign(campaign, chunk_size=None, rate=None):
+    """
+    Deliver a claimed campaign from its saved cursor until every subscriber is
+    done, or until the mail server cannot be reached
+    """
+    chunk_size = chunk_size or getattr(settings, 'NEWSLETTER_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    rate = rate if rate is not None else getattr(settings, 'NEWSLETTER_SEND_RATE', DEFAULT_SEND_RATE)
+    limiter = RateLimiter(rate)
+    cursor = campaign.last_subscriber_id
+
+    while True:
+        chunk = list(
+            Subscriber.objects.filter(pk__gt=cursor).order_by('pk').values_list('pk', 'email')[:chunk_size]
+        )
+        if not chunk:
+            break
+        try:
+            sent, failed, last_error = send_chunk(campaign, [email for _, email in chunk], limiter)
+        except Exception as e:
+            # Nothing of the chunk was sent; keep the cursor so it is retried when the campaign goes stale
+            logger.error(f"Newsletter '{campaign.subject}' paused, could not connect to the mail server: {e}")
+            Campaign.objects.filter(pk=campaign.pk).update(last_error=f'Could not connect to the mail server: {e}')
+            campaign.refresh_from_db()
+            return campaign
+        cursor = chunk[-1][0]
+        updates = {
+            'sent_count': F('sent_count') + sent,
+            'failed_count': F('failed_count') + failed,
+            'last_subscriber_id': cursor,
+            'heartbeat_at': timezone.now(),
+        }
+        if last_error:
+            updates['last_error'] = last_error
+        Campaign.objects.filter(pk=campaign.pk).update(**updates)
+
+    now = timezone.now()
+    Campaign.objects.filter(pk=campaign.pk).update(status='completed', finished_at=now, heartbeat_at=now)
+    campaign.refresh_from_db()
+    logger.info(f"Newsletter '{campaign.subject}' finished: {campaign.sent_count} sent, {campaign.failed_count} failed")
+    return campaign
+
+
+def send_pending_campaigns(chunk_size=None, rate=None):
+    """Deliver every queued or stalled campaign, returns the number of campaigns processed"""
+    processed = 0
+    while True:
+        campaign = claim_campaign()
+        if campaign is None:
+            return processed
+        send_campaign(campaign, chunk_size=chunk_size, rate=rate)
+        processed += 1
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from newsletter.delivery import send_pending_campaigns
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued newsletter campaigns and resumes interrupted ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Subscribers sent per SMTP connection')
+        parser.add_argument('--rate', type=float, help='Maximum messages per second')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new campaigns')
+        parser.add_argument('--interval', type=float, default=30.0, help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = send_pending_campaigns(chunk_size=options['chunk_size'], rate=options['rate'])
+            if processed:
+                self.stdout.write(f'Delivered {processed} campaign(s).')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Newsletter campaigns processed.'))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Subscriber(models.Model):
     email = models.EmailField(unique=True)
@@ -6,3 +7,60 @@ class Subscriber(models.Model):
 
     def __str__(self):
         return self.email
+
+    class Meta:
+        indexes = [
+            # Keyset pages of the subscriber list, see core.pagination
+            models.Index(fields=['created_at', 'id'], name='newsletter_sub_created_idx'),
+        ]
+
+
+class Campaign(models.Model):
+    """A newsletter send, delivered per recipient by newsletter.delivery"""
+
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('completed', 'Completed'),
+    )
+
+    subject = models.CharField(max_length=200)
+    text_content = models.TextField()
+    html_content = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+
+    # Delivery progress; subscribers are sent in primary key order, so
+    # last_subscriber_id is where an interrupted campaign resumes.
+    total_recipients = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    last_subscriber_id = models.PositiveBigIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'heartbeat_at'], name='newsletter_campaign_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+    def get_progress_percent(self):
+        if not self.total_recipients:
+            return 100 if self.status == 'completed' else 0
+        return min(100, round((self.sent_count + self.failed_count) * 100 / self.total_recipients))
+
+    def get_throughput(self):
+        """Messages handled per minute since the campaign started"""
+        if not self.started_at:
+            return 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return 0
+        return round((self.sent_count + self.failed_count) * 60 / elapsed, 1)
@@ -1,3 +1,85 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.testing import TEST_CACHES, SMTPStandIn
+from .delivery import STALE_CAMPAIGN_TIMEOUT, claim_campaign, send_pending_campaigns
+from .models import Campaign, Subscriber
+
+
+@override_settings(CACHES=TEST_CACHES, OUTBOX_DELIVERY_BACKEND='core.testing.SMTPStandIn', NEWSLETTER_SEND_RATE=0)
+class CampaignDeliveryTests(TestCase):
+    def setUp(self):
+        SMTPStandIn.reset()
+        self.subscribers = Subscriber.objects.bulk_create(
+            [Subscriber(email=f'reader{i}@example.com') for i in range(5)]
+        )
+        self.campaign = Campaign.objects.create(subject='Autumn', text_content='News', html_content='<p>News</p>',
+                                                total_recipients=5)
+
+    def recipients(self):
+        return [message.to[0] for message in mail.outbox]
+
+    def test_every_subscriber_gets_their_own_message(self):
+        self.assertEqual(send_pending_campaigns(chunk_size=2), 1)
+        self.assertEqual(self.recipients(), [subscriber.email for subscriber in self.subscribers])
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count), ('completed', 5))
+
+    def test_stalled_campaigns_resume_from_their_cursor(self):
+        Campaign.objects.filter(pk=self.campaign.pk).update(
+            status='sending', sent_count=2, last_subscriber_id=self.subscribers[1].pk,
+            heartbeat_at=timezone.now() - STALE_CAMPAIGN_TIMEOUT - timedelta(minutes=1),
+        )
+        send_pending_campaigns(chunk_size=2)
+        self.assertEqual(self.recipients(), [subscriber.email for subscriber in self.subscribers[2:]])
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count), ('completed', 5))
+
+    def test_campaigns_with_a_live_heartbeat_are_not_taken_over(self):
+        Campaign.objects.filter(pk=self.campaign.pk).update(status='sending', heartbeat_at=timezone.now())
+        self.assertIsNone(claim_campaign())
+        Campaign.objects.filter(pk=self.campaign.pk).update(heartbeat_at=timezone.now() - STALE_CAMPAIGN_TIMEOUT)
+        self.assertEqual(claim_campaign(), self.campaign)
+        # The new worker's heartbeat keeps others away
+        self.assertIsNone(claim_campaign())
+
+    def test_unreachable_server_pauses_without_moving_the_cursor(self):
+        SMTPStandIn.refuse_connections = True
+        send_pending_campaigns(chunk_size=2)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, 'sending')
+        self.assertEqual((self.campaign.last_subscriber_id, self.campaign.failed_count), (0, 0))
+        self.assertIn('Connection refused', self.campaign.last_error)
+
+        SMTPStandIn.refuse_connections = False
+        Campaign.objects.filter(pk=self.campaign.pk).update(heartbeat_at=timezone.now() - STALE_CAMPAIGN_TIMEOUT)
+        send_pending_campaigns(chunk_size=2)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_dropped_connections_are_reopened(self):
+        SMTPStandIn.disconnects = 1
+        send_pending_campaigns(chunk_size=5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.sent_count, self.campaign.failed_count), (5, 0))
+
+    def test_failed_reconnects_only_fail_that_recipient(self):
+        SMTPStandIn.disconnects = 1
+        # The first open succeeds, the reconnect after the disconnect is refused
+        opens = [None, ConnectionRefusedError('Connection refused')]
+        original_open = SMTPStandIn.open
+
+        def scripted_open(backend):
+            if opens and opens.pop(0):
+                raise ConnectionRefusedError('Connection refused')
+            return original_open(backend)
+
+        with mock.patch.object(SMTPStandIn, 'open', scripted_open):
+            send_pending_campaigns(chunk_size=5)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.sent_count, self.campaign.failed_count), (4, 1))
+        self.assertEqual(self.campaign.status, 'completed')
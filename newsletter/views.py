@@ -1,12 +1,10 @@
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.shortcuts import render
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
 from django.conf import settings
 from .forms import SubscriberForm, NewsletterCreationForm
 from .models import Subscriber
-from django.utils.html import strip_tags
+from .delivery import create_campaign
 from django.http import JsonResponse
 
 def subscribe(request):
@@ -36,28 +34,10 @@ def compose_newsletter_view(request):
             subject = form.cleaned_data['subject']
             message = form.cleaned_data['message']
             
-            subscribers = Subscriber.objects.all()
-            recipient_list = [subscriber.email for subscriber in subscribers]
-
             logo_url = request.build_absolute_uri(settings.MEDIA_URL + 'red_sun_logo.png')
-
-            html_content = render_to_string('newsletter/email/newsletter_template.html', {
-                'subject': subject,
-                'message': message,
-                'logo_url': logo_url,
-            })
-            text_content = strip_tags(html_content)
-
-            email = EmailMultiAlternatives(
-                subject,
-                text_content,
-                settings.DEFAULT_FROM_EMAIL,
-                recipient_list
-            )
-            email.attach_alternative(html_content, "text/html")
-            email.send()
+            campaign = create_campaign(subject, message, logo_url=logo_url)
             
-            messages.success(request, 'Newsletter sent successfully!')
+            messages.success(request, f'Newsletter queued for {campaign.total_recipients} subscribers.')
             return redirect('admin:newsletter_subscriber_changelist')
     else:
         form = NewsletterCreationForm()
@@ -0,0 +1,276 @@
+"""
+Abandoned cart scanning and reminder emails.
+
+``send_abandoned_cart_emails`` runs this pipeline. Due reminders are picked
+with database-side time predicates and handled in primary key batches. Each
+batch loads the products of all of its snapshots in one query, renders the
+emails, and sends them with a single ``send_messages()`` call on a shared
+connection. The reminder flags are then set with one UPDATE. With the
+default outbox backend, queueing a batch and flagging it commit in the same
+transaction, so a reminder is never queued twice. A reminder that cannot be
+rendered, e.g. because of a malformed snapshot, is logged and left out of
+its batch; it stays unflagged without holding up the rest.
+
+Cart views do not write AbandonedCart records themselves. They only bump
+``Cart.updated_at`` through ``Cart.touch()``. ``track_abandoned_carts`` later
+snapshots every cart that has changed since its record was written and has
+then been idle for ``ABANDONED_CART_TRACKING_DELAY`` minutes. A burst of
+cart edits therefore produces a single snapshot.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Exists, OuterRef, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from products.models import Product, primary_media_prefetch
+from .models import AbandonedCart, Cart, CartItem, CartSummary
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+CART_REMINDER_DELAY = timedelta(hours=2)
+CHECKOUT_REMINDER_DELAY = timedelta(hours=1)
+# Minutes a changed cart has to stay untouched before it is snapshotted
+DEFAULT_TRACKING_DELAY = 5
+
+REMINDERS = {
+    'cart': {
+        'subject': 'Your Cart is Waiting - Oraagh',
+        'template': 'orders/email/abandoned_cart_reminder.html',
+        'flag': 'cart_reminder_sent',
+        'sent_at': 'cart_reminder_sent_at',
+    },
+    'checkout': {
+        'subject': 'Complete Your Order - Oraagh',
+        'template': 'orders/email/abandoned_checkout_reminder.html',
+        'flag': 'checkout_reminder_sent',
+        'sent_at': 'checkout_reminder_sent_at',
+    },
+}
+
+
+class SnapshotItem:
+    """A cart item rebuilt from a snapshot, with the interface the reminder templates use"""
+
+    def __init__(self, product, quantity, subtotal):
+        self.product = product
+        self.quantity = quantity
+        self._subtotal = subtotal
+
+    def get_subtotal(self):
+        return self._subtotal
+
+
+class EmailRequest:
+    """Stands in for the request in email templates that build absolute URLs"""
+    scheme = 'https'
+
+    def get_host(self):
+        return getattr(settings, 'SITE_DOMAIN', 'oraagh.com')
+
+
+def due_reminders(stage, now=None):
+    """AbandonedCart rows whose ``stage`` reminder is due, filtered in the database"""
+    now = now or timezone.now()
+    queryset = AbandonedCart.objects.filter(stage=stage, is_recovered=False).exclude(user__email='')
+    if stage == 'cart':
+        return queryset.filter(cart_reminder_sent=False, last_activity_at__lte=now - CART_REMINDER_DELAY)
+    return queryset.filter(checkout_reminder_sent=False, checkout_started_at__lte=now - CHECKOUT_REMINDER_DELAY)
+
+
+def load_snapshot_products(abandoned_carts):
+    """Fetch every product referenced by the snapshots in one query, keyed by id"""
+    product_ids = {
+        item.get('product_id')
+        for abandoned_cart in abandoned_carts
+        if isinstance(abandoned_cart.cart_items_snapshot, list)
+        for item in abandoned_cart.cart_items_snapshot
+        if isinstance(item, dict)
+    }
+    product_ids.discard(None)
+    if not product_ids:
+        return {}
+    return Product.objects.with_primary_media().in_bulk(product_ids)
+
+
+def snapshot_items(snapshot, products):
+    """Rebuild template items from a snapshot, skipping products that were deleted"""
+    return [
+        SnapshotItem(products[item['product_id']], item['quantity'], item['subtotal'])
+        for item in snapshot
+        if item['product_id'] in products
+    ]
+
+
+def build_reminder(stage, abandoned_cart, products, connection):
+    reminder = REMINDERS[stage]
+    html_message = render_to_string(reminder['template'], {
+        'user': abandoned_cart.user,
+        'cart_items': snapshot_items(abandoned_cart.cart_items_snapshot, products),
+        'cart_total': abandoned_cart.cart_total,
+        'request': EmailRequest(),
+    })
+    message = EmailMultiAlternatives(
+        reminder['subject'],
+        strip_tags(html_message),
+        settings.DEFAULT_FROM_EMAIL,
+        [abandoned_cart.user.email],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def send_reminders(stage, connection=None, batch_size=BATCH_SIZE, now=None):
+    """
+    Send every due ``stage`` reminder.
+
+    Returns a ``(sent, failed)`` tuple of counts. Reminders that could not be
+    built, batches that could not be sent, and every due reminder when the
+    mail server cannot be reached, stay unflagged and are picked up again by
+    the next run.
+    """
+    reminder = REMINDERS[stage]
+    now = now or timezone.now()
+    queryset = due_reminders(stage, now).select_related('user').order_by('pk')
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    cursor = 0
+
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not connect to the mail server to send {stage} reminders: {e}")
+        return 0, queryset.count()
+    try:
+        while True:
+            batch = list(queryset.filter(pk__gt=cursor)[:batch_size])
+            if not batch:
+                break
+            cursor = batch[-1].pk
+            products = load_snapshot_products(batch)
+            messages = {}
+            for abandoned_cart in batch:
+                try:
+                    messages[abandoned_cart.pk] = build_reminder(stage, abandoned_cart, products, connection)
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"Could not build the {stage} reminder for abandoned cart {abandoned_cart.pk}: {e}")
+            if not messages:
+                continue
+            try:
+                with transaction.atomic():
+                    connection.send_messages(list(messages.values()))
+                    AbandonedCart.objects.filter(pk__in=list(messages)).update(
+                        **{reminder['flag']: True, reminder['sent_at']: now}
+                    )
+            except Exception as e:
+                failed += len(messages)
+                logger.error(f"Failed to send {len(messages)} {stage} reminders: {e}")
+                continue
+            sent += len(messages)
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def cart_snapshot(items):
+    """JSON snapshot of cart items, stored on AbandonedCart.cart_items_snapshot"""
+    snapshot = []
+    for item in items:
+        media = item.product.primary_media
+        snapshot.append({
+            'product_id': item.product.id,
+            'product_name': item.product.name,
+            'product_price': str(item.product.price),
+            'quantity': item.quantity,
+            'subtotal': str(item.get_subtotal()),
+            'product_image': media.rendition_url('thumbnail') if media else None,
+        })
+    return snapshot
+
+
+def get_tracking_delay():
+    return timedelta(minutes=getattr(settings, 'ABANDONED_CART_TRACKING_DELAY', DEFAULT_TRACKING_DELAY))
+
+
+def stale_carts(now=None):
+    """Idle carts with items whose AbandonedCart record is missing or older than the cart"""
+    now = now or timezone.now()
+    tracked = AbandonedCart.objects.filter(
+        user=OuterRef('user'), is_recovered=False, last_activity_at__gte=OuterRef('updated_at')
+    )
+    return Cart.objects.filter(
+        Exists(CartItem.objects.filter(cart=OuterRef('pk'))),
+        updated_at__lte=now - get_tracking_delay(),
+    ).exclude(Exists(tracked))
+
+
+def update_abandoned_cart_records(batch_size=BATCH_SIZE, now=None):
+    """Snapshot stale carts into AbandonedCart records, returns (created, updated)"""
+    now = now or timezone.now()
+    queryset = stale_carts(now).order_by('pk')
+    created = updated = 0
+    cursor = 0
+
+    while True:
+        carts = list(queryset.filter(pk__gt=cursor)[:batch_size])
+        if not carts:
+            break
+        cursor = carts[-1].pk
+
+        items_by_cart = {}
+        items = CartItem.objects.filter(cart__in=carts).select_related('product__category').order_by('pk')
+        for item in items:
+            items_by_cart.setdefault(item.cart_id, []).append(item)
+        prefetch_related_objects([item.product for item in items], primary_media_prefetch())
+
+        # Ordered oldest first, so the newest open record of a user wins
+        existing = {
+            abandoned_cart.user_id: abandoned_cart
+            for abandoned_cart in AbandonedCart.objects.filter(
+                user_id__in=[cart.user_id for cart in carts], is_recovered=False
+            ).order_by('updated_at', 'pk')
+        }
+
+        to_create = []
+        to_update = []
+        for cart in carts:
+            cart_items = items_by_cart.get(cart.pk, [])
+            snapshot = cart_snapshot(cart_items)
+            total = CartSummary(cart_items).total
+            abandoned_cart = existing.get(cart.user_id)
+            if abandoned_cart is None:
+                to_create.append(AbandonedCart(
+                    user_id=cart.user_id,
+                    stage='cart',
+                    cart_items_snapshot=snapshot,
+                    cart_total=total,
+                    cart_created_at=cart.created_at,
+                    last_activity_at=cart.updated_at,
+                ))
+            else:
+                abandoned_cart.cart_items_snapshot = snapshot
+                abandoned_cart.cart_total = total
+                abandoned_cart.last_activity_at = cart.updated_at
+                abandoned_cart.updated_at = now
+                if not abandoned_cart.checkout_started_at or cart.updated_at > abandoned_cart.checkout_started_at:
+                    # The cart changed after checkout was started, so the user is back at the cart stage
+                    abandoned_cart.stage = 'cart'
+                to_update.append(abandoned_cart)
+
+        with transaction.atomic():
+            AbandonedCart.objects.bulk_create(to_create)
+            AbandonedCart.objects.bulk_update(
+                to_update, ['stage', 'cart_items_snapshot', 'cart_total', 'last_activity_at', 'updated_at']
+            )
+        created += len(to_create)
+        updated += len(to_update)
+    return created, updated
@@ -0,0 +1,33 @@
+"""
+Cache-backed cart item count for the header cart badge.
+
+The count is written by the cart views whenever they compute a CartSummary,
+so the cart context processor can usually render the badge without touching
+the database. A miss falls back to one SUM(quantity) query.
+"""
+
+from django.core.cache import cache
+from django.db.models import Sum
+
+CART_COUNT_CACHE_KEY = 'orders:cart_count:{user_id}'
+# Bounds how long a change made outside the cart views (e.g. in the admin) can go unnoticed
+CART_COUNT_TIMEOUT = 60 * 60
+
+
+def get_cart_count(user):
+    """Return the number of items in the user's cart, served from cache when possible"""
+    key = CART_COUNT_CACHE_KEY.format(user_id=user.pk)
+    count = cache.get(key)
+    if count is None:
+        from .models import CartItem
+        count = CartItem.objects.filter(cart__user=user).aggregate(total=Sum('quantity'))['total'] or 0
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def set_cart_count(user, count):
+    cache.set(CART_COUNT_CACHE_KEY.format(user_id=user.pk), count, CART_COUNT_TIMEOUT)
+
+
+def invalidate_cart_count(user):
+    cache.delete(CART_COUNT_CACHE_KEY.format(user_id=user.pk))
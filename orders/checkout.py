@@ -0,0 +1,157 @@
+"""
+Turning a cart into an order.
+
+``place_order`` does all the work in one transaction. It decrements stock
+for every product in the cart with a single conditional UPDATE, creates the
+order and bulk-creates its items with the prices read inside the
+transaction, and empties the cart. If any product is short, nothing is
+written and ``InsufficientStock`` is raised.
+
+On databases with ``SELECT ... FOR UPDATE`` the product rows are locked in
+primary key order first, so concurrent multi-product checkouts cannot
+deadlock. SQLite has no row locks. There the stock UPDATE is the first
+statement of the transaction, and its write lock serializes concurrent
+checkouts.
+
+Shipping is priced from the in-process delivery table of ``core.delivery``.
+``Quote`` gives the cart page, the checkout page and the quote endpoint the
+same totals the order will be created with.
+"""
+
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+
+from core.cache import CATALOG, bump_version
+from core.delivery import choose_delivery, delivery_charge, get_available_delivery
+from products.models import Product
+from .models import AbandonedCart, CartItem, CartSummary, Order, OrderItem
+
+
+class InsufficientStock(Exception):
+    """Raised when a cart asks for more units of a product than are in stock"""
+
+    def __init__(self, shortages):
+        # (product name, requested, available) for every product that is short
+        self.shortages = shortages
+        details = ', '.join(
+            f'{name} ({available} left, {requested} requested)' for name, requested, available in shortages
+        )
+        super().__init__(f'Insufficient stock for {details}.')
+
+
+def money(amount):
+    return str(amount.quantize(Decimal('0.01')))
+
+
+class Quote:
+    """The totals of a cart with the delivery option it would ship with"""
+
+    def __init__(self, summary, delivery_option_id=None):
+        self.summary = summary
+        self.delivery_options = get_available_delivery(summary.total)
+        self.delivery = choose_delivery(summary.total, delivery_option_id)
+        self.shipping = delivery_charge(self.delivery)
+        self.grand_total = summary.total + self.shipping
+
+    def as_json(self):
+        return {
+            'total_items': self.summary.total_items,
+            'subtotal': money(self.summary.subtotal),
+            'tax': money(self.summary.tax),
+            'total': money(self.summary.total),
+            'shipping_options': [
+                {
+                    'id': option.pk,
+                    'name': option.name,
+                    'charge': money(option.charge),
+                    'estimated_days': option.estimated_days,
+                    'selected': option == self.delivery,
+                }
+                for option in self.delivery_options
+            ],
+            'shipping': money(self.shipping),
+            'grand_total': money(self.grand_total),
+        }
+
+
+def reserve_stock(quantities):
+    """Decrement stock for ``{product_id: quantity}`` in one UPDATE, or raise InsufficientStock"""
+    condition = Q()
+    for product_id, quantity in quantities.items():
+        condition |= Q(pk=product_id, stock_quantity__gte=quantity)
+    updated = Product.objects.filter(condition).update(
+        stock_quantity=Case(
+            *[When(pk=product_id, then=F('stock_quantity') - quantity) for product_id, quantity in quantities.items()],
+            output_field=PositiveIntegerField(),
+        )
+    )
+    if updated != len(quantities):
+        shortages = [
+            (name, quantities[pk], stock)
+            for pk, name, stock in Product.objects.filter(pk__in=quantities).values_list('pk', 'name', 'stock_quantity')
+            if stock < quantities[pk]
+        ]
+        # Products deleted since they were added to the cart count as out of stock
+        missing = set(quantities) - set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        shortages += [(f'Product #{pk}', quantities[pk], 0) for pk in sorted(missing)]
+        raise InsufficientStock(shortages)
+
+
+def place_order(cart, delivery_option_id=None, **order_fields):
+    """
+    Create an order from ``cart`` and return it.
+
+    The order ships with ``delivery_option_id`` when it is available for the
+    order, see ``core.delivery.choose_delivery``. ``order_fields`` are passed
+    to the Order (billing, shipping, notes, payment).
+    Raises InsufficientStock without changing anything when a product is short.
+    """
+    # Read before the transaction: on SQLite a read followed by a write can fail under contention
+    items = list(cart.get_summary().items)
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', flat=True))
+        reserve_stock(quantities)
+
+        # Price the order from the rows read under the lock
+        products = Product.objects.in_bulk(quantities)
+        for item in items:
+            item.product = products[item.product_id]
+        quote = Quote(CartSummary(items), delivery_option_id)
+
+        order = Order.objects.create(
+            user=cart.user,
+            subtotal=quote.summary.subtotal,
+            tax=quote.summary.tax,
+            shipping_cost=quote.shipping,
+            total=quote.grand_total,
+            **order_fields
+        )
+        order_items = []
+        for item in items:
+            price = item.product.price or Decimal('0.00')
+            order_items.append(OrderItem(
+                order=order,
+                product=item.product,
+                product_name=item.product.name,
+                product_price=price,
+                quantity=item.quantity,
+                subtotal=price * item.quantity,
+            ))
+        OrderItem.objects.bulk_create(order_items)
+
+        CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+        AbandonedCart.objects.filter(user=cart.user, is_recovered=False).update(
+            is_recovered=True,
+            recovered_at=timezone.now()
+        )
+        # Stock is shown on product pages, and the UPDATE above bypasses the invalidation signals
+        transaction.on_commit(lambda: bump_version(CATALOG))
+    return order
@@ -0,0 +1,127 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from orders.abandoned import BATCH_SIZE, send_reminders, update_abandoned_cart_records
+from orders.models import AbandonedCart, Cart, CartItem
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Time the abandoned cart pipeline against synthetic data (everything is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=100000, help='Number of abandoned carts to generate (default: 100000)')
+        parser.add_argument('--products', type=int, default=200, help='Number of products referenced by the carts (default: 200)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Pipeline batch size (default: {BATCH_SIZE})')
+        parser.add_argument(
+            '--backend',
+            default='django.core.mail.backends.dummy.EmailBackend',
+            help='Email backend the reminders are sent through (default: the dummy backend)',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def run(self, options):
+        count = options['carts']
+        batch_size = options['batch_size']
+        now = timezone.now()
+
+        started = time.perf_counter()
+        products = self.create_products(options['products'])
+        self.create_data(count, products, now)
+        self.stdout.write(f'Generated {count} abandoned carts and {count} inactive carts in {time.perf_counter() - started:.1f}s')
+
+        for stage in ('cart', 'checkout'):
+            mail_connection = get_connection(options['backend'])
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                sent, failed = send_reminders(stage, connection=mail_connection, batch_size=batch_size, now=now)
+                elapsed = time.perf_counter() - started
+            self.report(f'{stage} reminders', sent + failed, elapsed, len(queries))
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            created, updated = update_abandoned_cart_records(batch_size=batch_size, now=now)
+            elapsed = time.perf_counter() - started
+        self.report('abandoned cart records', created + updated, elapsed, len(queries))
+
+    def report(self, label, rows, elapsed, queries):
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(f'{label}: {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s, {queries} queries)')
+
+    def create_products(self, count):
+        Product.objects.bulk_create(
+            [
+                Product(
+                    name=f'Benchmark product {i}',
+                    slug=f'benchmark-abandoned-product-{i}',
+                    description='Benchmark product',
+                    price=Decimal('1000.00'),
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        return list(Product.objects.filter(slug__startswith='benchmark-abandoned-product-'))
+
+    def create_data(self, count, products, now):
+        """Half of the abandoned carts are at the cart stage and half at checkout, every one of them due.
+        Each user also owns an inactive cart with no AbandonedCart record yet."""
+        User.objects.bulk_create(
+            [
+                User(username=f'benchmark-abandoned-{i}', email=f'benchmark-abandoned-{i}@example.com', password='!')
+                for i in range(count * 2)
+            ],
+            batch_size=2000,
+        )
+        users = list(User.objects.filter(username__startswith='benchmark-abandoned-').order_by('pk'))
+        reminder_users, cart_users = users[:count], users[count:]
+
+        abandoned_carts = []
+        for i, user in enumerate(reminder_users):
+            items = [products[(i + offset) % len(products)] for offset in range(3)]
+            snapshot = [
+                {
+                    'product_id': product.pk,
+                    'product_name': product.name,
+                    'product_price': str(product.price),
+                    'quantity': 1,
+                    'subtotal': str(product.price),
+                    'product_image': None,
+                }
+                for product in items
+            ]
+            checkout = i % 2 == 1
+            abandoned_carts.append(AbandonedCart(
+                user=user,
+                stage='checkout' if checkout else 'cart',
+                cart_items_snapshot=snapshot,
+                cart_total=sum(product.price for product in items),
+                cart_created_at=now - timedelta(days=1),
+                last_activity_at=now - timedelta(hours=3),
+                checkout_started_at=now - timedelta(hours=3) if checkout else None,
+            ))
+        AbandonedCart.objects.bulk_create(abandoned_carts, batch_size=2000)
+
+        Cart.objects.bulk_create([Cart(user=user) for user in cart_users], batch_size=2000)
+        carts = Cart.objects.filter(user__in=User.objects.filter(username__startswith='benchmark-abandoned-'))
+        carts.update(updated_at=now - timedelta(hours=1))
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart_id=cart_id, product=products[i % len(products)], quantity=2)
+                for i, cart_id in enumerate(carts.values_list('pk', flat=True))
+            ],
+            batch_size=2000,
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from orders.abandoned import BATCH_SIZE, update_abandoned_cart_records
+
+
+class Command(BaseCommand):
+    help = 'Snapshot carts changed since their last abandoned cart record. Run every ABANDONED_CART_TRACKING_DELAY minutes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Carts snapshotted per batch (default: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        created, updated = update_abandoned_cart_records(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{created} abandoned carts recorded, {updated} updated'))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_courier_contact_order_courier_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='abandonedcart',
+            index=models.Index(fields=['stage', 'is_recovered', 'last_activity_at'], name='orders_abandoned_due_idx'),
+        ),
+    ]
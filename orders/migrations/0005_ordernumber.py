@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_abandonedcart_due_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumber',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
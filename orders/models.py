@@ -4,25 +4,50 @@ from products.models import Product
 from django.utils import timezone
 from decimal import Decimal
 
+class CartSummary:
+    """Item count and totals of a cart, computed in one pass over its items"""
+
+    def __init__(self, items):
+        self.items = items
+        self.total_items = sum(item.quantity for item in items)
+        self.subtotal = sum((item.get_subtotal_without_tax() for item in items), Decimal('0.00'))
+        self.tax = sum((item.get_tax_amount() for item in items), Decimal('0.00'))
+        self.total = sum((item.get_subtotal() for item in items), Decimal('0.00'))
+
+    def __bool__(self):
+        return bool(self.items)
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    def get_summary(self, refresh=False):
+        """Get the CartSummary of this cart, loading the items and products in one query"""
+        if refresh or getattr(self, '_summary', None) is None:
+            self._summary = CartSummary(list(self.items.select_related('product__category')))
+        return self._summary
+    
     def get_total(self):
         """Get total cart value including tax"""
-        return sum(item.get_subtotal() for item in self.items.all())
+        return self.get_summary().total
     
     def get_subtotal_without_tax(self):
         """Get cart subtotal without tax"""
-        return sum(item.get_subtotal_without_tax() for item in self.items.all())
+        return self.get_summary().subtotal
     
     def get_total_tax(self):
         """Get total tax amount for cart"""
-        return sum(item.get_tax_amount() for item in self.items.all())
+        return self.get_summary().tax
     
     def get_total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.get_summary().total_items
+    
+    def touch(self):
+        """Record cart activity; the abandoned cart tracker snapshots the cart once it has been idle for a while"""
+        self.updated_at = timezone.now()
+        Cart.objects.filter(pk=self.pk).update(updated_at=self.updated_at)
     
     def __str__(self):
         return f"Cart for {self.user.username}"
@@ -55,6 +80,32 @@ class CartItem(models.Model):
     class Meta:
         unique_together = ['cart', 'product']
 
+class OrderNumber(models.Model):
+    """
+    Allocates order numbers. Every order inserts a row, and the database assigns
+    its auto-incremented id without locks or retries, so two orders can never
+    get the same number. Rows older than the newest are pruned now and then.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Digits the sequence is padded to, so order numbers sort by allocation. The
+    # numbers are longer than the 11 characters of the older random ones, so the
+    # two formats never collide.
+    SEQUENCE_DIGITS = 12
+    PRUNE_EVERY = 1000
+
+    @classmethod
+    def allocate(cls):
+        """A new order number: ORD then the sequence, e.g. ORD000000000042"""
+        allocation = cls.objects.create()
+        if allocation.pk % cls.PRUNE_EVERY == 0:
+            cls.objects.filter(pk__lt=allocation.pk).delete()
+        return cls.format_number(allocation.pk)
+
+    @classmethod
+    def format_number(cls, sequence):
+        return f'ORD{sequence:0{cls.SEQUENCE_DIGITS}d}'
+
 class Order(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -113,16 +164,15 @@ class Order(models.Model):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._original_status = self.status
+        self._original_total = self.__dict__.get('total')
     
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # Generate unique order number
-            import random
-            import string
-            self.order_number = 'ORD' + ''.join(random.choices(string.digits, k=8))
+            self.order_number = OrderNumber.allocate()
         super().save(*args, **kwargs)
-        # Update original status after save
+        # Update original status and total after save
         self._original_status = self.status
+        self._original_total = self.total
     
     def has_tracking_info(self):
         """Check if order has tracking information"""
@@ -139,6 +189,12 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A customer's orders, newest first
+            models.Index(fields=['user', 'created_at', 'id'], name='orders_user_history_idx'),
+            # Keyset pages of the dashboard order list, see core.pagination
+            models.Index(fields=['created_at', 'id'], name='orders_created_idx'),
+        ]
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -216,3 +272,6 @@ class AbandonedCart(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['stage', 'is_recovered', 'last_activity_at'], name='orders_abandoned_due_idx'),
+        ]
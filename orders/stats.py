@@ -0,0 +1,35 @@
+"""
+Per-customer order statistics.
+
+The order history page shows how many orders a customer placed, how many
+items they bought and how much they spent. ``get_order_stats`` computes all
+three in one aggregate query. Items are summed per order in a correlated
+subquery, so the join with ``OrderItem`` cannot multiply the order count or
+the order totals.
+"""
+
+from decimal import Decimal
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Order, OrderItem
+
+
+def get_order_stats(user):
+    """``total_orders``, ``total_items`` and ``total_spent`` of ``user``, in one query"""
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(
+        quantity=Sum('quantity')
+    ).values('quantity')
+    totals = Order.objects.filter(user=user).annotate(
+        item_count=Coalesce(Subquery(items, output_field=IntegerField()), 0)
+    ).aggregate(
+        total_orders=Count('pk'),
+        total_items=Sum('item_count'),
+        total_spent=Sum('total'),
+    )
+    return {
+        'total_orders': totals['total_orders'],
+        'total_items': totals['total_items'] or 0,
+        'total_spent': totals['total_spent'] or Decimal('0.00'),
+    }
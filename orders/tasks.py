@@ -25,6 +25,21 @@ def send_abandoned_cart_emails():
         raise e
 
 
+@shared_task
+def track_abandoned_carts():
+    """
+    Celery task to snapshot changed carts into abandoned cart records.
+    This task should be scheduled every ABANDONED_CART_TRACKING_DELAY minutes.
+    """
+    try:
+        call_command('track_abandoned_carts')
+        logger.info("Abandoned carts tracked successfully")
+        return "Abandoned carts tracked successfully"
+    except Exception as e:
+        logger.error(f"Error tracking abandoned carts: {str(e)}")
+        raise e
+
+
 # Alternative: Simple cron job command
 # Add this to your crontab to run every hour:
 # 0 * * * * cd /path/to/your/project && python manage.py send_abandoned_cart_emails
@@ -1,3 +1,364 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.delivery import get_delivery_options
+from core.models import DeliveryCharge
+from core.testing import TEST_CACHES, TEST_STORAGES
+from products.models import Product, ProductMedia
+from .abandoned import send_reminders, update_abandoned_cart_records
+from .cart_count import get_cart_count
+from .checkout import InsufficientStock, place_order
+from .models import AbandonedCart, Cart, CartItem, Order, OrderItem, OrderNumber
+from .stats import get_order_stats
+
+
+def make_cart(username, *lines):
+    user = User.objects.create(username=username, email=f'{username}@example.com')
+    cart = Cart.objects.create(user=user)
+    for product, quantity in lines:
+        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PlaceOrderTests(TransactionTestCase):
+    def setUp(self):
+        # Flushing the tables fires no signals, so start from an empty delivery table
+        cache.clear()
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', sku='10000001',
+                                            price=Decimal('1000.00'), tax_percentage=Decimal('10.00'), stock_quantity=5)
+        self.scarf = Product.objects.create(name='Scarf', description='Silk', sku='10000002',
+                                            price=Decimal('500.00'), stock_quantity=1)
+
+    def test_places_order_and_decrements_stock(self):
+        cart = make_cart('buyer', (self.shawl, 2), (self.scarf, 1))
+        order = place_order(cart, billing_name='Buyer', billing_email='buyer@example.com')
+
+        self.assertEqual(order.subtotal, Decimal('2500.00'))
+        self.assertEqual(order.tax, Decimal('200.00'))
+        self.assertEqual(order.total, Decimal('2700.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('product_name', 'product_price', 'quantity', 'subtotal')),
+            [('Scarf', Decimal('500.00'), 1, Decimal('500.00')), ('Shawl', Decimal('1000.00'), 2, Decimal('2000.00'))],
+        )
+        self.assertEqual(Product.objects.get(pk=self.shawl.pk).stock_quantity, 3)
+        self.assertEqual(Product.objects.get(pk=self.scarf.pk).stock_quantity, 0)
+        self.assertFalse(cart.items.exists())
+
+    def test_insufficient_stock_changes_nothing(self):
+        cart = make_cart('buyer', (self.shawl, 2), (self.scarf, 3))
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(cart, billing_name='Buyer', billing_email='buyer@example.com')
+
+        self.assertEqual(raised.exception.shortages, [('Scarf', 3, 1)])
+        self.assertEqual(Product.objects.get(pk=self.shawl.pk).stock_quantity, 5)
+        self.assertEqual(Product.objects.get(pk=self.scarf.pk).stock_quantity, 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 2)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite test database; set a TEST NAME to run this test.')
+
+        buyers = 20
+        carts = [make_cart(f'buyer{i}', (self.shawl, 1)) for i in range(buyers)]
+        results = []
+        barrier = threading.Barrier(buyers)
+
+        def checkout(cart):
+            try:
+                barrier.wait()
+                place_order(cart, billing_name=cart.user.username, billing_email=cart.user.email)
+                results.append('ordered')
+            except InsufficientStock:
+                results.append('out of stock')
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=checkout, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('ordered'), 5)
+        self.assertEqual(results.count('out of stock'), buyers - 5)
+        self.assertEqual(Product.objects.get(pk=self.shawl.pk).stock_quantity, 0)
+        self.assertEqual(OrderItem.objects.filter(product=self.shawl).count(), 5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DeliveryQuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'),
+                                            tax_percentage=Decimal('10.00'), stock_quantity=5)
+        self.standard = DeliveryCharge.objects.create(name='Standard', charge=Decimal('250.00'), is_default=True)
+        self.express = DeliveryCharge.objects.create(name='Express', charge=Decimal('500.00'), estimated_days=1)
+        self.free = DeliveryCharge.objects.create(name='Free', charge=Decimal('0.00'), min_order_value=Decimal('2000.00'))
+        self.cart = make_cart('buyer', (self.shawl, 1))
+
+    def test_quote_prices_the_selected_available_option(self):
+        self.client.force_login(self.cart.user)
+        quote = self.client.get(reverse('orders:cart_quote'), {'delivery_option': self.express.pk}).json()
+        self.assertEqual([option['name'] for option in quote['shipping_options']], ['Standard', 'Express'])
+        self.assertEqual((quote['total'], quote['shipping'], quote['grand_total']), ('1100.00', '500.00', '1600.00'))
+
+        # Free delivery needs a larger order, so the default is used
+        quote = self.client.get(reverse('orders:cart_quote'), {'delivery_option': self.free.pk}).json()
+        self.assertEqual((quote['shipping'], quote['grand_total']), ('250.00', '1350.00'))
+
+    def test_order_total_includes_shipping(self):
+        order = place_order(self.cart, delivery_option_id=self.express.pk, billing_name='Buyer')
+        self.assertEqual((order.total, order.shipping_cost), (Decimal('1600.00'), Decimal('500.00')))
+
+    def test_table_is_served_from_memory_until_a_charge_changes(self):
+        get_delivery_options()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_delivery_options()), 3)
+        self.express.is_active = False
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.express.save()
+        # Not reloaded until the change commits
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_delivery_options()), 3)
+        for callback in callbacks:
+            callback()
+        self.assertEqual([option.name for option in get_delivery_options()], ['Free', 'Standard'])
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('100.00'))
+        ProductMedia.objects.create(product=self.shawl, media_file=SimpleUploadedFile('shawl.jpg', b'jpg'))
+        self.client.force_login(self.user)
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, subtotal=Decimal('300.00'), total=Decimal('300.00'))
+            OrderItem.objects.create(order=order, product=self.shawl, product_name='Shawl', product_price=Decimal('100.00'), quantity=2)
+            OrderItem.objects.create(order=order, product=self.shawl, product_name='Shawl', product_price=Decimal('100.00'), quantity=1)
+
+    def test_stats_are_one_query_and_not_multiplied_by_items(self):
+        self.add_orders(3)
+        Order.objects.create(user=User.objects.create(username='other'), subtotal=0, total=Decimal('50.00'))
+        with self.assertNumQueries(1):
+            stats = get_order_stats(self.user)
+        self.assertEqual(stats, {'total_orders': 3, 'total_items': 9, 'total_spent': Decimal('900.00')})
+
+    def test_history_page_query_count_does_not_grow(self):
+        self.add_orders(1)
+        # Caches the cart badge of the header
+        self.client.get(reverse('accounts:order_history'))
+        # Session, user, stats, orders, items, products, media
+        with self.assertNumQueries(7):
+            self.client.get(reverse('accounts:order_history'))
+        self.add_orders(10)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('accounts:order_history'))
+        self.assertEqual(len(response.context['orders']), 10)
+        self.assertEqual(response.context['total_items'], 33)
+
+        # The oldest order is alone on the second page
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('accounts:order_history'), {'after': response.context['page_obj'].next_cursor})
+        self.assertEqual([order.pk for order in response.context['orders']], [Order.objects.order_by('pk').first().pk])
+        self.assertFalse(response.context['page_obj'].has_next())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OrderNumberTests(TransactionTestCase):
+    def test_concurrent_orders_get_unique_increasing_numbers(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite test database; set a TEST NAME to run this test.')
+
+        threads_count, orders_per_thread = 16, 10
+        user = User.objects.create(username='buyer', email='buyer@example.com')
+        numbers = {}
+        errors = []
+        barrier = threading.Barrier(threads_count)
+
+        def create_orders(thread):
+            try:
+                barrier.wait()
+                numbers[thread] = [
+                    Order.objects.create(user=user, subtotal=0, tax=0, total=0).order_number
+                    for _ in range(orders_per_thread)
+                ]
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=create_orders, args=(i,)) for i in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        all_numbers = [number for thread_numbers in numbers.values() for number in thread_numbers]
+        self.assertEqual(len(set(all_numbers)), threads_count * orders_per_thread)
+        for number in all_numbers:
+            self.assertRegex(number, r'^ORD\d{12}$')
+        # Each thread created its orders one after another, so their numbers sort in that order
+        for thread_numbers in numbers.values():
+            self.assertEqual(thread_numbers, sorted(thread_numbers))
+
+    def test_numbers_keep_their_width_and_order_past_eight_digits(self):
+        numbers = [OrderNumber.format_number(sequence) for sequence in (42, 99999999, 100000000, 10 ** 12 - 1)]
+        self.assertEqual(numbers[0], 'ORD000000000042')
+        self.assertEqual({len(number) for number in numbers}, {15})
+        self.assertEqual(numbers, sorted(numbers))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'),
+                                            tax_percentage=Decimal('10.00'))
+        self.stole = Product.objects.create(name='Stole', description='Wool', price=Decimal('500.00'))
+        self.cart = make_cart('shopper', (self.shawl, 2), (self.stole, 1))
+        self.client.force_login(self.cart.user)
+
+    def test_totals_come_from_one_pass_over_the_items(self):
+        with self.assertNumQueries(1):
+            summary = self.cart.get_summary(refresh=True)
+            self.assertEqual(summary.total_items, 3)
+            self.assertEqual(summary.subtotal, Decimal('2500.00'))
+            self.assertEqual(summary.tax, Decimal('200.00'))
+            self.assertEqual(summary.total, Decimal('2700.00'))
+            self.assertEqual(self.cart.get_total(), Decimal('2700.00'))
+
+    def test_cart_page_query_count_does_not_grow_with_the_items(self):
+        url = reverse('orders:cart')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for i in range(5):
+            product = Product.objects.create(name=f'Scarf {i}', description='Silk', price=Decimal('300.00'))
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(response.context['cart_count'], 8)
+        self.assertEqual(len(many), len(few))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CartBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        self.cart = make_cart('shopper', (self.shawl, 2))
+        self.client.force_login(self.cart.user)
+
+    def test_count_is_cached_after_the_first_read(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cart_count(self.cart.user), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(self.cart.user), 2)
+
+    def test_cart_views_keep_the_cached_count_current(self):
+        stole = Product.objects.create(name='Stole', description='Wool', price=Decimal('500.00'))
+        self.client.post(reverse('orders:add_to_cart', args=[stole.pk]), {'quantity': 3})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(self.cart.user), 5)
+
+        item = CartItem.objects.get(cart=self.cart, product=stole)
+        self.client.post(reverse('orders:remove_from_cart', args=[item.pk]))
+        self.assertEqual(get_cart_count(self.cart.user), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AbandonedCartTrackingTests(TestCase):
+    def setUp(self):
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        self.cart = make_cart('shopper', (self.shawl, 1))
+        self.client.force_login(self.cart.user)
+
+    def test_adding_to_cart_only_touches_the_cart(self):
+        before = Cart.objects.get(pk=self.cart.pk).updated_at
+        self.client.post(reverse('orders:add_to_cart', args=[self.shawl.pk]))
+        self.assertGreater(Cart.objects.get(pk=self.cart.pk).updated_at, before)
+        self.assertFalse(AbandonedCart.objects.exists())
+
+    def test_idle_carts_are_snapshotted_once_per_change(self):
+        now = timezone.now()
+        # Still within the tracking delay
+        self.assertEqual(update_abandoned_cart_records(now=now), (0, 0))
+
+        later = now + timedelta(minutes=10)
+        self.assertEqual(update_abandoned_cart_records(now=later), (1, 0))
+        self.assertEqual(update_abandoned_cart_records(now=later), (0, 0))
+        record = AbandonedCart.objects.get()
+        self.assertEqual((record.stage, record.cart_total), ('cart', Decimal('1000.00')))
+
+        CartItem.objects.filter(cart=self.cart).update(quantity=3)
+        self.cart.touch()
+        self.assertEqual(update_abandoned_cart_records(now=timezone.now() + timedelta(minutes=10)), (0, 1))
+        record.refresh_from_db()
+        self.assertEqual(record.cart_total, Decimal('3000.00'))
+        self.assertEqual(record.cart_items_snapshot[0]['quantity'], 3)
+
+    def test_snapshots_read_each_product_once_per_batch(self):
+        stole = Product.objects.create(name='Stole', description='Cashmere', price=Decimal('500.00'))
+        for i in range(3):
+            make_cart(f'buyer{i}', (self.shawl, 1), (stole, 2))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(update_abandoned_cart_records(now=timezone.now() + timedelta(minutes=10)), (4, 0))
+        product_reads = [query for query in queries if 'FROM "products_product"' in query['sql']]
+        self.assertEqual(product_reads, [])
+        self.assertEqual(len(queries), 8)
+        record = AbandonedCart.objects.get(user__username='buyer0')
+        self.assertEqual([item['product_name'] for item in record.cart_items_snapshot], ['Shawl', 'Stole'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AbandonedCartReminderTests(TestCase):
+    def setUp(self):
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        self.now = timezone.now()
+        self.carts = [make_cart(f'shopper{i}', (self.shawl, 1)) for i in range(3)]
+        update_abandoned_cart_records(now=self.now + timedelta(minutes=10))
+        self.later = self.now + timedelta(hours=3)
+
+    def test_due_reminders_are_sent_once(self):
+        self.assertEqual(send_reminders('cart', now=self.now), (0, 0))
+        self.assertEqual(send_reminders('cart', batch_size=2, now=self.later), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('Shawl', mail.outbox[0].alternatives[0][0])
+        self.assertFalse(AbandonedCart.objects.filter(cart_reminder_sent=False).exists())
+        self.assertEqual(send_reminders('cart', now=self.later), (0, 0))
+
+    def test_a_bad_snapshot_only_holds_back_its_own_reminder(self):
+        broken = AbandonedCart.objects.get(user=self.carts[1].user)
+        broken.cart_items_snapshot = [{'product_id': self.shawl.pk}]
+        broken.save()
+
+        self.assertEqual(send_reminders('cart', now=self.later), (2, 1))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['shopper0@example.com', 'shopper2@example.com'])
+        self.assertEqual(list(AbandonedCart.objects.filter(cart_reminder_sent=False)), [broken])
+
+    def test_an_unreachable_mail_server_fails_the_stage(self):
+        connection = mock.Mock()
+        connection.open.side_effect = ConnectionRefusedError
+        with self.assertLogs('orders.abandoned', 'ERROR'):
+            self.assertEqual(send_reminders('cart', connection=connection, now=self.later), (0, 3))
+        connection.send_messages.assert_not_called()
+        self.assertEqual(AbandonedCart.objects.filter(cart_reminder_sent=False).count(), 3)
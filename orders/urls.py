@@ -9,4 +9,5 @@ urlpatterns = [
     path('update-cart-item/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
+    path('quote/', views.cart_quote, name='cart_quote'),
 ]
@@ -8,78 +8,61 @@ from django.template.loader import render_to_string
 from django.conf import settings
 from decimal import Decimal
 from django.utils import timezone
-from .models import Cart, CartItem, Order, OrderItem, AbandonedCart
-from products.models import Product
-from core.models import DeliveryCharge
+from .models import Cart, CartItem, CartSummary, Order, OrderItem, AbandonedCart
+from .cart_count import set_cart_count, invalidate_cart_count
+from .abandoned import cart_snapshot
+from .checkout import InsufficientStock, Quote, place_order
+from django.db.models import Sum, prefetch_related_objects
+from products.models import Product, primary_media_prefetch
 import json
 
+def get_cart_summary(request, cart, refresh=False):
+    """Compute the cart summary once, share it with the cart context processor and refresh the cached badge count"""
+    summary = cart.get_summary(refresh=refresh)
+    request.cart_summary = summary
+    set_cart_count(request.user, summary.total_items)
+    return summary
+
 @login_required
 def cart_view(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
+    summary = get_cart_summary(request, cart)
+    prefetch_related_objects(
+        [item.product for item in summary.items],
+        primary_media_prefetch(),
+    )
+    quote = Quote(summary, request.GET.get('delivery_option'))
     context = {
         'cart': cart,
-        'cart_items': cart.items.all(),
-        'cart_total': cart.get_total(),
-        'cart_count': cart.get_total_items(),
-        'delivery_charges': DeliveryCharge.objects.filter(is_active=True).order_by('charge'),
-        'default_delivery': DeliveryCharge.get_default(),
+        'cart_summary': summary,
+        'cart_items': summary.items,
+        'cart_total': summary.total,
+        'cart_count': summary.total_items,
+        'quote': quote,
+        'delivery_charges': quote.delivery_options,
+        'default_delivery': quote.delivery,
     }
     return render(request, 'orders/cart.html', context)
 
-def update_abandoned_cart_tracking(user, cart):
-    """Update or create abandoned cart tracking record"""
-    if not cart.items.exists():
-        return
-    
-    # Create cart items snapshot
-    cart_items_snapshot = []
-    for item in cart.items.all():
-        cart_items_snapshot.append({
-            'product_id': item.product.id,
-            'product_name': item.product.name,
-            'product_price': str(item.product.price),
-            'quantity': item.quantity,
-            'subtotal': str(item.get_subtotal()),
-            'product_image': item.product.media.first().media_file.url if item.product.media.first() else None,
-        })
-    
-    # Update or create abandoned cart record
-    abandoned_cart, created = AbandonedCart.objects.get_or_create(
-        user=user,
-        is_recovered=False,
-        defaults={
-            'stage': 'cart',
-            'cart_items_snapshot': cart_items_snapshot,
-            'cart_total': cart.get_total(),
-            'cart_created_at': cart.created_at,
-            'last_activity_at': timezone.now(),
-        }
-    )
-    
-    if not created:
-        # Update existing record
-        abandoned_cart.cart_items_snapshot = cart_items_snapshot
-        abandoned_cart.cart_total = cart.get_total()
-        abandoned_cart.last_activity_at = timezone.now()
-        abandoned_cart.stage = 'cart'  # Reset to cart stage if user goes back to cart
-        abandoned_cart.save()
+@login_required
+def cart_quote(request):
+    """Subtotal, tax, delivery options and grand total of the cart as JSON, for the selected delivery option"""
+    cart = Cart.objects.filter(user=request.user).first()
+    summary = get_cart_summary(request, cart) if cart else CartSummary([])
+    return JsonResponse(Quote(summary, request.GET.get('delivery_option')).as_json())
 
 def track_checkout_abandonment(user, cart):
     """Track when user starts checkout process"""
-    if not cart.items.exists():
+    summary = cart.get_summary()
+    if not summary:
         return
     
     # Create cart items snapshot
-    cart_items_snapshot = []
-    for item in cart.items.all():
-        cart_items_snapshot.append({
-            'product_id': item.product.id,
-            'product_name': item.product.name,
-            'product_price': str(item.product.price),
-            'quantity': item.quantity,
-            'subtotal': str(item.get_subtotal()),
-            'product_image': item.product.media.first().media_file.url if item.product.media.first() else None,
-        })
+    prefetch_related_objects(
+        [item.product for item in summary.items],
+        primary_media_prefetch(),
+    )
+    cart_items_snapshot = cart_snapshot(summary.items)
     
     # Update or create abandoned cart record for checkout stage
     abandoned_cart, created = AbandonedCart.objects.get_or_create(
@@ -88,7 +71,7 @@ def track_checkout_abandonment(user, cart):
         defaults={
             'stage': 'checkout',
             'cart_items_snapshot': cart_items_snapshot,
-            'cart_total': cart.get_total(),
+            'cart_total': summary.total,
             'cart_created_at': cart.created_at,
             'last_activity_at': timezone.now(),
             'checkout_started_at': timezone.now(),
@@ -98,22 +81,12 @@ def track_checkout_abandonment(user, cart):
     if not created:
         # Update existing record to checkout stage
         abandoned_cart.cart_items_snapshot = cart_items_snapshot
-        abandoned_cart.cart_total = cart.get_total()
+        abandoned_cart.cart_total = summary.total
         abandoned_cart.last_activity_at = timezone.now()
         abandoned_cart.stage = 'checkout'
         abandoned_cart.checkout_started_at = timezone.now()
         abandoned_cart.save()
 
-def mark_cart_as_recovered(user):
-    """Mark abandoned cart as recovered when order is placed"""
-    AbandonedCart.objects.filter(
-        user=user,
-        is_recovered=False
-    ).update(
-        is_recovered=True,
-        recovered_at=timezone.now()
-    )
-
 @login_required
 @require_POST
 def add_to_cart(request, product_id):
@@ -132,14 +105,18 @@ def add_to_cart(request, product_id):
         cart_item.quantity += quantity
         cart_item.save()
     
-    # Update abandoned cart tracking
-    update_abandoned_cart_tracking(request.user, cart)
+    # Only the badge count is needed here, so sum it in the database instead of loading every item
+    cart_count = cart.items.aggregate(total=Sum('quantity'))['total'] or 0
+    set_cart_count(request.user, cart_count)
+    
+    # Flag the cart for the abandoned cart tracker
+    cart.touch()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'message': f'{product.name} added to cart',
-            'cart_count': cart.get_total_items()
+            'cart_count': cart_count
         })
     
     messages.success(request, f'{product.name} has been added to your cart.')
@@ -148,7 +125,7 @@ def add_to_cart(request, product_id):
 @login_required
 @require_POST
 def update_cart_item(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart'), id=item_id, cart__user=request.user)
     quantity = int(request.POST.get('quantity', 1))
     
     if quantity > 0:
@@ -159,16 +136,18 @@ def update_cart_item(request, item_id):
         cart_item.delete()
         messages.success(request, 'Item removed from cart.')
     
-    # Update abandoned cart tracking
-    cart = Cart.objects.get(user=request.user)
-    update_abandoned_cart_tracking(request.user, cart)
+    cart = cart_item.cart
+    summary = get_cart_summary(request, cart)
+    
+    # Flag the cart for the abandoned cart tracker
+    cart.touch()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'message': 'Cart updated successfully.',
-            'cart_count': cart.get_total_items(),
-            'cart_total': str(cart.get_total())
+            'cart_count': summary.total_items,
+            'cart_total': str(summary.total)
         })
     
     return redirect('orders:cart')
@@ -176,16 +155,20 @@ def update_cart_item(request, item_id):
 @login_required
 @require_POST
 def remove_from_cart(request, item_id):
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id, cart__user=request.user)
     product_name = cart_item.product.name
+    cart = cart_item.cart
     cart_item.delete()
+    cart.touch()
     messages.success(request, f'{product_name} has been removed from your cart.')
+    invalidate_cart_count(request.user)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cart = Cart.objects.get(user=request.user)
+        summary = get_cart_summary(request, cart)
         return JsonResponse({
             'success': True,
-            'cart_count': cart.get_total_items()
+            'cart_count': summary.total_items,
+            'cart_total': str(summary.total)
         })
     
     return redirect('orders:cart')
@@ -193,8 +176,9 @@ def remove_from_cart(request, item_id):
 @login_required
 def checkout(request):
     cart = get_object_or_404(Cart, user=request.user)
+    summary = get_cart_summary(request, cart)
     
-    if not cart.items.exists():
+    if not summary:
         messages.warning(request, 'Your cart is empty.')
         return redirect('products:product_list')
     
@@ -202,42 +186,33 @@ def checkout(request):
     track_checkout_abandonment(request.user, cart)
     
     if request.method == 'POST':
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            billing_name=request.POST.get('billing_name'),
-            billing_email=request.POST.get('billing_email'),
-            billing_phone=request.POST.get('billing_phone'),
-            billing_address=request.POST.get('billing_address'),
-            billing_city=request.POST.get('billing_city'),
-            billing_state=request.POST.get('billing_state'),
-            billing_zip=request.POST.get('billing_zip'),
-            billing_country=request.POST.get('billing_country'),
-            shipping_name=request.POST.get('shipping_name', request.POST.get('billing_name')),
-            shipping_address=request.POST.get('shipping_address', request.POST.get('billing_address')),
-            shipping_city=request.POST.get('shipping_city', request.POST.get('billing_city')),
-            shipping_state=request.POST.get('shipping_state', request.POST.get('billing_state')),
-            shipping_zip=request.POST.get('shipping_zip', request.POST.get('billing_zip')),
-            shipping_country=request.POST.get('shipping_country', request.POST.get('billing_country')),
-            subtotal=cart.get_total(),
-            total=cart.get_total(),  # Add tax and shipping calculation if needed
-            customer_notes=request.POST.get('customer_notes', ''),
-            payment_method=request.POST.get('payment_method', 'Cash on Delivery'),
-        )
-        
-        # Create order items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
+        # Create the order, reserve stock and clear the cart in one transaction
+        try:
+            order = place_order(
+                cart,
+                delivery_option_id=request.POST.get('delivery_option'),
+                billing_name=request.POST.get('billing_name'),
+                billing_email=request.POST.get('billing_email'),
+                billing_phone=request.POST.get('billing_phone'),
+                billing_address=request.POST.get('billing_address'),
+                billing_city=request.POST.get('billing_city'),
+                billing_state=request.POST.get('billing_state'),
+                billing_zip=request.POST.get('billing_zip'),
+                billing_country=request.POST.get('billing_country'),
+                shipping_name=request.POST.get('shipping_name', request.POST.get('billing_name')),
+                shipping_address=request.POST.get('shipping_address', request.POST.get('billing_address')),
+                shipping_city=request.POST.get('shipping_city', request.POST.get('billing_city')),
+                shipping_state=request.POST.get('shipping_state', request.POST.get('billing_state')),
+                shipping_zip=request.POST.get('shipping_zip', request.POST.get('billing_zip')),
+                shipping_country=request.POST.get('shipping_country', request.POST.get('billing_country')),
+                customer_notes=request.POST.get('customer_notes', ''),
+                payment_method=request.POST.get('payment_method', 'Cash on Delivery'),
             )
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+            return redirect('orders:cart')
         
-        # Mark abandoned cart as recovered
-        mark_cart_as_recovered(request.user)
-        
-        # Clear cart
-        cart.items.all().delete()
+        set_cart_count(request.user, 0)
         
         # Send confirmation email to customer
         try:
@@ -346,8 +321,10 @@ def checkout(request):
     
     context = {
         'cart': cart,
-        'cart_items': cart.items.all(),
-        'cart_total': cart.get_total(),
+        'cart_summary': summary,
+        'cart_items': summary.items,
+        'cart_total': summary.total,
+        'quote': Quote(summary, request.GET.get('delivery_option')),
         'initial_data': initial_data,
     }
     return render(request, 'orders/checkout.html', context)
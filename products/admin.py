@@ -1,9 +1,6 @@
 from django.contrib import admin, messages
-from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-from .models import Product, ProductCategory, ProductMedia, Review, DealRequest
+from .models import Product, ProductCategory, ProductMedia, Review, DealRequest, MediaUpload
+from . import moderation
 
 @admin.register(ProductCategory)
 class ProductCategoryAdmin(admin.ModelAdmin):
@@ -62,56 +59,20 @@ class ReviewAdmin(admin.ModelAdmin):
     actions = ['approve_reviews', 'reject_reviews']
 
     def approve_reviews(self, request, queryset):
-        successful_approvals = 0
-        for review in queryset:
-            if review.status == 'Approved':
-                continue
-
-            if not review.email:
-                review.status = 'Approved'
-                review.save()
-                successful_approvals += 1
-                continue
-
-            try:
-                logo_url = request.build_absolute_uri(settings.MEDIA_URL + 'red_sun_logo.png')
-                context = {
-                    'user_name': review.author,
-                    'product_name': review.product.name,
-                    'product_url': request.build_absolute_uri(review.product.get_absolute_url()),
-                    'logo_url': logo_url,
-                }
-
-                html_content = render_to_string('products/email/review_approved_user.html', context)
-                text_content = strip_tags(html_content)
-
-                email = EmailMultiAlternatives(
-                    'Your Review has been Approved!',
-                    text_content,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [review.email]
-                )
-                email.attach_alternative(html_content, "text/html")
-                email.send(fail_silently=False)
-
-                # If email sends successfully, then approve the review
-                review.status = 'Approved'
-                review.save()
-                successful_approvals += 1
-
-            except Exception as e:
-                self.message_user(
-                    request,
-                    f"Could not approve review by '{review.author}' because email failed to send. Error: {e}",
-                    level=messages.ERROR
-                )
-
-        if successful_approvals > 0:
-            self.message_user(request, f"{successful_approvals} review(s) were successfully approved.")
+        # Statuses change in bulk and the emails are queued in batches, see products.moderation
+        approved, failed = moderation.approve_reviews(queryset, request.build_absolute_uri)
+        if failed:
+            self.message_user(
+                request,
+                f"{failed} review(s) were not approved because their notification emails could not be queued.",
+                level=messages.ERROR
+            )
+        if approved:
+            self.message_user(request, f"{approved} review(s) were successfully approved.")
     approve_reviews.short_description = "Approve selected reviews and notify user"
 
     def reject_reviews(self, request, queryset):
-        queryset.update(status='Rejected')
+        moderation.reject_reviews(queryset)
     reject_reviews.short_description = "Reject selected reviews"
 
     def save_model(self, request, obj, form, change):
@@ -119,23 +80,7 @@ class ReviewAdmin(admin.ModelAdmin):
         if 'status' in form.changed_data and obj.status == 'Approved':
             if obj.email:
                 try:
-                    logo_url = request.build_absolute_uri(settings.MEDIA_URL + 'red_sun_logo.png')
-                    context = {
-                        'user_name': obj.author,
-                        'product_name': obj.product.name,
-                        'product_url': request.build_absolute_uri(obj.product.get_absolute_url()),
-                        'logo_url': logo_url,
-                    }
-                    html_content = render_to_string('products/email/review_approved_user.html', context)
-                    text_content = strip_tags(html_content)
-                    email = EmailMultiAlternatives(
-                        'Your Review has been Approved!',
-                        text_content,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [obj.email]
-                    )
-                    email.attach_alternative(html_content, "text/html")
-                    email.send(fail_silently=False)
+                    moderation.build_approval_email(obj, request.build_absolute_uri).send(fail_silently=False)
                     self.message_user(request, "Review approved and notification email sent.")
                 except Exception as e:
                     self.message_user(request, f"Review was saved, but failed to send approval email. Error: {e}", level=messages.ERROR)
@@ -146,3 +91,10 @@ class DealRequestAdmin(admin.ModelAdmin):
     list_display = ('product', 'name', 'phone_number', 'status', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('name', 'phone_number', 'product__name')
+
+@admin.register(MediaUpload)
+class MediaUploadAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'product', 'status', 'progress', 'is_video', 'uploaded_by', 'created_at')
+    list_filter = ('status', 'is_video', 'created_at')
+    search_fields = ('filename', 'product__name')
+    readonly_fields = ('received', 'media', 'details', 'error', 'claimed_at', 'created_at', 'updated_at')
@@ -0,0 +1,117 @@
+"""
+Resized renditions of product images.
+
+Pages do not serve the uploaded originals. Every image upload gets three
+renditions, each saved as a recompressed JPEG and as WebP:
+
+* ``thumbnail`` for cart rows, emails and admin grids
+* ``card`` for product cards
+* ``detail`` for the product page
+
+Images are never scaled up. A rendition of a small image keeps the original
+size and is only recompressed. ``ProductMedia.renditions`` records the path
+and dimensions of every rendition, e.g.
+``{'card': {'width': 600, 'height': 800, 'jpeg': '...', 'webp': '...'}}``.
+Videos and files Pillow cannot read get no renditions, and pages fall back to
+the original file.
+
+``products.signals`` renders an upload when it is saved. The
+``{% responsive_image %}`` and ``{% rendition_url %}`` tags in
+``products.templatetags.product_images`` turn the renditions into
+``srcset`` markup and URLs. ``manage.py generate_media_renditions``
+backfills existing media in worker processes.
+"""
+
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Name, maximum width
+RENDITIONS = (
+    ('thumbnail', 200),
+    ('card', 600),
+    ('detail', 1200),
+)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+RENDITION_DIR = 'product_media/renditions'
+
+
+def rendition_path(name, media_pk, rendition, extension):
+    """Storage path of a rendition, next to the others of the same upload"""
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    return f'{RENDITION_DIR}/{media_pk}/{stem}-{rendition}.{extension}'
+
+
+def encode(image, image_format, quality):
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality, optimize=image_format == 'JPEG', progressive=image_format == 'JPEG')
+    return ContentFile(buffer.getvalue())
+
+
+def render_file(name, media_pk, storage=default_storage):
+    """
+    Render every rendition of the stored file ``name`` and return them.
+
+    Returns an empty dict for files that are missing or are not images. Takes
+    plain values so it can run in a worker process.
+    """
+    try:
+        source = storage.open(name, 'rb')
+    except OSError:
+        return {}
+    # Failures to write the renditions are raised, so the caller can retry
+    with source:
+        return render_image(source, name, media_pk, storage)
+
+
+def render_image(source, name, media_pk, storage=default_storage):
+    """Render the renditions of an open image file, named after ``name``, or return {} if it is not an image"""
+    try:
+        original = Image.open(source)
+        original = ImageOps.exif_transpose(original)
+        original.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        return {}
+    # JPEG has no alpha channel, flatten transparent images onto white
+    if original.mode in ('RGBA', 'LA') or (original.mode == 'P' and 'transparency' in original.info):
+        flat = Image.new('RGB', original.size, 'white')
+        flat.paste(original.convert('RGBA'), mask=original.convert('RGBA').getchannel('A'))
+        original = flat
+    else:
+        original = original.convert('RGB')
+
+    renditions = {}
+    for rendition, max_width in RENDITIONS:
+        image = original
+        if image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        paths = {}
+        for extension, image_format, quality in (('jpeg', 'JPEG', JPEG_QUALITY), ('webp', 'WEBP', WEBP_QUALITY)):
+            path = rendition_path(name, media_pk, rendition, extension)
+            if storage.exists(path):
+                storage.delete(path)
+            paths[extension] = storage.save(path, encode(image, image_format, quality))
+        renditions[rendition] = {'width': image.width, 'height': image.height, **paths}
+    return renditions
+
+
+def delete_stale_renditions(old, new, storage=default_storage):
+    """Delete the files of ``old`` renditions that ``new`` did not overwrite"""
+    for rendition, paths in old.items():
+        for extension in ('jpeg', 'webp'):
+            path = paths.get(extension)
+            if path and new.get(rendition, {}).get(extension) != path:
+                storage.delete(path)
+
+
+def generate_renditions(media):
+    """Render the renditions of a ProductMedia and save them on the row, without firing save signals"""
+    renditions = {} if media.is_video or not media.media_file else render_file(media.media_file.name, media.pk)
+    delete_stale_renditions(media.renditions or {}, renditions)
+    media.renditions = renditions
+    type(media).objects.filter(pk=media.pk).update(renditions=renditions)
+    return renditions
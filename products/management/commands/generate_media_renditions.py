@@ -0,0 +1,84 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from core.cache import CATALOG, bump_version
+from products.images import delete_stale_renditions, render_file
+from products.models import ProductMedia
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+
+
+def render_media(media):
+    """Worker entry point, takes and returns plain values. The renditions are None if they could not be saved"""
+    pk, name = media
+    try:
+        return pk, render_file(name, pk)
+    except Exception as e:
+        logger.error(f"Could not render the renditions of media {pk}: {e}")
+        return pk, None
+
+
+class Command(BaseCommand):
+    help = 'Render the resized renditions of product images that have none, in parallel worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Media rendered per batch (default: {BATCH_SIZE})')
+        parser.add_argument('--force', action='store_true', help='Render media that already have renditions again')
+
+    def handle(self, *args, **options):
+        media = ProductMedia.objects.filter(is_video=False).exclude(media_file='').order_by('pk')
+        if not options['force']:
+            media = media.filter(renditions={})
+        media = media.only('pk', 'media_file', 'renditions')
+        batch_size = options['batch_size']
+        workers = max(1, options['workers'])
+
+        executor = None
+        if workers > 1:
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        rendered = skipped = failed = 0
+        cursor = 0
+        try:
+            while True:
+                batch = list(media.filter(pk__gt=cursor)[:batch_size])
+                if not batch:
+                    break
+                cursor = batch[-1].pk
+                jobs = [(item.pk, item.media_file.name) for item in batch]
+                results = dict(executor.map(render_media, jobs) if executor else map(render_media, jobs))
+
+                for item in batch:
+                    renditions = results[item.pk]
+                    if renditions is None:
+                        # Keeps its old renditions, and is picked up again by the next run
+                        failed += 1
+                        continue
+                    delete_stale_renditions(item.renditions, renditions)
+                    item.renditions = renditions
+                    if renditions:
+                        rendered += 1
+                    else:
+                        skipped += 1
+                with transaction.atomic():
+                    ProductMedia.objects.bulk_update(batch, ['renditions'])
+                self.stdout.write(f'  - {rendered + skipped + failed} media processed')
+                if len(batch) < batch_size:
+                    break
+        finally:
+            if executor:
+                executor.shutdown()
+
+        # bulk_update() skips the save signals that invalidate cached catalog pages
+        bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} images, skipped {skipped} files that are not images, {failed} failed.'
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from products.uploads import process_uploads, sweep_abandoned_uploads
+
+
+class Command(BaseCommand):
+    help = 'Turns completed chunked uploads into product media: probes them, stores them and renders their renditions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Uploads processed per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for uploads instead of exiting when none are queued')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        abandoned = sweep_abandoned_uploads()
+        if abandoned:
+            self.stdout.write(f'Deleted {abandoned} abandoned upload(s).')
+        while True:
+            done, failed = process_uploads(batch_size=options['batch_size'])
+            if done or failed:
+                self.stdout.write(f'Processed {done} upload(s), {failed} failed.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Media uploads processed.'))
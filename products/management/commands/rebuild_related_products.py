@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.cache import CATALOG, bump_version
+from products.recommendations import BATCH_SIZE, rebuild_related_products
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related products of every product from categories, orders and carts. Run nightly.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Products written per batch (default: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        count = rebuild_related_products(batch_size=options['batch_size'])
+        bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed related products for {count} products.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from products.search import index_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for products and categories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Products inserted per batch')
+
+    def handle(self, *args, **options):
+        if not index_available():
+            self.stdout.write(self.style.WARNING(
+                'The search index is only available on SQLite with FTS5; search uses the database fallback.'
+            ))
+            return
+
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products.'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from core.cache import CATALOG, bump_version
+from products.models import Product
+from products.slugs import SlugAllocator
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Give every product without a slug a unique one, in batches with a fixed number of queries each.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Products repaired per batch (default: {BATCH_SIZE})')
+        parser.add_argument('--dry-run', action='store_true', help='Show the new slugs without saving them')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        missing = Product.objects.filter(Q(slug__isnull=True) | Q(slug='')).order_by('pk').only('pk', 'name', 'slug')
+        # One allocator for the whole run, so products in different batches never get the same slug
+        allocator = SlugAllocator(Product, fallback='product')
+        fixed = 0
+        cursor = 0
+
+        while True:
+            batch = list(missing.filter(pk__gt=cursor)[:batch_size])
+            if not batch:
+                break
+            cursor = batch[-1].pk
+            allocator.prefetch(allocator.base_slug(product.name) for product in batch)
+            for product in batch:
+                product.slug = allocator.allocate(product.name)
+                self.stdout.write(f'  - "{product.name}" -> "{product.slug}"')
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Product.objects.bulk_update(batch, ['slug'])
+            fixed += len(batch)
+            if len(batch) < batch_size:
+                break
+
+        if not fixed:
+            self.stdout.write(self.style.SUCCESS('All products already have slugs.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Would fix {fixed} product slugs.'))
+        else:
+            # bulk_update() skips the save signals that invalidate cached catalog pages
+            bump_version(CATALOG)
+            self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} product slugs.'))
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def create_search_index(apps, schema_editor):
+    """Create and fill the FTS5 search tables, only on SQLite builds with FTS5"""
+    if not fts5_supported(schema_editor.connection):
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE products_product_fts USING fts5("
+        "name, sku, body, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE products_category_fts USING fts5("
+        "name, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO products_category_fts (rowid, name) SELECT id, name FROM products_productcategory"
+    )
+    backfill_product_index(apps, schema_editor)
+
+
+INSERT_PRODUCT = 'INSERT INTO products_product_fts (rowid, name, sku, body) VALUES (%s, %s, %s, %s)'
+
+
+def backfill_product_index(apps, schema_editor, batch_size=500):
+    """Index every product with the columns of products.search.product_document"""
+    Product = apps.get_model('products', 'Product')
+    products = Product.objects.select_related('category').order_by('pk').iterator(chunk_size=batch_size)
+    with schema_editor.connection.cursor() as cursor:
+        rows = []
+        for product in products:
+            body = ' '.join(filter(None, [
+                product.description,
+                product.category.name if product.category else '',
+                product.brand,
+                product.origin_country,
+                product.get_product_type_display(),
+            ]))
+            rows.append([product.pk, product.name, product.sku or '', body])
+            if len(rows) >= batch_size:
+                cursor.executemany(INSERT_PRODUCT, rows)
+                rows = []
+        if rows:
+            cursor.executemany(INSERT_PRODUCT, rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS products_product_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS products_category_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_alter_product_product_type_alter_product_weight_unit'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, reverse_code=drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:59
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def backfill_review_stats(apps, schema_editor):
+    """Fill the review statistics from the reviews that are already approved"""
+    Product = apps.get_model('products', 'Product')
+    Review = apps.get_model('products', 'Review')
+    stats = {}
+    for product_id, rating in Review.objects.filter(status='Approved').values_list('product_id', 'rating').iterator():
+        stats.setdefault(product_id, []).append(rating)
+    for product_id, ratings in stats.items():
+        Product.objects.filter(pk=product_id).update(
+            review_count=len(ratings),
+            average_rating=Decimal(str(round(sum(ratings) / len(ratings), 2))),
+            rating_histogram={str(stars): ratings.count(stars) for stars in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=3, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_histogram',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Approved reviews per star rating'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_review_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmedia',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
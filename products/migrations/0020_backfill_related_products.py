@@ -0,0 +1,84 @@
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations
+
+# The scoring of products.recommendations at the time of this migration
+RELATED_LIMIT = 8
+CATEGORY_CANDIDATES = 20
+MAX_BASKET_SIZE = 50
+CO_PURCHASE_WEIGHT = 3.0
+CO_CART_WEIGHT = 1.0
+CATEGORY_WEIGHT = 2.0
+PRODUCT_TYPE_WEIGHT = 1.0
+
+
+def co_occurrences(model, basket_field):
+    counts = defaultdict(Counter)
+    rows = model.objects.filter(product__isnull=False).order_by(basket_field).values_list(basket_field, 'product_id')
+    for _, basket in groupby(rows.iterator(chunk_size=2000), key=itemgetter(0)):
+        products = {product_id for _, product_id in basket}
+        if len(products) > MAX_BASKET_SIZE:
+            continue
+        for product_id in products:
+            counts[product_id].update(other for other in products if other != product_id)
+    return counts
+
+
+def backfill_related_products(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    RelatedProduct = apps.get_model('products', 'RelatedProduct')
+    purchases = co_occurrences(apps.get_model('orders', 'OrderItem'), 'order_id')
+    carts = co_occurrences(apps.get_model('orders', 'CartItem'), 'cart_id')
+
+    attributes = {}
+    newest = defaultdict(list)
+    products = Product.objects.order_by('-created_at', '-pk').values_list('pk', 'category_id', 'product_type', 'is_active')
+    for position, (pk, category_id, product_type, is_active) in enumerate(products.iterator(chunk_size=2000)):
+        attributes[pk] = (category_id, product_type, position, is_active)
+        if is_active and category_id is not None and len(newest[category_id]) <= CATEGORY_CANDIDATES:
+            newest[category_id].append(pk)
+
+    rows = []
+    for product_id, (category_id, product_type, _, _) in attributes.items():
+        scores = Counter()
+        for other, count in purchases[product_id].items():
+            scores[other] += CO_PURCHASE_WEIGHT * count
+        for other, count in carts[product_id].items():
+            scores[other] += CO_CART_WEIGHT * count
+        for other in newest.get(category_id, ()):
+            scores.setdefault(other, 0)
+
+        ranked = []
+        for other, score in scores.items():
+            if other == product_id or other not in attributes:
+                continue
+            other_category, other_type, position, is_active = attributes[other]
+            if not is_active:
+                continue
+            if category_id is not None and other_category == category_id:
+                score += CATEGORY_WEIGHT
+            if other_type == product_type:
+                score += PRODUCT_TYPE_WEIGHT
+            ranked.append((-score, position, other))
+        ranked.sort()
+        rows.extend(
+            RelatedProduct(product_id=product_id, related_id=other, rank=rank, score=-score)
+            for rank, (score, _, other) in enumerate(ranked[:RELATED_LIMIT], start=1)
+        )
+
+    RelatedProduct.objects.all().delete()
+    RelatedProduct.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_created_idx'),
+        ('products', '0019_product_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_related_products, migrations.RunPython.noop),
+    ]
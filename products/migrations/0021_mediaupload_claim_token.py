@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_backfill_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaupload',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
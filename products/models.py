@@ -1,8 +1,12 @@
 from django.db import models
+from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 from django.core.validators import RegexValidator
+from decimal import Decimal
+
+from .slugs import SlugAllocator
 
 class ProductCategory(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -19,6 +23,17 @@ class ProductCategory(models.Model):
     class Meta:
         verbose_name_plural = 'Product Categories'
 
+def primary_media_prefetch():
+    """Prefetch of the first media item of each product, read by Product.primary_media"""
+    return models.Prefetch('media', queryset=ProductMedia.objects.order_by('pk')[:1], to_attr='_primary_media')
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_primary_media(self):
+        """Load the category and the first media item of every product up front,
+        so product cards render in a fixed number of queries."""
+        return self.select_related('category').prefetch_related(primary_media_prefetch())
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -88,15 +103,72 @@ class Product(models.Model):
         ('refurbished', 'Refurbished')
     ], default='new')
 
+    # Approved review statistics, kept up to date by refresh_review_stats()
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True, editable=False)
+    rating_histogram = models.JSONField(default=dict, blank=True, editable=False, help_text="Approved reviews per star rating")
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Read from __dict__ so deferred fields are not loaded just for this
+        self._original_listing = (self.__dict__.get('category_id'), self.__dict__.get('product_type'))
+        self._original_is_active = self.__dict__.get('is_active')
+
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
         return reverse('products:product_detail', kwargs={'slug': self.slug})
 
+    @property
+    def primary_media(self):
+        """First media item of the product, taken from with_primary_media() when prefetched"""
+        if hasattr(self, '_primary_media'):
+            return self._primary_media[0] if self._primary_media else None
+        return self.media.order_by('pk').first()
+
+    @classmethod
+    def refresh_review_stats(cls, product_ids):
+        """Recompute the approved review count, average and histogram of the given products,
+        reading them in one aggregate query and writing them back in one bulk update"""
+        approved = models.Q(reviews__status='Approved')
+        stats = cls.objects.filter(pk__in=set(product_ids)).annotate(
+            approved_count=models.Count('reviews', filter=approved),
+            approved_avg=models.Avg('reviews__rating', filter=approved),
+            **{
+                f'stars_{stars}': models.Count('reviews', filter=approved & models.Q(reviews__rating=stars))
+                for stars in range(1, 6)
+            }
+        ).values('pk', 'approved_count', 'approved_avg', *[f'stars_{stars}' for stars in range(1, 6)])
+        products = []
+        for row in stats:
+            average = row['approved_avg']
+            products.append(cls(
+                pk=row['pk'],
+                review_count=row['approved_count'],
+                average_rating=Decimal(str(round(average, 2))) if average is not None else None,
+                rating_histogram={str(stars): row[f'stars_{stars}'] for stars in range(1, 6)},
+            ))
+        cls.objects.bulk_update(products, ['review_count', 'average_rating', 'rating_histogram'], batch_size=500)
+
+    @property
+    def average_rating_int(self):
+        return int(round(self.average_rating)) if self.average_rating else 0
+
+    def get_rating_breakdown(self):
+        """(stars, count, percent) for 5 down to 1 stars, for the review summary bars"""
+        breakdown = []
+        for stars in range(5, 0, -1):
+            count = self.rating_histogram.get(str(stars), 0)
+            percent = round(count * 100 / self.review_count) if self.review_count else 0
+            breakdown.append((stars, count, percent))
+        return breakdown
+
     def get_tax_amount(self):
         """Calculate tax amount based on price and tax percentage"""
         if self.price and self.tax_percentage:
@@ -124,27 +196,98 @@ class Product(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            num = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f'{base_slug}-{num}'
-                num += 1
-            self.slug = slug
+            self.slug = SlugAllocator(Product, fallback='product').allocate(self.name)
         super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages of the dashboard product list, see core.pagination
+            models.Index(fields=['created_at', 'id'], name='products_created_idx'),
+        ]
 
 class ProductMedia(models.Model):
     product = models.ForeignKey(Product, related_name='media', on_delete=models.CASCADE)
     media_file = models.FileField(upload_to='product_media/')
     is_video = models.BooleanField(default=False)
     caption = models.CharField(max_length=255, blank=True)
+    # Resized copies of the image, see products.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Saving a new or replaced file renders its renditions, unless an instance
+    # turns this off because its caller renders them itself
+    render_renditions = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'media_file' in self.get_deferred_fields():
+            # Not loaded, and left alone by saves unless it is loaded or assigned later
+            self._original_media_file = models.DEFERRED
+        else:
+            self._original_media_file = self.media_file.name
 
     def __str__(self):
         return f"Media for {self.product.name}"
 
+    def rendition_url(self, rendition, image_format='jpeg'):
+        """URL of a rendition, or of the original file when it has none"""
+        path = self.renditions.get(rendition, {}).get(image_format)
+        if path:
+            return self.media_file.storage.url(path)
+        return self.media_file.url if self.media_file else ''
+
+    def srcset(self, image_format='jpeg'):
+        """``srcset`` value listing every rendition in ``image_format`` by width"""
+        widths = {}
+        for rendition in self.renditions.values():
+            if rendition.get(image_format):
+                widths.setdefault(rendition['width'], rendition[image_format])
+        storage = self.media_file.storage
+        return ', '.join(f'{storage.url(path)} {width}w' for width, path in sorted(widths.items()))
+
+
+class MediaUpload(models.Model):
+    """A file uploaded in chunks, turned into ProductMedia in the background, see products.uploads"""
+
+    STATUS_CHOICES = (
+        ('uploading', 'Uploading'),
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    product = models.ForeignKey(Product, related_name='uploads', on_delete=models.CASCADE)
+    uploaded_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    is_video = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='uploading')
+    media = models.OneToOneField(ProductMedia, null=True, blank=True, related_name='upload', on_delete=models.SET_NULL)
+    # What probing found out about the file, e.g. its format, dimensions and duration
+    details = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # Set by the worker that claimed the upload, see products.uploads.claim
+    claim_token = models.CharField(max_length=32, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='products_upload_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} for {self.product.name} ({self.status})"
+
+    @property
+    def progress(self):
+        """Percentage of the file received"""
+        return 100 if not self.size else round(100 * self.received / self.size)
+
 class Review(models.Model):
     STATUS_CHOICES = (
         ('Pending', 'Pending'),
@@ -160,6 +303,13 @@ class Review(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Read from __dict__ so deferred fields are not loaded just for this
+        self._original_status = self.__dict__.get('status')
+        self._original_rating = self.__dict__.get('rating')
+        self._original_product_id = self.__dict__.get('product_id')
+
     def __str__(self):
         return f'Review by {self.author} for {self.product.name}'
 
@@ -183,3 +333,17 @@ class DealRequest(models.Model):
 
     def __str__(self):
         return f'Deal request from {self.name} for {self.product.name}'
+
+class RelatedProduct(models.Model):
+    """A precomputed recommendation, built by ``products.recommendations``"""
+    product = models.ForeignKey(Product, related_name='related_products', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='recommended_for', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    def __str__(self):
+        return f'{self.related} for {self.product} (#{self.rank})'
+
+    class Meta:
+        ordering = ['product', 'rank']
+        unique_together = ['product', 'rank']
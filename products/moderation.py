@@ -0,0 +1,119 @@
+"""
+Bulk review moderation.
+
+The admin approves and rejects reviews in bulk. ``approve_reviews`` walks the
+selection in primary key batches. Each batch loads its reviews together with
+their products. In one transaction, it then locks the reviews of the batch
+that are still not approved, approves them with one UPDATE, and sends the
+approval emails of those whose reviewer left an address with one
+``send_messages()`` call on a shared connection. Reviews approved by someone
+else since the batch was read are left out. With the default outbox backend,
+queueing the emails and approving the batch commit in the same transaction,
+so a review is never approved without its email or notified twice.
+``process_email_outbox`` delivers the emails later.
+
+``update()`` fires no save signals, so once every batch is done the rating
+statistics of the affected products are refreshed together, and the catalog
+cache version is bumped once that commits.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from core.cache import CATALOG, bump_version
+from .models import Product, Review
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def build_approval_email(review, build_absolute_uri, connection=None):
+    """The email telling ``review.email`` that their review is published"""
+    context = {
+        'user_name': review.author,
+        'product_name': review.product.name,
+        'product_url': build_absolute_uri(review.product.get_absolute_url()),
+        'logo_url': build_absolute_uri(settings.MEDIA_URL + 'red_sun_logo.png'),
+    }
+    html_content = render_to_string('products/email/review_approved_user.html', context)
+    message = EmailMultiAlternatives(
+        'Your Review has been Approved!',
+        strip_tags(html_content),
+        settings.DEFAULT_FROM_EMAIL,
+        [review.email],
+        connection=connection,
+    )
+    message.attach_alternative(html_content, 'text/html')
+    return message
+
+
+def approve_reviews(queryset, build_absolute_uri, connection=None, batch_size=BATCH_SIZE):
+    """
+    Approve every review of ``queryset`` that is not approved yet and notify
+    its author. ``build_absolute_uri`` turns paths into the links of the email,
+    usually ``request.build_absolute_uri``.
+
+    Returns a ``(approved, failed)`` tuple of counts. A batch whose emails
+    cannot be sent stays unapproved, and so does the whole selection when the
+    mail server cannot be reached.
+    """
+    reviews = queryset.exclude(status='Approved').select_related('product').order_by('pk')
+    connection = connection or get_connection(fail_silently=False)
+    approved = failed = 0
+    product_ids = set()
+    cursor = 0
+
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not connect to the mail server to approve reviews: {e}")
+        return 0, reviews.count()
+    try:
+        while True:
+            batch = list(reviews.filter(pk__gt=cursor)[:batch_size])
+            if not batch:
+                break
+            cursor = batch[-1].pk
+            try:
+                with transaction.atomic():
+                    # Reviews approved by someone else since the batch was read already had their email
+                    pending = set(
+                        Review.objects.select_for_update()
+                        .filter(pk__in=[review.pk for review in batch]).exclude(status='Approved')
+                        .values_list('pk', flat=True)
+                    )
+                    claimed = [review for review in batch if review.pk in pending]
+                    Review.objects.filter(pk__in=pending).update(status='Approved')
+                    connection.send_messages([
+                        build_approval_email(review, build_absolute_uri, connection)
+                        for review in claimed if review.email
+                    ])
+            except Exception as e:
+                failed += len(batch)
+                logger.error(f"Failed to approve {len(batch)} reviews: {e}")
+                continue
+            approved += len(claimed)
+            product_ids.update(review.product_id for review in claimed)
+    finally:
+        connection.close()
+
+    if product_ids:
+        Product.refresh_review_stats(product_ids)
+        transaction.on_commit(lambda: bump_version(CATALOG))
+    return approved, failed
+
+
+def reject_reviews(queryset):
+    """Reject every review of ``queryset``, returns how many were updated"""
+    product_ids = set(queryset.filter(status='Approved').values_list('product_id', flat=True))
+    rejected = queryset.update(status='Rejected')
+    if product_ids:
+        Product.refresh_review_stats(product_ids)
+    transaction.on_commit(lambda: bump_version(CATALOG))
+    return rejected
@@ -0,0 +1,159 @@
+"""
+Precomputed related products.
+
+The product page reads its recommendations from ``RelatedProduct``. It gets
+them with one indexed lookup on ``(product, rank)``, so nothing is scored
+per request. Each product's candidates are scored as follows:
+
+* 3 points for every order that contains both products (co-purchase)
+* 1 point for every cart that holds both products (co-cart)
+* 2 points for being in the same category
+* 1 point for having the same product type
+
+Inactive products are never recommended.
+
+Products in the same category are only considered if they are among the
+newest ``CATEGORY_CANDIDATES`` of that category. That keeps large categories
+from adding a quadratic number of pairs. Ties go to the newer product.
+
+``manage.py rebuild_related_products`` rebuilds every product and should run
+nightly, because orders and carts change all the time. ``products.signals``
+refreshes a product once a save that adds it or changes its category, type
+or active state commits, together with the newest products of its category.
+"""
+
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+
+from orders.models import CartItem, OrderItem
+from .models import Product, RelatedProduct
+
+RELATED_LIMIT = 8
+CATEGORY_CANDIDATES = 20
+BATCH_SIZE = 500
+# Baskets larger than this say little about how their products relate
+MAX_BASKET_SIZE = 50
+
+CO_PURCHASE_WEIGHT = 3.0
+CO_CART_WEIGHT = 1.0
+CATEGORY_WEIGHT = 2.0
+PRODUCT_TYPE_WEIGHT = 1.0
+
+
+def co_occurrences(rows, product_ids=None):
+    """
+    Count the baskets each pair of products shares.
+
+    ``rows`` are ``(basket_id, product_id)`` pairs ordered by basket. Only
+    pairs starting with one of ``product_ids`` are counted when it is given.
+    """
+    counts = defaultdict(Counter)
+    for _, basket in groupby(rows, key=itemgetter(0)):
+        products = {product_id for _, product_id in basket}
+        if len(products) > MAX_BASKET_SIZE:
+            continue
+        for product_id in products:
+            if product_ids is None or product_id in product_ids:
+                counts[product_id].update(other for other in products if other != product_id)
+    return counts
+
+
+def basket_rows(model, basket_field, product_ids=None):
+    queryset = model.objects.filter(product__isnull=False)
+    if product_ids is not None:
+        baskets = model.objects.filter(product__in=product_ids).values(basket_field)
+        queryset = queryset.filter(**{f'{basket_field}__in': baskets})
+    return queryset.order_by(basket_field).values_list(basket_field, 'product_id').iterator(chunk_size=2000)
+
+
+def score_products(product_ids=None):
+    """Return ``{product_id: [(related_id, score), ...]}`` best first, for all products or ``product_ids``"""
+    targets = None if product_ids is None else set(product_ids)
+    purchases = co_occurrences(basket_rows(OrderItem, 'order_id', targets), targets)
+    carts = co_occurrences(basket_rows(CartItem, 'cart_id', targets), targets)
+
+    products = Product.objects.order_by('-created_at', '-pk').values_list('pk', 'category_id', 'product_type', 'is_active')
+    if targets is not None:
+        candidate_ids = set(targets)
+        for counts in (purchases, carts):
+            for neighbours in counts.values():
+                candidate_ids.update(neighbours)
+        categories = Product.objects.filter(pk__in=targets, category__isnull=False).values('category_id')
+        products = products.filter(pk__in=candidate_ids) | products.filter(category__in=categories)
+
+    # Every product's category and type, plus the newest products of each category,
+    # read newest first so candidate lists and tie-breaks prefer new products
+    attributes = {}
+    newest = defaultdict(list)
+    for position, (pk, category_id, product_type, is_active) in enumerate(products.iterator(chunk_size=2000)):
+        attributes[pk] = (category_id, product_type, position, is_active)
+        # One extra, as a product is among the newest of its own category
+        if is_active and category_id is not None and len(newest[category_id]) <= CATEGORY_CANDIDATES:
+            newest[category_id].append(pk)
+
+    recommendations = {}
+    for product_id in (targets if targets is not None else attributes):
+        if product_id not in attributes:
+            continue
+        category_id, product_type, _, _ = attributes[product_id]
+        scores = Counter()
+        for other, count in purchases[product_id].items():
+            scores[other] += CO_PURCHASE_WEIGHT * count
+        for other, count in carts[product_id].items():
+            scores[other] += CO_CART_WEIGHT * count
+        for other in newest.get(category_id, ()):
+            scores.setdefault(other, 0)
+
+        ranked = []
+        for other, score in scores.items():
+            if other == product_id or other not in attributes:
+                continue
+            other_category, other_type, position, is_active = attributes[other]
+            if not is_active:
+                continue
+            if category_id is not None and other_category == category_id:
+                score += CATEGORY_WEIGHT
+            if other_type == product_type:
+                score += PRODUCT_TYPE_WEIGHT
+            ranked.append((-score, position, other))
+        ranked.sort()
+        recommendations[product_id] = [(other, -score) for score, _, other in ranked[:RELATED_LIMIT]]
+    return recommendations
+
+
+def save_recommendations(recommendations):
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=recommendations).delete()
+        RelatedProduct.objects.bulk_create([
+            RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=score)
+            for product_id, related in recommendations.items()
+            for rank, (related_id, score) in enumerate(related, start=1)
+        ])
+
+
+def refresh_related_products(product_ids):
+    """Recompute the recommendations of ``product_ids``"""
+    save_recommendations(score_products(product_ids))
+
+
+def refresh_product_neighbourhood(product_id):
+    """Recompute a changed product and the newest products of its category, whose lists it may now belong to"""
+    category_id = Product.objects.filter(pk=product_id).values_list('category_id', flat=True).first()
+    neighbours = Product.objects.filter(category_id=category_id, is_active=True).exclude(category__isnull=True)
+    neighbours = neighbours.order_by('-created_at', '-pk').values_list('pk', flat=True)[:CATEGORY_CANDIDATES]
+    refresh_related_products([product_id, *neighbours])
+
+
+def rebuild_related_products(batch_size=BATCH_SIZE):
+    """Recompute the recommendations of every product, returns the number of products"""
+    recommendations = score_products()
+    product_ids = list(recommendations)
+    for start in range(0, len(product_ids), batch_size):
+        save_recommendations({
+            product_id: recommendations[product_id] for product_id in product_ids[start:start + batch_size]
+        })
+    # Products that no longer exist have their rows removed by the cascade
+    return len(product_ids)
@@ -0,0 +1,191 @@
+"""
+Full-text search over products and categories.
+
+On SQLite the searchable text is kept in two FTS5 tables whose rowid is the
+product or category primary key. The signals in ``products.signals`` keep them
+in sync on save/delete, and ``manage.py rebuild_search_index`` rebuilds them from
+scratch. Results are ranked with bm25, and every query term matches as a
+prefix. The match and the rank are subqueries of the product query, so
+results are counted and paged by the database like any other queryset.
+Other database backends have no index, so search falls back to a weighted
+``icontains`` query.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Product, ProductCategory
+
+PRODUCT_INDEX_TABLE = 'products_product_fts'
+CATEGORY_INDEX_TABLE = 'products_category_fts'
+SKU_PATTERN = re.compile(r'^[0-9]{8,12}$')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# bm25 column weights for the product index: name, sku, body
+PRODUCT_RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+_index_available = None
+
+
+def index_available():
+    """Whether the FTS5 index tables exist on the default database"""
+    global _index_available
+    if _index_available is None:
+        _index_available = (
+            connection.vendor == 'sqlite' and
+            PRODUCT_INDEX_TABLE in connection.introspection.table_names()
+        )
+    return _index_available
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_PATTERN.findall(text or '')]
+
+
+def build_match_expression(query):
+    """Turn free text into an FTS5 query where every term is a quoted prefix"""
+    return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+
+def product_document(product):
+    """Return the (name, sku, body) columns indexed for a product"""
+    body = ' '.join(filter(None, [
+        product.description,
+        product.category.name if product.category else '',
+        product.brand,
+        product.origin_country,
+        product.get_product_type_display(),
+    ]))
+    return product.name, product.sku or '', body
+
+
+def index_product(product):
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PRODUCT_INDEX_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {PRODUCT_INDEX_TABLE} (rowid, name, sku, body) VALUES (%s, %s, %s, %s)',
+            [product.pk, *product_document(product)]
+        )
+
+
+def remove_product(product_id):
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PRODUCT_INDEX_TABLE} WHERE rowid = %s', [product_id])
+
+
+def index_category(category):
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {CATEGORY_INDEX_TABLE} WHERE rowid = %s', [category.pk])
+        cursor.execute(
+            f'INSERT INTO {CATEGORY_INDEX_TABLE} (rowid, name) VALUES (%s, %s)',
+            [category.pk, category.name]
+        )
+
+
+def remove_category(category_id):
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {CATEGORY_INDEX_TABLE} WHERE rowid = %s', [category_id])
+
+
+def rebuild_index(batch_size=500):
+    """Re-index every product and category, returns the number of products indexed"""
+    if not index_available():
+        return 0
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PRODUCT_INDEX_TABLE}')
+        cursor.execute(f'DELETE FROM {CATEGORY_INDEX_TABLE}')
+        cursor.executemany(
+            f'INSERT INTO {CATEGORY_INDEX_TABLE} (rowid, name) VALUES (%s, %s)',
+            list(ProductCategory.objects.values_list('pk', 'name'))
+        )
+        rows = []
+        for product in Product.objects.select_related('category').order_by('pk').iterator(chunk_size=batch_size):
+            rows.append([product.pk, *product_document(product)])
+            if len(rows) >= batch_size:
+                cursor.executemany(
+                    f'INSERT INTO {PRODUCT_INDEX_TABLE} (rowid, name, sku, body) VALUES (%s, %s, %s, %s)', rows
+                )
+                count += len(rows)
+                rows = []
+        if rows:
+            cursor.executemany(
+                f'INSERT INTO {PRODUCT_INDEX_TABLE} (rowid, name, sku, body) VALUES (%s, %s, %s, %s)', rows
+            )
+            count += len(rows)
+    return count
+
+
+def match_filter(table, expression):
+    """Primary keys of the rows of ``table`` matching an FTS5 expression, as a subquery"""
+    return RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [expression])
+
+
+def match_rank(table, expression, model, weights=None):
+    """bm25 rank of each ``model`` row against an FTS5 expression, lower is more relevant"""
+    rank = f"bm25({table}, {', '.join(str(w) for w in weights)})" if weights else f'bm25({table})'
+    quote = connection.ops.quote_name
+    outer = f'{quote(model._meta.db_table)}.{quote(model._meta.pk.column)}'
+    return RawSQL(f'SELECT {rank} FROM {table} WHERE {table} MATCH %s AND {table}.rowid = {outer}', [expression],
+                  output_field=FloatField())
+
+
+def search_products(queryset, query):
+    """
+    Filter a product queryset by ``query`` and order it by relevance.
+
+    Matching and ranking happen inside the query, so the results are counted
+    and paged by the database like those of any other queryset.
+    """
+    query = query.strip()
+    if SKU_PATTERN.match(query):
+        # Exact SKU lookups go straight to the unique index
+        exact = queryset.filter(sku=query)
+        if exact.exists():
+            return exact
+    if index_available():
+        expression = build_match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=match_filter(PRODUCT_INDEX_TABLE, expression)).annotate(
+            search_rank=match_rank(PRODUCT_INDEX_TABLE, expression, queryset.model, PRODUCT_RANK_WEIGHTS)
+        ).order_by('search_rank', '-created_at', '-pk')
+
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(sku__icontains=query)
+    ).annotate(
+        search_rank=Case(
+            When(name__iexact=query, then=Value(4)),
+            When(name__istartswith=query, then=Value(3)),
+            When(name__icontains=query, then=Value(2)),
+            When(sku__icontains=query, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    ).order_by('-search_rank', '-created_at', '-pk')
+
+
+def search_categories(queryset, query):
+    """Filter a category queryset by ``query`` and order it by relevance"""
+    query = query.strip()
+    if index_available():
+        expression = build_match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=match_filter(CATEGORY_INDEX_TABLE, expression)).annotate(
+            search_rank=match_rank(CATEGORY_INDEX_TABLE, expression, queryset.model)
+        ).order_by('search_rank', 'name')
+    return queryset.filter(name__icontains=query).order_by('name')
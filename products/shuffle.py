@@ -0,0 +1,103 @@
+"""
+Per-session shuffled ordering for the product catalog.
+
+Instead of asking the database for ``ORDER BY RANDOM()`` on every request, the
+product ids are ordered in Python by a keyed hash of the visitor's shuffle
+seed. The order is stable for one visitor while they page through the catalog
+and rotates for everyone every ``SHUFFLE_ROTATION_SECONDS``.
+
+Sessions draw their seed from ``SHUFFLE_SEEDS`` buckets, so visitors share a
+bounded number of orders. The ordered ids of each seed and filter are cached,
+keyed by the ``shuffle`` cache group. A listing page then reads one cache
+entry and the products of that page, and only the first visitor of a seed
+hashes and sorts the ids. ``products.signals`` bumps the group when a product
+is added or removed, or moves to another category or type, so a cached order
+never misses a product or shows one that no longer matches.
+"""
+
+import hashlib
+import random
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core.cache import bump_version, versioned_key
+from .models import Product
+
+SHUFFLE = 'shuffle'
+SHUFFLE_SESSION_KEY = 'product_shuffle_seed'
+SHUFFLE_ROTATION_SECONDS = 6 * 60 * 60
+SHUFFLE_SEEDS = 128
+
+
+def invalidate_shuffled_ids():
+    """Drop every cached order, once the current transaction commits"""
+    transaction.on_commit(lambda: bump_version(SHUFFLE))
+
+
+def get_shuffle_seed(request):
+    """Return the shuffle seed for this visitor, combined with the current rotation window"""
+    seed = request.session.get(SHUFFLE_SESSION_KEY)
+    if seed is None:
+        seed = random.randrange(SHUFFLE_SEEDS)
+        request.session[SHUFFLE_SESSION_KEY] = seed
+    window = int(time.time() // SHUFFLE_ROTATION_SECONDS)
+    return f'{seed}:{window}'
+
+
+def shuffled_ids(seed, ids):
+    """Order ids by a keyed hash so each id keeps its place when others are added or removed"""
+    def sort_key(pk):
+        return hashlib.blake2b(f'{seed}:{pk}'.encode(), digest_size=8).digest()
+    return sorted(ids, key=sort_key)
+
+
+def get_shuffled_ids(seed, queryset, filter_key=''):
+    """
+    The ids of ``queryset`` in the order of ``seed``, from the cache when possible.
+
+    ``filter_key`` identifies the filters applied to ``queryset``, an empty key
+    standing for the whole catalog.
+    """
+    key = versioned_key('products:shuffle', [SHUFFLE], seed, filter_key)
+    ids = cache.get(key)
+    if ids is None:
+        ids = shuffled_ids(seed, queryset.order_by().values_list('pk', flat=True))
+        cache.set(key, ids, SHUFFLE_ROTATION_SECONDS)
+    return ids
+
+
+class ShuffledProducts:
+    """
+    Paginator-compatible sequence of products in shuffled order.
+
+    Only the ids of the requested page are loaded from ``queryset``, so paging
+    costs one ``pk IN (...)`` query regardless of catalog size.
+    """
+
+    def __init__(self, queryset, ordered_ids):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.ordered_ids = ordered_ids
+
+    def count(self):
+        return len(self.ordered_ids)
+
+    def __len__(self):
+        return len(self.ordered_ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            page_ids = self.ordered_ids[index]
+            products = self.queryset.in_bulk(page_ids)
+            return [products[pk] for pk in page_ids if pk in products]
+        return self[index:index + 1][0]
+
+
+def shuffle_queryset(request, queryset, filter_key=''):
+    """Return ``queryset``, filtered as described by ``filter_key``, in the visitor's shuffled order"""
+    return ShuffledProducts(queryset, get_shuffled_ids(get_shuffle_seed(request), queryset, filter_key))
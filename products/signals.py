@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from core.cache import CATALOG, bump_version
+from .images import generate_renditions
+from .models import Product, ProductCategory, ProductMedia, Review
+from .recommendations import refresh_product_neighbourhood
+from .shuffle import invalidate_shuffled_ids
+from . import search
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    """
+    Refresh the shuffled catalog and the search index when a product changes.
+    Its recommendations, and those of its category, are refreshed after the
+    transaction commits, and only when it is new or changes category, type
+    or active state.
+    """
+    listing = (instance.category_id, instance.product_type)
+    if created or listing != instance._original_listing:
+        invalidate_shuffled_ids()
+    if created or listing != instance._original_listing or instance.is_active != instance._original_is_active:
+        transaction.on_commit(lambda: refresh_product_neighbourhood(instance.pk))
+    instance._original_listing = listing
+    instance._original_is_active = instance.is_active
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Refresh the shuffled catalog and the search index when a product is removed"""
+    invalidate_shuffled_ids()
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=ProductCategory)
+def category_saved(sender, instance, **kwargs):
+    """Re-index the category and its products, which carry the category name"""
+    search.index_category(instance)
+    for product in instance.products.select_related('category'):
+        search.index_product(product)
+
+
+@receiver(post_delete, sender=ProductCategory)
+def category_deleted(sender, instance, **kwargs):
+    search.remove_category(instance.pk)
+
+
+@receiver(post_save, sender=ProductMedia)
+def media_saved(sender, instance, created, **kwargs):
+    """Render the resized copies of a new or replaced upload"""
+    if instance._original_media_file is DEFERRED:
+        # Fetched without the file, which the save only wrote if it was loaded or assigned since
+        if 'media_file' not in instance.__dict__:
+            return
+        replaced = True
+    else:
+        replaced = instance.media_file.name != instance._original_media_file
+    if (created or replaced) and instance.render_renditions:
+        generate_renditions(instance)
+    instance._original_media_file = instance.media_file.name
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    """
+    Refresh the review statistics when a review is approved, leaves the
+    approved state, or is approved and changes its rating or product. A review
+    moved to another product refreshes both products. Pending and rejected
+    reviews are not shown, so saving them leaves the catalog cache alone.
+    """
+    if instance.status == 'Approved' or instance._original_status == 'Approved':
+        transaction.on_commit(lambda: bump_version(CATALOG))
+        current = (instance.status, instance.rating, instance.product_id)
+        original = (instance._original_status, instance._original_rating, instance._original_product_id)
+        if created or current != original:
+            Product.refresh_review_stats({instance.product_id, instance._original_product_id} - {None})
+    instance._original_status = instance.status
+    instance._original_rating = instance.rating
+    instance._original_product_id = instance.product_id
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    if instance._original_status == 'Approved':
+        Product.refresh_review_stats([instance.product_id])
+        transaction.on_commit(lambda: bump_version(CATALOG))
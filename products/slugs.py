@@ -0,0 +1,62 @@
+"""
+Unique slug allocation.
+
+A slug is the slugified name, or the name followed by the lowest free ``-N``
+suffix when the plain slug is already taken, e.g. ``shawl``, ``shawl-1``,
+``shawl-2``. ``SlugAllocator`` loads every taken slug for a set of base slugs
+in one query. It reads each base and the slugs starting with ``base-``, so
+allocating slugs for a whole batch of products costs a single query. On
+PostgreSQL the prefix match uses the ``varchar_pattern_ops`` index Django
+creates next to the unique index of a slug field, whatever the collation.
+"""
+
+from django.db.models import Q
+from django.utils.text import slugify
+
+
+class SlugAllocator:
+    """Hands out unique slugs for ``model``, remembering the ones it has given out"""
+
+    def __init__(self, model, field='slug', fallback='item'):
+        self.model = model
+        self.field = field
+        self.fallback = fallback
+        self.max_length = model._meta.get_field(field).max_length
+        # Taken suffixes per base slug, 0 standing for the base slug itself
+        self.taken = {}
+
+    def base_slug(self, name):
+        # Leave room for a suffix within the column length
+        return slugify(name)[:self.max_length - 8].strip('-') or self.fallback
+
+    def prefetch(self, bases):
+        """Load the taken slugs of every base not loaded yet, in one query"""
+        bases = {base for base in bases if base not in self.taken}
+        if not bases:
+            return
+        condition = Q()
+        for base in bases:
+            self.taken[base] = set()
+            condition |= Q(**{self.field: base}) | Q(**{f'{self.field}__startswith': f'{base}-'})
+        for slug in self.model._default_manager.filter(condition).values_list(self.field, flat=True):
+            self.record(slug)
+
+    def record(self, slug):
+        """Note ``slug`` as taken, if it is one of the loaded bases or one of their suffixed forms"""
+        if slug in self.taken:
+            self.taken[slug].add(0)
+            return
+        base, _, suffix = slug.rpartition('-')
+        if base in self.taken and suffix.isdigit() and not suffix.startswith('0'):
+            self.taken[base].add(int(suffix))
+
+    def allocate(self, name):
+        """A unique slug for ``name``"""
+        base = self.base_slug(name)
+        self.prefetch([base])
+        taken = self.taken[base]
+        suffix = 0
+        while suffix in taken:
+            suffix += 1
+        taken.add(suffix)
+        return f'{base}-{suffix}' if suffix else base
@@ -0,0 +1,25 @@
+"""
+Celery tasks for products.
+This file can be used with Celery for automated task scheduling.
+"""
+
+from celery import shared_task
+from django.core.management import call_command
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_media_uploads():
+    """
+    Celery task to turn completed media uploads into product media.
+    This task should be scheduled to run every minute.
+    """
+    try:
+        call_command('process_media_uploads')
+        logger.info("Media uploads processed successfully")
+        return "Media uploads processed successfully"
+    except Exception as e:
+        logger.error(f"Error processing media uploads: {str(e)}")
+        raise e
@@ -0,0 +1,43 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+DEFAULT_SIZES = {
+    'thumbnail': '200px',
+    'card': '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw',
+    'detail': '(min-width: 1024px) 50vw, 100vw',
+}
+
+
+@register.simple_tag
+def rendition_url(media, rendition='card'):
+    """URL of one rendition of a ProductMedia, for CSS backgrounds and emails"""
+    return media.rendition_url(rendition) if media else ''
+
+
+@register.simple_tag
+def responsive_image(media, rendition='card', sizes=None, **attrs):
+    """
+    An ``<img>`` showing ``rendition`` with every rendition in its ``srcset``,
+    wrapped in a ``<picture>`` that offers the WebP copies first.
+
+    Extra keyword arguments become attributes of the ``<img>``, with
+    underscores turned into dashes, e.g. ``alt=product.name class="w-full"``.
+    """
+    if not media:
+        return ''
+    attrs = {key.replace('_', '-'): value for key, value in attrs.items()}
+    attrs.setdefault('loading', 'lazy')
+    details = media.renditions.get(rendition)
+    if not details:
+        return format_html('<img src="{}"{}>', media.rendition_url(rendition), flatatt(attrs))
+
+    sizes = sizes or DEFAULT_SIZES.get(rendition, '100vw')
+    attrs.update(width=details['width'], height=details['height'])
+    return format_html(
+        '<picture style="display: contents"><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        media.srcset('webp'), sizes, media.rendition_url(rendition), media.srcset(), sizes, flatatt(attrs),
+    )
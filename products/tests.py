@@ -1,3 +1,570 @@
-from django.test import TestCase
+from decimal import Decimal
+from importlib import import_module
+import tempfile
+from unittest import mock
+from io import BytesIO, StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from core.models import DeliveryCharge
+from core.testing import TEST_CACHES, TEST_STORAGES
+from orders.models import Order, OrderItem
+from . import moderation, search, uploads
+from .images import render_file
+from .models import MediaUpload, Product, ProductCategory, ProductMedia, RelatedProduct, Review
+from .recommendations import rebuild_related_products
+from .shuffle import get_shuffled_ids
+from .slugs import SlugAllocator
+from .uploads import process_uploads, queue_file
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReviewStatsTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+
+    def add_review(self, rating, status='Approved'):
+        return Review.objects.create(product=self.product, author='Ali', comment='Lovely', rating=rating, status=status)
+
+    def test_stats_follow_approval_and_rejection(self):
+        self.add_review(5)
+        self.add_review(4)
+        pending = self.add_review(1, status='Pending')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.average_rating, Decimal('4.50'))
+
+        pending.status = 'Approved'
+        pending.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 3)
+        self.assertEqual(self.product.average_rating, Decimal('3.33'))
+        self.assertEqual(self.product.rating_histogram, {'1': 1, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        pending.status = 'Rejected'
+        pending.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.rating_histogram['1'], 0)
+
+    def test_rating_changes_and_moves_refresh_both_products(self):
+        review = self.add_review(5)
+        self.add_review(3)
+        review.rating = 1
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.average_rating, Decimal('2.00'))
+
+        rug = Product.objects.create(name='Rug', description='Wool', price=Decimal('5000.00'))
+        review.product = rug
+        review.save()
+        self.product.refresh_from_db()
+        rug.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.average_rating), (1, Decimal('3.00')))
+        self.assertEqual((rug.review_count, rug.average_rating), (1, Decimal('1.00')))
+
+    def test_deleting_an_approved_review_updates_stats(self):
+        review = self.add_review(3)
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 0)
+        self.assertIsNone(self.product.average_rating)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReviewModerationTests(TestCase):
+    def setUp(self):
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        self.rug = Product.objects.create(name='Rug', description='Kilim', price=Decimal('5000.00'))
+
+    def add_reviews(self, product, ratings, email=True, status='Pending'):
+        return Review.objects.bulk_create([
+            Review(product=product, author=f'Buyer {i}', email=f'buyer{i}@example.com' if email else None,
+                   comment='Lovely', rating=rating, status=status)
+            for i, rating in enumerate(ratings)
+        ])
+
+    def test_admin_action_approves_queues_emails_and_refreshes_stats(self):
+        reviews = self.add_reviews(self.shawl, [5, 4]) + self.add_reviews(self.rug, [3], email=False)
+        already_approved = self.add_reviews(self.rug, [1], status='Approved')
+        self.client.force_login(User.objects.create_superuser('moderator', 'moderator@example.com', 'secret'))
+        self.client.post(reverse('admin:products_review_changelist'), {
+            'action': 'approve_reviews',
+            '_selected_action': [review.pk for review in reviews + already_approved],
+        })
+
+        self.assertEqual(Review.objects.filter(status='Approved').count(), 4)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['buyer0@example.com', 'buyer1@example.com'])
+        self.assertIn('http://testserver/', mail.outbox[0].alternatives[0][0])
+        self.shawl.refresh_from_db()
+        self.rug.refresh_from_db()
+        self.assertEqual((self.shawl.review_count, self.shawl.average_rating), (2, Decimal('4.50')))
+        self.assertEqual((self.rug.review_count, self.rug.rating_histogram['3']), (2, 1))
+
+    def test_query_count_does_not_grow_with_the_selection(self):
+        self.add_reviews(self.shawl, [5, 4])
+        with CaptureQueriesContext(connection) as few:
+            moderation.approve_reviews(Review.objects.all(), lambda path: f'http://testserver{path}')
+        self.add_reviews(self.shawl, [5] * 20)
+        self.add_reviews(self.rug, [4] * 20)
+        with CaptureQueriesContext(connection) as many:
+            approved, failed = moderation.approve_reviews(Review.objects.all(), lambda path: f'http://testserver{path}')
+        self.assertEqual((approved, failed), (40, 0))
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(mail.outbox), 42)
+
+    def test_reviews_approved_meanwhile_are_not_notified_again(self):
+        first, second = self.add_reviews(self.shawl, [5, 4])
+        select_for_update = Review.objects.select_for_update
+
+        def approved_by_someone_else_first():
+            Review.objects.filter(pk=first.pk).update(status='Approved')
+            return select_for_update()
+
+        with mock.patch.object(Review.objects, 'select_for_update', approved_by_someone_else_first):
+            approved, failed = moderation.approve_reviews(Review.objects.all(), lambda path: f'http://testserver{path}')
+        self.assertEqual((approved, failed), (1, 0))
+        self.assertEqual([email.to[0] for email in mail.outbox], [second.email])
+
+    def test_catalog_version_is_bumped_once_the_approval_commits(self):
+        self.add_reviews(self.shawl, [5])
+        with mock.patch('products.moderation.bump_version') as bump:
+            with self.captureOnCommitCallbacks(execute=True):
+                moderation.approve_reviews(Review.objects.all(), lambda path: f'http://testserver{path}')
+                bump.assert_not_called()
+            bump.assert_called_once()
+            with self.captureOnCommitCallbacks(execute=True):
+                moderation.reject_reviews(Review.objects.all())
+                self.assertEqual(bump.call_count, 1)
+            self.assertEqual(bump.call_count, 2)
+
+    def test_unreachable_mail_server_leaves_the_selection_pending(self):
+        self.add_reviews(self.shawl, [5, 4])
+        connection = mock.Mock()
+        connection.open.side_effect = ConnectionRefusedError
+        with self.assertLogs('products.moderation', 'ERROR'):
+            approved, failed = moderation.approve_reviews(
+                Review.objects.all(), lambda path: f'http://testserver{path}', connection=connection,
+            )
+        self.assertEqual((approved, failed), (0, 2))
+        self.assertFalse(Review.objects.filter(status='Approved').exists())
+        connection.send_messages.assert_not_called()
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class ProductCardQueryTests(TestCase):
+    def setUp(self):
+        self.category = ProductCategory.objects.create(name='Shawls')
+        self.client.force_login(User.objects.create(username='shopper'))
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Shawl {i}', description='Pashmina', category=self.category,
+                                             price=Decimal('1000.00'))
+            for j in range(2):
+                ProductMedia.objects.create(product=product, media_file=SimpleUploadedFile(f'shawl{i}-{j}.jpg', b'jpg'))
+
+    def test_cards_read_category_and_first_media_in_two_queries(self):
+        self.add_products(5)
+        with self.assertNumQueries(2):
+            products = list(Product.objects.with_primary_media())
+            cards = [(product.category.name, product.primary_media.media_file.name) for product in products]
+        self.assertEqual(len(cards), 5)
+        self.assertTrue(all(name.startswith('product_media/shawl') and '-0' in name for _, name in cards))
+
+    def test_listing_query_count_does_not_grow_with_the_products(self):
+        self.add_products(2)
+        url = reverse('products:product_list')
+        self.client.get(url, {'sort': 'name_asc'})
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url, {'sort': 'name_asc'})
+        self.add_products(8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url, {'sort': 'name_asc'})
+        self.assertEqual(len(response.context['products']), 10)
+        self.assertEqual(len(many), len(few))
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class ProductDetailQueryTests(TestCase):
+    def setUp(self):
+        category = ProductCategory.objects.create(name='Shawls')
+        self.product = Product.objects.create(name='Shawl', description='Pashmina', category=category,
+                                              price=Decimal('1000.00'), stock_quantity=3)
+        for i in range(3):
+            Product.objects.create(name=f'Related {i}', description='Wool', category=category, price=Decimal('500.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliveryCharge.objects.create(name='Standard', charge=Decimal('250.00'), is_default=True)
+            DeliveryCharge.objects.create(name='Express', charge=Decimal('500.00'))
+        rebuild_related_products()
+
+    def add_media_and_reviews(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_media_and_reviews(count)
+
+    def create_media_and_reviews(self, count):
+        for i in range(count):
+            ProductMedia.objects.create(product=self.product, media_file=SimpleUploadedFile(f'shawl{i}.jpg', b'jpg'))
+            Review.objects.create(product=self.product, author=f'Buyer {i}', comment='Lovely', rating=5, status='Approved')
+
+    def test_detail_page_query_count_does_not_grow(self):
+        self.add_media_and_reviews(1)
+        # Product (with category), media, approved reviews, related products, their media, delivery charges
+        with self.assertNumQueries(6):
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.context['review_count'], 1)
+
+        # Delivery charges are now held in memory
+        self.add_media_and_reviews(10)
+        with self.assertNumQueries(5):
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.context['review_count'], 11)
+        self.assertEqual(len(response.context['approved_reviews']), 11)
+        self.assertEqual(len(response.context['media_items']), 11)
+        self.assertEqual(response.context['default_delivery'].name, 'Standard')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SearchTests(TestCase):
+    def setUp(self):
+        if not search.index_available():
+            self.skipTest('SQLite was built without FTS5')
+        self.scarf = Product.objects.create(name='Silk scarf', description='Pashmina trim', price=Decimal('500.00'))
+        self.shawl = Product.objects.create(name='Pashmina shawl', description='Warm', price=Decimal('1000.00'))
+
+    def names(self, query):
+        return [product.name for product in search.search_products(Product.objects.all(), query)]
+
+    def test_name_matches_outrank_description_matches(self):
+        self.assertEqual(self.names('pashmina'), ['Pashmina shawl', 'Silk scarf'])
+        self.assertEqual(self.names('pash'), ['Pashmina shawl', 'Silk scarf'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.scarf.name = 'Cashmere wrap'
+        self.scarf.description = 'Soft'
+        self.scarf.save()
+        self.assertEqual(self.names('cashmere'), ['Cashmere wrap'])
+        self.assertEqual(self.names('silk'), [])
+        self.shawl.delete()
+        self.assertEqual(self.names('pashmina'), [])
+
+    def test_results_are_paged_past_any_limit(self):
+        Product.objects.bulk_create([
+            Product(name=f'Wool shawl {i}', slug=f'wool-shawl-{i}', description='Warm', price=Decimal('900.00'))
+            for i in range(230)
+        ])
+        search.rebuild_index()
+        self.assertEqual(search.search_products(Product.objects.all(), 'wool').count(), 230)
+        response = self.client.get(reverse('core:search'), {'q': 'wool', 'page': 10})
+        self.assertEqual(response.context['total_results'], 230)
+        self.assertEqual(len(response.context['product_results']), 230 - 9 * 24)
+
+    def test_migration_backfill_matches_the_signals(self):
+        Product.objects.create(
+            name='Kani stole', description='Woven', price=Decimal('800.00'), product_type='CASHMERE',
+            category=ProductCategory.objects.create(name='Stoles'),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, name, sku, body FROM {search.PRODUCT_INDEX_TABLE} ORDER BY rowid')
+            expected = cursor.fetchall()
+            cursor.execute(f'DELETE FROM {search.PRODUCT_INDEX_TABLE}')
+            migration = import_module('products.migrations.0014_search_index')
+            migration.backfill_product_index(apps, SimpleNamespace(connection=connection))
+            cursor.execute(f'SELECT rowid, name, sku, body FROM {search.PRODUCT_INDEX_TABLE} ORDER BY rowid')
+            self.assertEqual(cursor.fetchall(), expected)
+        self.assertEqual(self.names('cashmere'), ['Kani stole'])
+
+    def test_falls_back_to_icontains_without_the_index(self):
+        with mock.patch('products.search.index_available', return_value=False):
+            self.assertEqual(self.names('pashmina'), ['Pashmina shawl', 'Silk scarf'])
+            self.assertEqual(self.names('ilk sca'), ['Silk scarf'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShuffledListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = ProductCategory.objects.create(name='Shawls')
+        Product.objects.bulk_create([
+            Product(name=f'Shawl {i}', slug=f'shawl-{i}', description='Pashmina', price=Decimal('1000.00'),
+                    category=self.category if i % 2 else None)
+            for i in range(40)
+        ])
+        # Logged in, so the listing is rendered rather than served from the page cache
+        self.client.force_login(User.objects.create(username='shopper'))
+
+    def page_ids(self, page, **params):
+        response = self.client.get(reverse('products:product_list'), {'page': page, **params})
+        return [product.pk for product in response.context['products']]
+
+    def test_order_is_stable_within_a_session(self):
+        self.assertEqual(self.page_ids(1), self.page_ids(1))
+        self.assertEqual(self.page_ids(2), self.page_ids(2))
+
+    def test_pages_cover_every_product_once(self):
+        ids = self.page_ids(1) + self.page_ids(2) + self.page_ids(3)
+        self.assertEqual(sorted(ids), sorted(Product.objects.values_list('pk', flat=True)))
+        category_ids = self.page_ids(1, category='shawls') + self.page_ids(2, category='shawls')
+        self.assertEqual(sorted(category_ids), sorted(self.category.products.values_list('pk', flat=True)))
+
+    def test_order_is_cached_until_the_catalog_membership_changes(self):
+        ids = get_shuffled_ids('7:1', Product.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_shuffled_ids('7:1', Product.objects.all()), ids)
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Stole', description='Wool', price=Decimal('800.00'))
+        self.assertIn(product.pk, get_shuffled_ids('7:1', Product.objects.all()))
+
+    def test_only_sorted_listings_are_cached_as_pages(self):
+        self.client.logout()
+        url = reverse('products:product_list')
+        self.client.get(url)
+        # The shuffled page is rendered again from the cached order of its seed:
+        # session, the products of the page, their media, categories
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        visitor = self.client_class()
+        visitor.get(url, {'sort': 'price_asc'})
+        with self.assertNumQueries(0):
+            visitor.get(url, {'sort': 'price_asc'})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RelatedProductTests(TestCase):
+    def setUp(self):
+        shawls = ProductCategory.objects.create(name='Shawls')
+        scarves = ProductCategory.objects.create(name='Scarves')
+        self.shawl = Product.objects.create(name='Shawl', description='Pashmina', category=shawls, price=Decimal('1000.00'))
+        self.sibling = Product.objects.create(name='Wool Shawl', description='Wool', category=shawls, price=Decimal('500.00'))
+        self.retired = Product.objects.create(name='Old Shawl', description='Wool', category=shawls,
+                                              price=Decimal('500.00'), is_active=False)
+        self.scarf = Product.objects.create(name='Scarf', description='Silk', category=scarves, price=Decimal('300.00'))
+
+    def test_co_purchases_outrank_category_and_inactive_products_are_skipped(self):
+        user = User.objects.create(username='buyer')
+        for _ in range(2):
+            order = Order.objects.create(user=user, subtotal=0, tax=0, total=0)
+            OrderItem.objects.create(order=order, product=self.shawl, product_name='Shawl', product_price=0, quantity=1, subtotal=0)
+            OrderItem.objects.create(order=order, product=self.scarf, product_name='Scarf', product_price=0, quantity=1, subtotal=0)
+
+        rebuild_related_products()
+        related = list(self.shawl.related_products.values_list('related__name', flat=True))
+        self.assertEqual(related, ['Scarf', 'Wool Shawl'])
+
+    def test_saving_a_product_refreshes_its_recommendations(self):
+        self.scarf.category = self.shawl.category
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scarf.save()
+        self.assertEqual(list(self.scarf.related_products.values_list('related', flat=True)), [self.sibling.pk, self.shawl.pk])
+
+        # Price changes leave the recommendations alone
+        self.scarf.price = Decimal('350.00')
+        with mock.patch('products.signals.refresh_product_neighbourhood') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.scarf.save()
+        refresh.assert_not_called()
+
+    def test_migration_backfill_matches_the_rebuild(self):
+        rebuild_related_products()
+        expected = list(RelatedProduct.objects.values_list('product', 'related', 'rank', 'score'))
+        RelatedProduct.objects.all().delete()
+        migration = import_module('products.migrations.0020_backfill_related_products')
+        migration.backfill_related_products(apps, None)
+        self.assertEqual(list(RelatedProduct.objects.values_list('product', 'related', 'rank', 'score')), expected)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SlugAllocationTests(TestCase):
+    def create(self, name, **kwargs):
+        return Product.objects.create(name=name, description='Wool', price=Decimal('100.00'), **kwargs)
+
+    def test_duplicate_names_get_the_lowest_free_suffix(self):
+        slugs = [self.create('Shawl').slug for _ in range(3)]
+        self.assertEqual(slugs, ['shawl', 'shawl-1', 'shawl-2'])
+        # 'shawl-set' shares the prefix but is not a numbered shawl
+        self.create('Shawl Set')
+        Product.objects.filter(slug='shawl-1').delete()
+        self.assertEqual(self.create('Shawl').slug, 'shawl-1')
+        self.assertEqual(self.create('Shawl').slug, 'shawl-3')
+
+    def test_allocating_a_batch_of_names_takes_one_query(self):
+        self.create('Shawl')
+        self.create('Scarf')
+        allocator = SlugAllocator(Product, fallback='product')
+        names = ['Shawl', 'Scarf', 'Shawl', '!!!', 'Stole']
+        with self.assertNumQueries(1):
+            allocator.prefetch(allocator.base_slug(name) for name in names)
+            slugs = [allocator.allocate(name) for name in names]
+        self.assertEqual(slugs, ['shawl-1', 'scarf-1', 'shawl-2', 'product', 'stole'])
+
+    def test_repair_fills_in_missing_slugs(self):
+        self.create('Shawl')
+        blank = self.create('Shawl', slug='temporary')
+        Product.objects.filter(pk=blank.pk).update(slug='')
+        call_command('repair_product_slugs', stdout=StringIO())
+        blank.refresh_from_db()
+        self.assertEqual(blank.slug, 'shawl-1')
+
+
+def image_upload(name, size, mode='RGB'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+
+    def test_upload_is_rendered_at_every_width_without_scaling_up(self):
+        media = ProductMedia.objects.create(product=self.product, media_file=image_upload('shawl.png', (1600, 1200), 'RGBA'))
+        self.assertEqual(
+            {name: (rendition['width'], rendition['height']) for name, rendition in media.renditions.items()},
+            {'thumbnail': (200, 150), 'card': (600, 450), 'detail': (1200, 900)},
+        )
+        with media.media_file.storage.open(media.renditions['card']['webp']) as stored:
+            self.assertEqual(Image.open(stored).format, 'WEBP')
+
+        html = Template("{% load product_images %}{% responsive_image media 'card' alt='Shawl' %}").render(Context({'media': media}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(' 200w, ', html)
+        self.assertIn(f'src="{media.rendition_url("card")}"', html)
+
+        small = ProductMedia.objects.create(product=self.product, media_file=image_upload('small.png', (100, 80)))
+        self.assertEqual({rendition['width'] for rendition in small.renditions.values()}, {100})
+        self.assertEqual(small.srcset().count('w'), 1)
+
+    def test_videos_keep_the_original_file(self):
+        media = ProductMedia.objects.create(product=self.product, media_file=SimpleUploadedFile('clip.mp4', b'mp4'), is_video=True)
+        self.assertEqual(media.renditions, {})
+        self.assertEqual(media.rendition_url('card'), media.media_file.url)
+
+    def test_backfill_renders_media_without_renditions(self):
+        media = ProductMedia.objects.create(product=self.product, media_file=image_upload('shawl.png', (800, 800)))
+        ProductMedia.objects.filter(pk=media.pk).update(renditions={})
+        call_command('generate_media_renditions', workers=1, stdout=StringIO())
+        media.refresh_from_db()
+        self.assertEqual(media.renditions['card']['width'], 600)
+
+    def test_saves_without_the_file_loaded_do_not_render(self):
+        media = ProductMedia.objects.create(product=self.product, media_file=image_upload('shawl.png', (800, 800)))
+        with mock.patch('products.signals.generate_renditions') as render:
+            deferred = ProductMedia.objects.only('pk', 'caption').get(pk=media.pk)
+            deferred.caption = 'Front'
+            deferred.save()
+            render.assert_not_called()
+
+            deferred = ProductMedia.objects.defer('media_file').get(pk=media.pk)
+            deferred.media_file = image_upload('other.png', (300, 300))
+            deferred.save()
+            render.assert_called_once()
+
+    def test_storage_errors_are_not_mistaken_for_non_images(self):
+        media = ProductMedia.objects.create(product=self.product, media_file=image_upload('shawl.png', (800, 800)))
+        self.assertEqual(render_file('missing.png', media.pk), {})
+        with mock.patch.object(media.media_file.storage, 'save', side_effect=OSError('Disk full')):
+            with self.assertRaises(OSError):
+                render_file(media.media_file.name, media.pk)
+
+
+@override_settings(CACHES=TEST_CACHES, STORAGES=TEST_STORAGES)
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.enterContext(override_settings(MEDIA_UPLOAD_TEMP_DIR=temp_dir.name))
+        self.product = Product.objects.create(name='Shawl', description='Pashmina', price=Decimal('1000.00'))
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+
+    def send_chunk(self, chunk_url, data, start, size):
+        return self.client.post(chunk_url, data, content_type='application/octet-stream',
+                                headers={'Content-Range': f'bytes {start}-{start + len(data) - 1}/{size}'})
+
+    def test_chunks_are_assembled_and_processed_in_the_background(self):
+        data = image_upload('shawl.png', (800, 600)).read()
+        half = len(data) // 2
+        response = self.client.post(reverse('admin_dashboard:product_upload_start', args=[self.product.pk]),
+                                    {'filename': 'shawl.png', 'size': len(data)})
+        chunk_url = response.json()['chunk_url']
+
+        self.assertEqual(self.send_chunk(chunk_url, data[:half], 0, len(data)).json()['status'], 'uploading')
+        # A chunk that skips ahead is refused with the offset to resume from
+        response = self.send_chunk(chunk_url, data[half + 1:], half + 1, len(data))
+        self.assertEqual((response.status_code, response.json()['received']), (409, half))
+        self.assertEqual(self.send_chunk(chunk_url, data[half:], half, len(data)).json()['status'], 'queued')
+        self.assertFalse(self.product.media.exists())
+
+        # Rendered once, from the part file, not again by the save signal
+        with mock.patch('products.signals.generate_renditions') as generate:
+            self.assertEqual(process_uploads(), (1, 0))
+        generate.assert_not_called()
+        upload = MediaUpload.objects.get()
+        self.assertEqual((upload.status, upload.details['width']), ('done', 800))
+        self.assertEqual(upload.media.renditions['card']['width'], 600)
+        with upload.media.media_file.open() as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_form_uploads_are_queued_and_batched(self):
+        files = [image_upload(f'shawl{i}.png', (300, 300)) for i in range(3)]
+        files.append(SimpleUploadedFile('clip.mp4', b'mp4 data'))
+        self.client.post(reverse('admin_dashboard:product_media_add', args=[self.product.pk]), {'media_files': files})
+        self.assertEqual(MediaUpload.objects.filter(status='queued').count(), 4)
+
+        self.assertEqual(process_uploads(batch_size=10), (4, 0))
+        self.assertEqual(self.product.media.count(), 4)
+        video = self.product.media.get(is_video=True)
+        self.assertEqual(video.media_file.read(), b'mp4 data')
+
+    def queue_images(self, count, product=None):
+        files = [image_upload(f'shawl{i}.png', (300, 300)) for i in range(count)]
+        return [queue_file(product or self.product, file) for file in files]
+
+    def test_a_failing_upload_does_not_hold_back_the_batch(self):
+        rug = Product.objects.create(name='Rug', description='Wool', price=Decimal('5000.00'))
+        first, broken, _ = self.queue_images(2) + self.queue_images(1, rug)
+        video = queue_file(self.product, SimpleUploadedFile('clip.mp4', b'mp4 data'))
+        bad_probe = mock.patch('products.uploads.run_tool', return_value=b'not json')
+        original_store = uploads.store_upload
+
+        def store_upload(upload):
+            if upload.pk == broken.pk:
+                raise OSError('Disk full')
+            if upload.product_id == rug.pk:
+                # The product is deleted while the batch is processed, taking its uploads with it
+                Product.objects.filter(pk=rug.pk).delete()
+            return original_store(upload)
+
+        with bad_probe, mock.patch('products.uploads.store_upload', store_upload):
+            self.assertEqual(process_uploads(batch_size=10), (1, 2))
+        statuses = dict(MediaUpload.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {first.pk: 'done', broken.pk: 'failed', video.pk: 'failed'})
+        self.assertIn('Disk full', MediaUpload.objects.get(pk=broken.pk).error)
+        self.assertEqual(self.product.media.count(), 1)
+
+    def test_uploads_are_claimed_by_one_worker_only(self):
+        # Both workers read the same candidates before either claims them
+        pks = [upload.pk for upload in self.queue_images(3)]
+        self.assertEqual(len(uploads.claim(pks)), 3)
+        self.assertEqual(uploads.claim(pks), [])
+
+    def test_a_stale_claim_finished_elsewhere_is_rolled_back(self):
+        upload, = self.queue_images(1)
+        claimed, = uploads.claim([upload.pk])
+        # The claim went stale and another worker took the upload over
+        MediaUpload.objects.filter(pk=upload.pk).update(claim_token='other')
+        self.assertEqual(uploads.process_batch([claimed]), (0, 0))
+        self.assertFalse(ProductMedia.objects.exists())
+        self.assertEqual(MediaUpload.objects.get(pk=upload.pk).status, 'processing')
@@ -0,0 +1,311 @@
+"""
+Chunked product media uploads.
+
+The dashboard uploads each file in chunks of at most ``CHUNK_SIZE`` bytes.
+``start_upload`` creates a ``MediaUpload`` row for the file. ``write_chunk``
+streams each chunk from the request straight into a part file under
+``MEDIA_UPLOAD_TEMP_DIR``, so no request holds a whole file in memory. A chunk
+must start where the received bytes end, so a client whose request failed
+asks for ``received`` and resumes from there. Once every byte is in, the
+upload is queued.
+
+``process_media_uploads`` drains the queue in the background. It claims a
+batch of queued uploads with one UPDATE that only matches rows still queued,
+stamped with a token of its own, so two workers never process the same
+upload, even on SQLite. It then handles each upload on its own. It probes
+the file: Pillow reads images, and ``ffprobe`` reads the dimensions and
+duration of videos. It moves the file into media storage, and creates the
+ProductMedia row and marks the upload done in one transaction, so an upload
+is either done with its media or can be processed again. A failure fails
+that upload only. Once committed, it renders the image renditions of
+``products.images``. For videos, it renders them from a poster frame taken
+with ``ffmpeg``. Media whose renditions could not be rendered keep the
+original file until ``generate_media_renditions`` runs.
+Without ``ffmpeg`` on the PATH, videos are stored without poster or probe
+details. The dashboard polls ``MediaUpload.status`` and ``received`` to show
+progress.
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from core.cache import CATALOG, bump_version
+from .images import render_image
+from .models import MediaUpload, ProductMedia
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+# Read from the request and copied to disk this much at a time
+BUFFER_SIZE = 64 * 1024
+# Uploads claimed by a worker that died are handed out again after this long
+CLAIM_TIMEOUT = timedelta(minutes=30)
+PROBE_TIMEOUT = 60
+POSTER_OFFSET_SECONDS = 1
+
+
+class ChunkRejected(Exception):
+    """Raised when a chunk does not continue the upload where it left off"""
+
+    def __init__(self, message, received):
+        self.received = received
+        super().__init__(message)
+
+
+def get_temp_dir():
+    directory = getattr(settings, 'MEDIA_UPLOAD_TEMP_DIR', None) or os.path.join(tempfile.gettempdir(), 'media_uploads')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def part_path(upload):
+    return os.path.join(get_temp_dir(), f'{upload.pk}.part')
+
+
+def is_video_file(filename):
+    content_type, _ = mimetypes.guess_type(filename)
+    return bool(content_type and content_type.startswith('video/'))
+
+
+def start_upload(product, filename, size, user=None):
+    """Create the MediaUpload a file's chunks are written to"""
+    filename = os.path.basename(filename)[:255] or 'upload'
+    upload = MediaUpload.objects.create(
+        product=product,
+        uploaded_by=user,
+        filename=filename,
+        size=size,
+        is_video=is_video_file(filename),
+        status='uploading' if size else 'queued',
+    )
+    # Empty files have no chunks, create the part file now
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def write_chunk(upload, start, stream, length):
+    """
+    Copy ``length`` bytes from ``stream`` into the upload at offset ``start``.
+
+    Raises ChunkRejected unless the chunk starts at ``upload.received`` and
+    fits in the file. Queues the upload once its last byte is written.
+    """
+    if upload.status != 'uploading':
+        raise ChunkRejected('The upload is complete.', upload.received)
+    if start != upload.received or length <= 0 or length > CHUNK_SIZE or start + length > upload.size:
+        raise ChunkRejected(f'Expected a chunk of at most {CHUNK_SIZE} bytes at offset {upload.received}.', upload.received)
+
+    written = 0
+    with open(part_path(upload), 'r+b' if start else 'wb') as part:
+        part.seek(start)
+        while written < length:
+            buffer = stream.read(min(BUFFER_SIZE, length - written))
+            if not buffer:
+                break
+            part.write(buffer)
+            written += len(buffer)
+        part.truncate()
+    if written != length:
+        raise ChunkRejected(f'Received {written} of {length} bytes.', upload.received)
+
+    received = start + length
+    status = 'queued' if received == upload.size else 'uploading'
+    # Only the request that wrote from the current offset moves it forward
+    if not MediaUpload.objects.filter(pk=upload.pk, received=start, status='uploading').update(
+        received=received, status=status, updated_at=timezone.now()
+    ):
+        upload.refresh_from_db(fields=['received', 'status'])
+        raise ChunkRejected('Another chunk was written at this offset.', upload.received)
+    upload.received, upload.status = received, status
+    return upload
+
+
+def queue_file(product, uploaded_file, user=None):
+    """Queue a file that arrived in one piece, e.g. a regular form upload"""
+    upload = start_upload(product, uploaded_file.name, uploaded_file.size, user)
+    with open(part_path(upload), 'wb') as part:
+        for chunk in uploaded_file.chunks(BUFFER_SIZE):
+            part.write(chunk)
+    MediaUpload.objects.filter(pk=upload.pk).update(received=upload.size, status='queued')
+    return upload
+
+
+def claim(pks, now=None):
+    """
+    Claim the uploads of ``pks`` that are still queued and return them.
+    Uploads another worker claimed in the meantime are left out.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    MediaUpload.objects.filter(pk__in=pks, status='queued').update(status='processing', claimed_at=now, claim_token=token)
+    return list(MediaUpload.objects.filter(claim_token=token, status='processing').order_by('created_at', 'pk'))
+
+
+def claim_batch(batch_size):
+    """Claim up to ``batch_size`` queued uploads and return them"""
+    now = timezone.now()
+    MediaUpload.objects.filter(status='processing', claimed_at__lt=now - CLAIM_TIMEOUT).update(
+        status='queued', claim_token=''
+    )
+    with transaction.atomic():
+        pks = list(
+            MediaUpload.objects.select_for_update(skip_locked=True)
+            .filter(status='queued').order_by('created_at', 'pk').values_list('pk', flat=True)[:batch_size]
+        )
+        return claim(pks, now)
+
+
+def run_tool(*args):
+    """Run ffmpeg or ffprobe, returns its output or None when it is missing or fails"""
+    if not shutil.which(args[0]):
+        return None
+    try:
+        return subprocess.run(args, capture_output=True, check=True, timeout=PROBE_TIMEOUT).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"{args[0]} failed on {args[-1]}: {e}")
+        return None
+
+
+def probe_video(path):
+    """Format, dimensions and duration of a video, or {} without ffprobe"""
+    output = run_tool(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+        'stream=width,height:format=duration,format_name', '-of', 'json', path,
+    )
+    if not output:
+        return {}
+    probed = json.loads(output)
+    stream = (probed.get('streams') or [{}])[0]
+    details = {'format': probed.get('format', {}).get('format_name', '')}
+    if stream.get('width'):
+        details.update(width=stream['width'], height=stream['height'])
+    if probed.get('format', {}).get('duration'):
+        details['duration'] = float(probed['format']['duration'])
+    return details
+
+
+def render_video_poster(path, name, media_pk):
+    """Renditions of a frame near the start of the video, or {} without ffmpeg"""
+    with tempfile.TemporaryDirectory() as directory:
+        poster = os.path.join(directory, 'poster.jpg')
+        if run_tool('ffmpeg', '-v', 'error', '-ss', str(POSTER_OFFSET_SECONDS), '-i', path,
+                    '-frames:v', '1', '-y', poster) is None or not os.path.exists(poster):
+            return {}
+        with open(poster, 'rb') as source:
+            return render_image(source, name, media_pk)
+
+
+def probe_image(path):
+    try:
+        with Image.open(path) as image:
+            return {'format': image.format, 'width': image.width, 'height': image.height}
+    except (UnidentifiedImageError, OSError):
+        return {}
+
+
+def finish(upload, **fields):
+    """Record the outcome of an upload, unless its claim went stale and another worker took it over"""
+    if not MediaUpload.objects.filter(pk=upload.pk, claim_token=upload.claim_token).update(
+        claim_token='', updated_at=timezone.now(), **fields
+    ):
+        raise RuntimeError('The upload was claimed by another worker.')
+
+
+def store_upload(upload):
+    """Probe and store a claimed upload, then create its ProductMedia and mark it done together"""
+    path = part_path(upload)
+    details = probe_video(path) if upload.is_video else probe_image(path)
+    media = ProductMedia(product_id=upload.product_id, is_video=upload.is_video)
+    # render_upload() renders them from the part file once this commits
+    media.render_renditions = False
+    with open(path, 'rb') as part:
+        media.media_file.save(upload.filename, File(part), save=False)
+    try:
+        with transaction.atomic():
+            media.save()
+            finish(upload, status='done', media=media, details=details, error='')
+    except Exception:
+        media.media_file.delete(save=False)
+        raise
+    return media
+
+
+def render_upload(upload, media):
+    """Render and save the renditions of freshly stored media"""
+    path = part_path(upload)
+    if upload.is_video:
+        renditions = render_video_poster(path, media.media_file.name, media.pk)
+    else:
+        with open(path, 'rb') as part:
+            renditions = render_image(part, media.media_file.name, media.pk)
+    ProductMedia.objects.filter(pk=media.pk).update(renditions=renditions)
+
+
+def process_batch(batch):
+    """Turn a claimed batch of uploads into ProductMedia one by one, returns ``(done, failed)`` counts"""
+    done = failed = 0
+    for upload in batch:
+        try:
+            media = store_upload(upload)
+        except Exception as e:
+            logger.error(f"Could not process upload {upload.pk} ({upload.filename}): {e}")
+            try:
+                finish(upload, status='failed', error=str(e))
+            except Exception:
+                # Deleted with its product, or taken over by another worker
+                continue
+            failed += 1
+        else:
+            done += 1
+            try:
+                render_upload(upload, media)
+            except Exception as e:
+                logger.error(f"Could not render upload {upload.pk} ({upload.filename}): {e}")
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+    return done, failed
+
+
+def process_uploads(batch_size=20, max_batches=None):
+    """Process queued uploads batch by batch, returns ``(done, failed)`` counts"""
+    done = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+        batches += 1
+        batch_done, batch_failed = process_batch(batch)
+        done += batch_done
+        failed += batch_failed
+    if done:
+        bump_version(CATALOG)
+    return done, failed
+
+
+def sweep_abandoned_uploads(older_than=timedelta(days=1)):
+    """Delete uploads that stopped receiving chunks, and their part files, returns how many"""
+    abandoned = list(MediaUpload.objects.filter(
+        status='uploading', updated_at__lt=timezone.now() - older_than
+    ).values_list('pk', flat=True))
+    for pk in abandoned:
+        try:
+            os.remove(os.path.join(get_temp_dir(), f'{pk}.part'))
+        except FileNotFoundError:
+            pass
+    MediaUpload.objects.filter(pk__in=abandoned).delete()
+    return len(abandoned)
@@ -1,17 +1,41 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.http import urlencode
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
+from django.utils.html import strip_tags
 from django.views.generic import ListView, DetailView
-from django.db.models import Avg, Q
+from django.utils.decorators import method_decorator
+from django.db.models import Prefetch
 from django.contrib import messages
 from django.core.serializers.json import DjangoJSONEncoder
 import json
-from .models import Product, ProductCategory, Review
+from .models import Product, ProductCategory, ProductMedia, Review
 from .forms import DealRequestForm
-from core.models import DeliveryCharge
+from .search import search_products
+from .shuffle import get_shuffle_seed, shuffle_queryset
+from core.cache import CATALOG, cache_public_page
+from core.delivery import get_default_delivery, get_delivery_options
 
+SORT_ORDERS = {
+    'price_asc': 'price',
+    'price_desc': '-price',
+    'name_asc': 'name',
+    'name_desc': '-name',
+}
+
+
+def is_shuffled_listing(request):
+    """
+    Listings without a sort order or search are shuffled per visitor. Their
+    pages are not cached whole, ``products.shuffle`` caches the order of each
+    seed and a page only loads its own products.
+    """
+    return not request.GET.get('q') and request.GET.get('sort') not in SORT_ORDERS
+
+
+@method_decorator(cache_public_page([CATALOG], unless=is_shuffled_listing), name='dispatch')
 class ProductListView(ListView):
     model = Product
     template_name = 'products/product_list.html'
@@ -19,16 +43,12 @@ class ProductListView(ListView):
     paginate_by = 15
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().with_primary_media()
         
         # Searching
         search_query = self.request.GET.get('q')
         if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(sku__icontains=search_query)
-            )
+            queryset = search_products(queryset, search_query)
 
         # Filtering
         category_slug = self.request.GET.get('category')
@@ -41,17 +61,13 @@ class ProductListView(ListView):
 
         # Sorting
         sort_by = self.request.GET.get('sort')
-        if sort_by == 'price_asc':
-            queryset = queryset.order_by('price')
-        elif sort_by == 'price_desc':
-            queryset = queryset.order_by('-price')
-        elif sort_by == 'name_asc':
-            queryset = queryset.order_by('name')
-        elif sort_by == 'name_desc':
-            queryset = queryset.order_by('-name')
-        else:
-            # If no sort order is specified, shuffle the products.
-            queryset = queryset.order_by('?')
+        if sort_by in SORT_ORDERS:
+            queryset = queryset.order_by(SORT_ORDERS[sort_by])
+        elif not search_query:
+            # If no sort order is specified, shuffle the products per visitor.
+            # Search results keep their relevance order instead.
+            filter_key = urlencode({'category': category_slug or '', 'product_type': product_type or ''})
+            queryset = shuffle_queryset(self.request, queryset, filter_key)
         
         return queryset
 
@@ -63,41 +79,50 @@ class ProductListView(ListView):
         context['current_product_type'] = self.request.GET.get('product_type', '')
         context['current_sort'] = self.request.GET.get('sort', '')
         context['search_query'] = self.request.GET.get('q', '')
+        seed = get_shuffle_seed(self.request) if is_shuffled_listing(self.request) else ''
+        context['grid_cache_vary'] = f'{self.request.get_full_path()}:{seed}'
         return context
 
+@method_decorator(cache_public_page([CATALOG]), name='dispatch')
 class ProductDetailView(DetailView):
     model = Product
     template_name = 'products/product_detail.html'
     context_object_name = 'product'
 
+    def get_queryset(self):
+        # Review statistics are denormalized on the product, so the page needs one product
+        # fetch plus one query per prefetched relation
+        return Product.objects.select_related('category').prefetch_related(
+            Prefetch('media', queryset=ProductMedia.objects.order_by('pk'), to_attr='media_items'),
+            Prefetch('reviews', queryset=Review.objects.filter(status='Approved'), to_attr='approved_reviews'),
+        )
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
-        approved_reviews = product.reviews.filter(status='Approved')
+        product = self.object
         
         # Add integer rating for template loop
-        for review in approved_reviews:
+        for review in product.approved_reviews:
             review.rating_int = int(round(review.rating))
-        context['approved_reviews'] = approved_reviews
-        context['review_count'] = approved_reviews.count()
+        context['approved_reviews'] = product.approved_reviews
+        context['review_count'] = product.review_count
         context['deal_form'] = DealRequestForm()
-        
-        # Calculate average rating
-        average_rating = approved_reviews.aggregate(Avg('rating'))['rating__avg']
-        context['average_rating'] = average_rating
-        context['average_rating_int'] = int(round(average_rating)) if average_rating else 0
+        context['average_rating'] = product.average_rating
+        context['average_rating_int'] = product.average_rating_int
+        context['rating_breakdown'] = product.get_rating_breakdown()
 
-        media_urls = [media.media_file.url for media in product.media.all()]
+        context['media_items'] = product.media_items
+        media_urls = [media.media_file.url for media in product.media_items]
         context['media_urls_json'] = json.dumps(media_urls, cls=DjangoJSONEncoder)
 
-        if product.category:
-            context['related_products'] = Product.objects.filter(category=product.category).exclude(pk=product.pk)[:4]
-        else:
-            context['related_products'] = Product.objects.none()
+        # Precomputed by products.recommendations, read in rank order from the (product, rank) index
+        context['related_products'] = Product.objects.with_primary_media().filter(
+            recommended_for__product=product
+        ).order_by('recommended_for__rank')[:4]
 
-        # Add delivery charges
-        context['delivery_charges'] = DeliveryCharge.objects.filter(is_active=True).order_by('charge')
-        context['default_delivery'] = DeliveryCharge.get_default()
+        # Served from the in-process delivery table, without a query
+        context['delivery_charges'] = get_delivery_options()
+        context['default_delivery'] = get_default_delivery()
 
         return context
 
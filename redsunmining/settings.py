@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -95,13 +96,15 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'newsletter.context_processors.newsletter_form',
                 'core.context_processors.cart_context',
+                'core.context_processors.cache_versions',
             ],
         },
     },
 ]
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    # ModelBackend with logins by username or case-insensitive email
+    'accounts.backends.EmailOrUsernameBackend',
     # 'allauth.account.auth_backends.AuthenticationBackend',
 ]
 
@@ -120,10 +123,29 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file test database lets concurrency tests open one connection per thread
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# A file cache is shared by every worker process, so a version bump in one of them
+# (see core/cache.py) expires cached pages for all. Its incr is not atomic, so blog
+# view counts (blog/counters.py) are only exact on Redis or Memcached. Tests switch
+# to a private memory cache with override_settings.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'oraagh_cache')),
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+PAGE_CACHE_TIMEOUT = 300  # Seconds anonymous pages are served from the cache
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -168,6 +190,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Chunked media uploads are assembled here before products.uploads moves them into MEDIA_ROOT
+MEDIA_UPLOAD_TEMP_DIR = os.getenv('MEDIA_UPLOAD_TEMP_DIR', os.path.join(BASE_DIR, 'media_uploads'))
 
 # Channels
 ASGI_APPLICATION = 'redsunmining.routing.application'
@@ -175,7 +199,18 @@ ASGI_APPLICATION = 'redsunmining.routing.application'
 # EMAIL CONFIGURATION
 # ------------------------------------------------------------------------------
 ADMIN_EMAIL = 'info@oraagh.com'
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Mail sent by the site is queued in the outbox (core.mail) and delivered by
+# `manage.py process_email_outbox` through OUTBOX_DELIVERY_BACKEND.
+EMAIL_BACKEND = 'core.mail.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+# Newsletter campaigns (`manage.py send_newsletter_campaigns`)
+NEWSLETTER_CHUNK_SIZE = 200  # Subscribers per SMTP connection
+NEWSLETTER_SEND_RATE = 10  # Messages per second
+
+# Abandoned carts (`manage.py track_abandoned_carts`)
+ABANDONED_CART_TRACKING_DELAY = 5  # Minutes a changed cart must be idle before it is snapshotted
+
 EMAIL_HOST = 'mail.oraagh.com'
 EMAIL_PORT = 465
 